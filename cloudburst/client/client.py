@@ -17,6 +17,7 @@ import logging
 
 import zmq
 from anna.client import AnnaTcpClient
+from anna.lattices import SetLattice
 
 from cloudburst.shared.function import CloudburstFunction
 from cloudburst.shared.future import CloudburstFuture
@@ -27,7 +28,8 @@ from cloudburst.shared.proto.cloudburst_pb2 import (
     FunctionCall,
     GenericResponse,
     NORMAL,  # Cloudburst consistency modes
-    MULTIEXEC # Cloudburst's execution types
+    MULTIEXEC, # Cloudburst's execution types
+    NO_RESOURCES  # Cloudburst's error types
 )
 from cloudburst.shared.proto.shared_pb2 import StringSet
 from cloudburst.shared.serializer import Serializer
@@ -36,14 +38,31 @@ from cloudburst.shared.utils import (
     DAG_CALL_PORT,
     DAG_CREATE_PORT,
     DAG_DELETE_PORT,
+    DEFAULT_PRIORITY,
     FUNC_CALL_PORT,
     FUNC_CREATE_PORT,
-    LIST_PORT
+    LIST_PORT,
+    PURE_FUNCS_KEY,
+    QOS_ARGS,
+    RETRY_AFTER_PREFIX
 )
 
 serializer = Serializer()
 
 
+class CloudburstOverloadedError(RuntimeError):
+    '''
+    Raised when the scheduler rejects a call because the system is overloaded.
+    retry_after is how long the scheduler asks us to wait before retrying, in
+    seconds.
+    '''
+
+    def __init__(self, retry_after):
+        super().__init__('Scheduler is overloaded; retry after %.3f seconds.'
+                         % (retry_after))
+        self.retry_after = retry_after
+
+
 class CloudburstConnection():
     def __init__(self, func_addr, ip, tid=0, local=False):
         '''
@@ -124,7 +143,7 @@ class CloudburstConnection():
 
         return CloudburstFunction(name, self, self.kvs_client)
 
-    def register(self, function, name):
+    def register(self, function, name, pure=False):
         '''
         Registers a new function or class with the system. The returned object
         can be called like a regular Python function, which returns a Cloudburst
@@ -133,8 +152,19 @@ class CloudburstConnection():
 
         function: The function object that we are registering.
         name: A unique name for the function to be stored with in the system.
+        pure: Whether the function always returns the same result for the same
+        arguments, without side effects. Identical calls to a pure function
+        (or to a DAG of pure functions) that arrive while one is in flight
+        share its result rather than running again.
         '''
 
+        # Function is defined in the common protobufs, so pure functions are
+        # recorded in a set in the KVS instead, which the schedulers read.
+        # SetLattices merge, so we do not overwrite other clients' functions.
+        if pure:
+            self.kvs_client.put(PURE_FUNCS_KEY,
+                                SetLattice({bytes(name, 'utf-8')}))
+
         func = Function()
         func.name = name
         func.body = serializer.dump(function)
@@ -212,7 +242,8 @@ class CloudburstConnection():
 
     def call_dag(self, dname, arg_map, direct_response=False,
                  consistency=NORMAL, output_key=None, client_id=None,
-                 dry_run=False, continuation=None):
+                 dry_run=False, continuation=None, deadline=None,
+                 priority=None, tenant=None):
         '''
         Issues a new request to execute the DAG. Returns a CloudburstFuture that
 
@@ -226,6 +257,14 @@ class CloudburstConnection():
         output_key: The KVS key in which to store the result of thie DAG.
         client_id: An optional ID associated with an individual client across
         requests; this is used for causal metadata.
+        deadline: An optional number of seconds within which the DAG has to
+        finish. Executors run requests with earlier deadlines first, and fail
+        requests whose deadline has passed instead of running them.
+        priority: An optional priority class. Executors run requests with a
+        higher priority class before any others.
+        tenant: An optional name of the tenant the call belongs to. Tenants
+        get a share of the executors in proportion to their weights. By
+        default, all calls to a DAG belong to a tenant named after the DAG.
         '''
         dc = DagCall()
         dc.name = dname
@@ -246,6 +285,13 @@ class CloudburstConnection():
             al = dc.function_args[fname]
             al.values.extend(args)
 
+        if deadline is not None or priority is not None or tenant:
+            qos = [deadline if deadline is not None else 0,
+                   priority if priority is not None else DEFAULT_PRIORITY,
+                   tenant if tenant else '']
+            dc.function_args[QOS_ARGS].values.extend(
+                [serializer.dump(arg, serialize=False) for arg in qos])
+
         if direct_response:
             dc.response_address = self.response_address
 
@@ -280,6 +326,8 @@ class CloudburstConnection():
                 return CloudburstFuture(r.response_id, self.kvs_client,
                                      serializer)
         else:
+            _check_overloaded(r)
+
             logging.error('Scheduler returned unexpected error: \n' + str(r))
             raise RuntimeError(str(r.error))
 
@@ -326,6 +374,9 @@ class CloudburstConnection():
         r = GenericResponse()
         r.ParseFromString(self.func_call_sock.recv())
 
+        if not r.success:
+            _check_overloaded(r)
+
         self.rid += 1
         return r.response_id
 
@@ -351,3 +402,10 @@ class CloudburstConnection():
         flist = StringSet()
         flist.ParseFromString(self.list_sock.recv())
         return flist.keys
+
+
+def _check_overloaded(response):
+    if (response.error == NO_RESOURCES and
+            response.response_id.startswith(RETRY_AFTER_PREFIX)):
+        retry_after = float(response.response_id[len(RETRY_AFTER_PREFIX):])
+        raise CloudburstOverloadedError(retry_after)
@@ -40,7 +40,8 @@ def run(cloudburst_client, num_requests, sckt):
         inp = [inp1, inp2, inp3]
         return np.mean(inp, axis=0)
 
-    cloud_prep = cloudburst_client.register(preprocess, 'preprocess')
+    cloud_prep = cloudburst_client.register(preprocess, 'preprocess',
+                                            pure=True)
     cloud_sqnet1 = cloudburst_client.register(sqnet, 'sqnet1')
     cloud_sqnet2 = cloudburst_client.register(sqnet, 'sqnet2')
     cloud_sqnet3 = cloudburst_client.register(sqnet, 'sqnet3')
@@ -0,0 +1,114 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+'''
+Measures how many DAG calls per second a scheduler can serve. Many client
+processes issue calls to a one-function DAG as fast as they can, and only wait
+for the scheduler's response (not for the DAG's result), so this measures the
+scheduler's call handling rather than the executors.
+
+To compare worker counts, restart the scheduler with each value of the
+`workers` option in its configuration, and run:
+
+    python -m cloudburst.server.benchmarks.scheduler_workers \
+        <scheduler-ip> <workers> [duration] [clients ...]
+
+The worker count is only used to label the results. The DAG is registered if
+it does not exist yet.
+'''
+
+import multiprocessing
+import sys
+import time
+
+import zmq
+
+from cloudburst.client.client import CloudburstConnection
+from cloudburst.shared.proto.cloudburst_pb2 import DagCall, GenericResponse
+from cloudburst.shared.utils import DAG_CALL_PORT
+
+DAG_NAME = 'scheduler_workers'
+FUNCTION_NAME = 'scheduler_workers_noop'
+
+
+def create(scheduler_ip):
+    cloudburst = CloudburstConnection(scheduler_ip, scheduler_ip)
+
+    def noop(cloudburst):
+        return 0
+
+    cloudburst.register(noop, FUNCTION_NAME)
+    cloudburst.register_dag(DAG_NAME, [FUNCTION_NAME], [])
+
+
+def _client(scheduler_ip, duration, results):
+    context = zmq.Context(1)
+    sckt = context.socket(zmq.REQ)
+    sckt.connect('tcp://%s:%d' % (scheduler_ip, DAG_CALL_PORT))
+
+    call = DagCall()
+    call.name = DAG_NAME
+    serialized = call.SerializeToString()
+
+    response = GenericResponse()
+    count = 0
+    end = time.time() + duration
+    while time.time() < end:
+        sckt.send(serialized)
+        response.ParseFromString(sckt.recv())
+
+        if response.success:
+            count += 1
+
+    results.put(count)
+
+
+def run(scheduler_ip, num_clients, duration):
+    '''
+    Returns the number of successful calls per second that num_clients client
+    processes got through over the given duration, in seconds.
+    '''
+    results = multiprocessing.Queue()
+    clients = [multiprocessing.Process(target=_client,
+                                       args=(scheduler_ip, duration, results))
+               for _ in range(num_clients)]
+
+    for client in clients:
+        client.start()
+
+    total = sum(results.get() for _ in clients)
+
+    for client in clients:
+        client.join()
+
+    return total / duration
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print('Usage: %s scheduler-ip workers [duration] [clients ...]' %
+              (sys.argv[0]))
+        sys.exit(1)
+
+    scheduler_ip = sys.argv[1]
+    workers = int(sys.argv[2])
+    duration = float(sys.argv[3]) if len(sys.argv) > 3 else 10
+    client_counts = [int(c) for c in sys.argv[4:]] or [1, 2, 4, 8, 16]
+
+    create(scheduler_ip)
+
+    print('workers\tclients\tcalls/sec')
+    for num_clients in client_counts:
+        throughput = run(scheduler_ip, num_clients, duration)
+        print('%d\t%d\t%.1f' % (workers, num_clients, throughput))
@@ -20,6 +20,7 @@ import time
 from datetime import datetime
 
 import cloudpickle as cp
+from cloudburst.client.client import CloudburstOverloadedError
 from cloudburst.shared.reference import CloudburstReference
 
 from cloudburst.server.benchmarks.ZipfGenerator import ZipfGenerator
@@ -141,6 +142,10 @@ def run(cloudburst_client, num_requests, create, redis, dag_name, db_size, tx_si
                 try:
                     res = cloudburst_client.call_dag(dag_name, request, consistency=MULTI, output_key=output_key, direct_response=True)
                     flag = False
+                except CloudburstOverloadedError as e:
+                    # The scheduler is shedding load, so we back off for as
+                    # long as it asked us to.
+                    time.sleep(e.retry_after)
                 except Exception as e:
                     logging.info(e)
                     continue
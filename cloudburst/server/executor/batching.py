@@ -0,0 +1,175 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from collections import deque
+import time
+
+# The largest batch we will ever form, regardless of what the runtime model
+# suggests.
+BATCH_SIZE_LIMIT = 20
+
+# The longest we will ever hold a ready request while waiting for more
+# requests to arrive, in seconds.
+LINGER_LIMIT = 0.05
+
+# The number of recent batches (and arrivals) the runtime model is fit over.
+SAMPLE_WINDOW = 50
+
+# We stop growing batches once the fixed per-batch overhead, amortized over
+# the batch, is less than this fraction of the marginal cost of one request.
+AMORTIZATION_RATIO = 0.1
+
+
+class AdaptiveBatcher():
+    '''
+    Forms batches for a single batching-enabled function. Ready requests are
+    added as they become runnable, and take() hands them back once either the
+    current batch size is reached or the oldest request has lingered long
+    enough.
+
+    The batch size and linger time are tuned online from a linear model of
+    batch runtime versus batch size: runtime = fixed + per_item * size. Batches
+    grow until the fixed overhead is amortized (or the latency target would be
+    exceeded), and requests linger at most as long as one batch's fixed
+    overhead. If requests arrive too slowly to fill the batch within that time,
+    we run what we have right away, so low load does not add latency.
+    '''
+
+    def __init__(self, max_batch_size=BATCH_SIZE_LIMIT,
+                 max_linger=LINGER_LIMIT, target_latency=None):
+        # The upper bounds on the tuned parameters for this function.
+        self.max_batch_size = max_batch_size
+        self.max_linger = max_linger
+
+        # An optional upper bound on how long a single batch may run.
+        self.target_latency = target_latency
+
+        # The currently tuned parameters. We start with no lingering until we
+        # have measured anything.
+        self.batch_size = max_batch_size
+        self.linger = 0.0
+
+        # The ready requests, in the order in which they became ready, and the
+        # time at which each of them did.
+        self.pending = deque()
+
+        # (batch size, runtime) pairs for recently executed batches.
+        self.samples = deque(maxlen=SAMPLE_WINDOW)
+
+        # The times at which recent requests became ready, used to estimate the
+        # arrival rate.
+        self.arrivals = deque(maxlen=SAMPLE_WINDOW)
+
+    def __len__(self):
+        return len(self.pending)
+
+    def __contains__(self, item):
+        return any(p[0] == item for p in self.pending)
+
+    def add(self, item, now=None):
+        if now is None:
+            now = time.time()
+
+        self.pending.append((item, now))
+        self.arrivals.append(now)
+
+    def remove(self, item):
+        self.pending = deque(filter(lambda p: p[0] != item, self.pending))
+
+    def deadline(self):
+        '''
+        Returns the time at which the oldest pending request must be run, or
+        None if there is nothing pending.
+        '''
+        if len(self.pending) == 0:
+            return None
+
+        return self.pending[0][1] + self.linger
+
+    def take(self, now=None):
+        '''
+        Returns the next batch to run, or an empty list if we should keep
+        waiting for more requests.
+        '''
+        if len(self.pending) == 0:
+            return []
+
+        if now is None:
+            now = time.time()
+
+        if (len(self.pending) < self.batch_size and now < self.deadline()
+                and self._expect_more(now)):
+            return []
+
+        batch = []
+        while len(self.pending) > 0 and len(batch) < self.batch_size:
+            batch.append(self.pending.popleft()[0])
+
+        return batch
+
+    def record(self, size, runtime):
+        '''
+        Records how long a batch of the given size took to run and re-tunes
+        the batch size and linger time.
+        '''
+        self.samples.append((size, runtime))
+
+        fixed, per_item = self._fit()
+
+        if per_item > 0:
+            size = fixed / (AMORTIZATION_RATIO * per_item)
+            if self.target_latency is not None:
+                size = min(size, (self.target_latency - fixed) / per_item)
+        else:
+            # Runtime does not grow with the batch size, so bigger is better.
+            size = self.max_batch_size
+
+        self.batch_size = int(max(1, min(self.max_batch_size, size)))
+
+        # Holding a request for up to one batch's fixed overhead at most
+        # doubles its latency, while saving that overhead for every request
+        # that joins it.
+        self.linger = max(0.0, min(self.max_linger, fixed))
+
+    def _expect_more(self, now):
+        # If requests arrive so slowly that we do not expect the next one to
+        # show up before the oldest pending request's deadline, waiting only
+        # adds latency.
+        if len(self.arrivals) < 2:
+            return False
+
+        interval = (self.arrivals[-1] - self.arrivals[0]) / \
+            (len(self.arrivals) - 1)
+        return now + interval < self.deadline()
+
+    def _fit(self):
+        # A least-squares fit of runtime against batch size.
+        n = len(self.samples)
+        mean_size = sum(s for s, _ in self.samples) / n
+        mean_runtime = sum(r for _, r in self.samples) / n
+
+        variance = sum((s - mean_size) ** 2 for s, _ in self.samples)
+        if variance == 0:
+            # We have only seen one batch size, so we cannot tell the fixed
+            # and per-request costs apart. We split the runtime evenly between
+            # the two, which lets batches grow past the size we have seen so
+            # far; the next differently sized batch refines the fit.
+            return mean_runtime / 2, mean_runtime / (2 * mean_size)
+
+        covariance = sum((s - mean_size) * (r - mean_runtime)
+                         for s, r in self.samples)
+        per_item = max(0.0, covariance / variance)
+        fixed = max(0.0, mean_runtime - per_item * mean_size)
+
+        return fixed, per_item
@@ -0,0 +1,102 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import random
+
+from cloudburst.server import utils as sutils
+
+# How many more outstanding requests than the least backlogged replica a
+# replica on our own node may have and still be picked, since the result we
+# send it does not have to leave the node.
+LOCALITY_SLACK = 2
+
+
+class LateBinder():
+    '''
+    Picks the executors of late-bound functions when we send them their
+    triggers. Each replica's load is estimated from the most recent backlog the
+    schedulers reported for it in any schedule we received, plus the requests
+    we have bound to it since; our own backlog is known exactly. We prefer to
+    run the next function where the result we just produced is: on this
+    executor, or another one on our node, unless it is much more backlogged
+    than the least backlogged replica.
+    '''
+
+    def __init__(self, status):
+        # Our own status, whose backlog is kept up to date by the executor.
+        self.status = status
+        self.address = status.ip + ':' + str(status.tid)
+
+        # The most recent backlog reported for each executor, along with the
+        # start time of the schedule that reported it, and the number of
+        # requests we bound to each executor since.
+        self.backlogs = {}
+        self.bound = {}
+
+        # The number of requests we bound since the last report, and how many
+        # of them we bound to our own node.
+        self.late_bound = 0
+        self.local = 0
+
+    def observe(self, schedule):
+        '''
+        Updates our estimates of the executors' backlogs from the candidates of
+        the late-bound functions in a schedule.
+        '''
+        for key in schedule.locations:
+            if key.startswith(sutils.CANDIDATES_LOCATION_PREFIX):
+                fname = key[len(sutils.CANDIDATES_LOCATION_PREFIX):]
+                self._update(sutils.get_candidates(schedule, fname),
+                             schedule.start_time)
+
+    def bind(self, schedule, fname):
+        '''
+        Picks the executor of a late-bound function, and returns its location.
+        '''
+        candidates = sutils.get_candidates(schedule, fname)
+        self._update(candidates, schedule.start_time)
+
+        loads = {}
+        for location, _ in candidates:
+            loads[location] = self._load(location)
+
+        least = min(loads.values())
+        local = [location for location in loads if
+                 location.split(':')[0] == self.status.ip and
+                 loads[location] <= least + LOCALITY_SLACK]
+        if len(local) > 0:
+            loads = {location: loads[location] for location in local}
+            self.local += 1
+
+        least = min(loads.values())
+        location = random.choice([location for location in loads if
+                                  loads[location] == least])
+
+        self.bound[location] = self.bound.get(location, 0) + 1
+        self.late_bound += 1
+        return location
+
+    def _load(self, location):
+        if location == self.address:
+            return self.status.backlog
+
+        backlog = self.backlogs[location][0]
+        return backlog + self.bound.get(location, 0)
+
+    def _update(self, candidates, as_of):
+        for location, backlog in candidates:
+            if (location not in self.backlogs or
+                    self.backlogs[location][1] < as_of):
+                self.backlogs[location] = (backlog, as_of)
+                self.bound[location] = 0
@@ -28,10 +28,13 @@ from anna.lattices import (
 )
 
 from cloudburst.server.executor import utils
+from cloudburst.server.executor.store import ObjectReference
 import cloudburst.server.utils as sutils
 from cloudburst.shared.proto.cloudburst_pb2 import (
     Continuation,
+    DagSchedule,
     DagTrigger,
+    DEFAULT,
     FunctionCall,
     NORMAL, MULTI,  # Cloudburst's consistency modes,
     EXECUTION_ERROR, FUNC_NOT_FOUND,  # Cloudburst's error types
@@ -42,8 +45,13 @@ from cloudburst.shared.serializer import Serializer
 
 serializer = Serializer()
 
+# The largest timestamp a snapshot interval can end at; an interval ending here
+# has not been narrowed down by any read yet.
+MAX_TIMESTAMP = 2**64 - 1
 
-def exec_function(exec_socket, kvs, user_library, cache, function_cache):
+
+def exec_function(exec_socket, kvs, user_library, cache, function_cache,
+                  writer=None, memo=None, node_cache=None):
     call = FunctionCall()
     call.ParseFromString(exec_socket.recv())
 
@@ -63,7 +71,10 @@ def exec_function(exec_socket, kvs, user_library, cache, function_cache):
         function_cache[call.name] = f
         try:
             if call.consistency == NORMAL:
-                result = _exec_func_normal(kvs, f, fargs, user_library, cache)
+                result = _exec_func_memoized(kvs, f, call.name,
+                                             call.arguments.values, fargs,
+                                             user_library, cache, memo,
+                                             writer, node_cache)
                 logging.info('Finished executing %s: %s!' % (call.name,
                                                              str(result)))
             else:
@@ -74,11 +85,21 @@ def exec_function(exec_socket, kvs, user_library, cache, function_cache):
             sutils.error.error = EXECUTION_ERROR
             result = ('ERROR: ' + str(e), sutils.error.SerializeToString())
 
+    # If we have a write coalescer, it sends the result along with others and
+    # retries it until it is acked.
     if call.consistency == NORMAL:
         result = serializer.dump_lattice(result)
+        if writer:
+            writer.put(call.response_key, result)
+            return
+
         succeed = kvs.put(call.response_key, result)
     else:
         result = serializer.dump_lattice(result, WrenLattice)
+        if writer:
+            writer.causal_put(call.response_key, result)
+            return
+
         succeed = kvs.causal_put(call.response_key, result)
 
     if not succeed:
@@ -86,7 +107,7 @@ def exec_function(exec_socket, kvs, user_library, cache, function_cache):
                      + 'into the KVS.')
 
 
-def _exec_func_normal(kvs, func, args, user_lib, cache):
+def _exec_func_normal(kvs, func, args, user_lib, cache, node_cache=None):
     # NOTE: We may not want to keep this permanently but need it for
     # continuations if the upstream function returns multiple things.
     processed = tuple()
@@ -111,13 +132,31 @@ def _exec_func_normal(kvs, func, args, user_lib, cache):
         refs = list(filter(lambda a: isinstance(a, CloudburstReference), args))
 
     if refs:
-        refs = _resolve_ref_normal(refs, kvs, cache)
+        refs = _resolve_ref_normal(refs, kvs, cache, node_cache)
 
     return _run_function(func, refs, args, user_lib)
 
 
+def _exec_func_memoized(kvs, func, fname, values, args, user_lib, cache, memo,
+                        writer=None, node_cache=None):
+    # If the function is pure, we return the result of an earlier call with
+    # the same arguments if we have one, and remember the result otherwise.
+    key = memo.key(fname, values, args) if memo is not None else None
+    if key is not None:
+        hit, result = memo.get(key)
+        if hit:
+            return result
+
+    result = _exec_func_normal(kvs, func, args, user_lib, cache, node_cache)
+
+    if key is not None:
+        memo.put(key, result, writer)
+
+    return result
+
+
 def _exec_func_causal(kvs, func, args, user_lib, schedule=None,
-                      t_low=0, t_high= 2**64-1):
+                      t_low=0, t_high=MAX_TIMESTAMP):
     refs = list(filter(lambda a: isinstance(a, CloudburstReference), args))
 
     if refs:
@@ -153,7 +192,7 @@ def _run_function(func, refs, args, user_lib):
     return func(*func_args)
 
 
-def _resolve_ref_normal(refs, kvs, cache):
+def _resolve_ref_normal(refs, kvs, cache, node_cache=None):
     deserialize_map = {}
     kv_pairs = {}
     keys = set()
@@ -162,8 +201,17 @@ def _resolve_ref_normal(refs, kvs, cache):
         deserialize_map[ref.key] = ref.deserialize
         if ref.key in cache:
             kv_pairs[ref.key] = cache[ref.key]
-        else:
-            keys.add(ref.key)
+            continue
+
+        # Another executor on our node may have read this value already.
+        if node_cache is not None and ref.deserialize:
+            value = node_cache.get(ref.key)
+            if value is not None:
+                kv_pairs[ref.key] = value
+                cache[ref.key] = value
+                continue
+
+        keys.add(ref.key)
 
     keys = list(keys)
 
@@ -171,18 +219,22 @@ def _resolve_ref_normal(refs, kvs, cache):
         returned_kv_pairs = kvs.get(keys)
 
         # When chaining function executions, we must wait, so we check to see
-        # if certain values have not been resolved yet.
-        while None in returned_kv_pairs.values():
-            returned_kv_pairs = kvs.get(keys)
+        # if certain values have not been resolved yet. We only re-request the
+        # keys that are still missing.
+        missing = _unresolved(returned_kv_pairs)
+        while len(missing) > 0:
+            retried = kvs.get(missing)
+            for key in missing:
+                returned_kv_pairs[key] = retried[key]
+
+            missing = _unresolved(returned_kv_pairs)
 
         for key in keys:
             # Because references might be repeated, we check to make sure that
             # we haven't already deserialized this ref.
-            if deserialize_map[key] and isinstance(returned_kv_pairs[key],
-                                                   Lattice):
-                kv_pairs[key] = serializer.load_lattice(returned_kv_pairs[key])
-            else:
-                kv_pairs[key] = returned_kv_pairs[key].reveal()
+            kv_pairs[key] = _load_reference(returned_kv_pairs[key],
+                                            deserialize_map[key], key,
+                                            node_cache)
 
             # Cache the deserialized payload for future use
             cache[key] = kv_pairs[key]
@@ -190,21 +242,132 @@ def _resolve_ref_normal(refs, kvs, cache):
     return kv_pairs
 
 
+def prefetch_references(kvs, schedule, cache, prefetching, children=False,
+                        node_cache=None):
+    '''
+    Starts fetching the references in a DAG request's arguments to this
+    function (and, optionally, to its downstream functions) from the KVS, so
+    that they are usually in the cache by the time the request's triggers
+    arrive. Keys that are cached or already being fetched are skipped.
+    '''
+    fname = schedule.target_function
+    args = [serializer.load(arg) for arg in schedule.arguments[fname].values]
+    refs = list(filter(lambda a: isinstance(a, CloudburstReference), args))
+
+    keys = []
+    for ref in refs:
+        if ref.key not in cache and ref.key not in prefetching:
+            if node_cache is not None and ref.deserialize:
+                value = node_cache.get(ref.key)
+                if value is not None:
+                    cache[ref.key] = value
+                    continue
+
+            prefetching[ref.key] = ref.deserialize
+            keys.append(ref.key)
+
+    # Fetching a child's references only helps if the child runs on this
+    # node, where it warms the KVS cache and ours. Each reference keeps its
+    # own deserialize flag, so the child reads it from our cache as it asked.
+    if children:
+        for ref in _compute_children_refs(schedule, local=True):
+            if ref.key not in cache and ref.key not in prefetching:
+                prefetching[ref.key] = ref.deserialize
+                keys.append(ref.key)
+
+    if len(keys) > 0:
+        kvs.get_async(keys)
+
+
+def receive_prefetched(kvs, cache, prefetching, node_cache=None, store=None):
+    '''
+    Moves the response to one prefetch request into the cache. The objects
+    that our object store reads from the KVS arrive the same way; their keys
+    are returned.
+    '''
+    kv_pairs = kvs.receive_async()
+
+    for key in kv_pairs:
+        if key in prefetching:
+            cache[key] = _load_reference(kv_pairs[key],
+                                         prefetching.pop(key), key,
+                                         node_cache)
+
+    if store is not None:
+        return store.receive_kvs(kv_pairs)
+
+    return []
+
+
+def object_references(triggers):
+    '''
+    Returns the references to objects held in object stores among the
+    arguments in a request's triggers.
+    '''
+    refs = []
+    for trigger in triggers:
+        for value in trigger.arguments.values:
+            # References are pickled, so other values are never one.
+            if value.type != DEFAULT:
+                continue
+
+            arg = serializer.load(value)
+            if isinstance(arg, ObjectReference):
+                refs.append(arg)
+
+    return refs
+
+
+def _load_reference(lattice, deserialize, key=None, node_cache=None):
+    if deserialize and isinstance(lattice, Lattice):
+        # Arrays are kept once per node, and we read them from there.
+        if node_cache is not None and isinstance(lattice, LWWPairLattice):
+            value = node_cache.insert(key, lattice.reveal())
+            if value is not None:
+                return value
+
+        return serializer.load_lattice(lattice)
+    else:
+        return lattice.reveal()
+
+
 def _resolve_ref_causal(refs, kvs, schedule, t_low,
-                        t_high):
+                        t_high, future_read_set=None):
+    keys = [ref.key for ref in refs]
+
     if schedule:
         client_id = schedule.client_id
         consistency = schedule.consistency
+
+        # Tell the KVS what our downstream functions are going to read, so
+        # that it picks a snapshot that stays valid for the rest of the DAG.
+        if future_read_set is None:
+            future_read_set = _compute_children_read_set(schedule) - set(keys)
     else:
         client_id = 0
         consistency = MULTI
+        future_read_set = set()
 
-    keys = [ref.key for ref in refs]
-    kv_pairs = kvs.causal_get(keys, t_low, t_high, consistency, client_id)
+    kv_pairs = kvs.causal_get(keys, t_low, t_high, consistency, client_id,
+                              future_read_set=future_read_set)
+
+    # We keep the versions we have already read, and only re-request the keys
+    # that are still missing. The versions we keep constrain the snapshot, so
+    # the retries read from within the window they leave open.
+    missing = _unresolved(kv_pairs)
+    while len(missing) > 0:
+        retry_low, retry_high = t_low, t_high
+        for key in kv_pairs:
+            if isinstance(kv_pairs[key], LWWPairLattice):
+                retry_low = max(kv_pairs[key].ts, retry_low)
+                retry_high = min(kv_pairs[key].promise, retry_high)
 
-    while None in kv_pairs.values():
-        kv_pairs = kvs.causal_get(keys, t_low, t_high, consistency, client_id)
+        retried = kvs.causal_get(missing, retry_low, retry_high, consistency,
+                                 client_id, future_read_set=future_read_set)
+        for key in missing:
+            kv_pairs[key] = retried.get(key)
 
+        missing = _unresolved(kv_pairs)
 
 
     for ref in refs:
@@ -229,17 +392,26 @@ def _resolve_ref_causal(refs, kvs, schedule, t_low,
 
 
 def exec_dag_function(pusher_cache, kvs, trigger_sets, function, schedules,
-                      user_library, dag_runtimes, cache, schedulers, batching):
+                      user_library, dag_runtimes, cache, schedulers, batching,
+                      writer=None, memo=None, function_cache=None,
+                      stage_runtimes=None, binder=None, store=None,
+                      node_cache=None):
     if schedules[0].consistency == NORMAL:
         finished, successes = _exec_dag_function_normal(pusher_cache, kvs,
                                                         trigger_sets, function,
                                                         schedules,
                                                         user_library, cache,
-                                                        schedulers, batching)
+                                                        schedulers, batching,
+                                                        writer, memo,
+                                                        function_cache,
+                                                        stage_runtimes, binder,
+                                                        store, node_cache)
     else:
         finished, successes = _exec_dag_function_causal(pusher_cache, kvs,
                                                         trigger_sets, function,
-                                                        schedules, user_library)
+                                                        schedules,
+                                                        user_library, batching,
+                                                        writer)
 
     # If finished is true, that means that this executor finished the DAG
     # request. We will report the end-to-end latency for this DAG if so.
@@ -256,7 +428,7 @@ def exec_dag_function(pusher_cache, kvs, trigger_sets, function, schedules,
     return successes
 
 
-def _construct_trigger(sid, fname, result):
+def _construct_trigger(sid, fname, result, store=None, consumers=0):
     trigger = DagTrigger()
     trigger.id = sid
     trigger.source = fname
@@ -264,37 +436,95 @@ def _construct_trigger(sid, fname, result):
     if type(result) != tuple:
         result = (result,)
 
-    trigger.arguments.values.extend(list(
-        map(lambda v: serializer.dump(v, None, False), result)))
+    values = list(map(lambda v: serializer.dump(v, None, False), result))
+
+    # Large values stay in our object store, and the next functions are sent a
+    # reference to them instead.
+    if store is not None and consumers > 0:
+        for idx, value in enumerate(values):
+            if len(value.body) > store.threshold:
+                ref = store.put(value.SerializeToString(), consumers)
+                if ref is not None:
+                    values[idx] = serializer.dump(ref, None, False)
+
+    trigger.arguments.values.extend(values)
     return trigger
 
 
 def _exec_dag_function_normal(pusher_cache, kvs, trigger_sets, function,
                               schedules, user_lib, cache, schedulers,
-                              batching):
+                              batching, writer=None, memo=None,
+                              function_cache=None, stage_runtimes=None,
+                              binder=None, store=None, node_cache=None):
     fname = schedules[0].target_function
 
+    # If this function starts a fused chain, we run the rest of the chain
+    # right after it, and pass on its last function's result as our own.
+    chain = []
+    if function_cache is not None and not batching:
+        chain = sutils.get_fused_chains(schedules[0].dag).get(fname, [])
+
     # We construct farg_sets to have a request by request set of arguments.
     # That is, each element in farg_sets will have all the arguments for one
-    # invocation.
+    # invocation. We keep the serialized arguments as well, which memoized
+    # results are keyed by.
     farg_sets = []
-    for schedule, trigger_set in zip(schedules, trigger_sets):
-        fargs = list(schedule.arguments[fname].values)
+    value_sets = []
+    failed = []
+    for idx, pair in enumerate(zip(schedules, trigger_sets)):
+        schedule, trigger_set = pair
+        values = list(schedule.arguments[fname].values)
 
         for trigger in trigger_set:
-            fargs += list(trigger.arguments.values)
+            values += list(trigger.arguments.values)
+
+        fargs = [serializer.load(arg) for arg in values]
+
+        # Values kept in another executor's object store were fetched before
+        # the request was queued, or are read from shared memory now. The
+        # references differ on every call, so these calls are not memoized.
+        if any(isinstance(arg, ObjectReference) for arg in fargs):
+            fargs = _fetch_objects(store, fargs)
+            memo = None
+
+            # If an object's owner failed before writing it to the KVS, the
+            # request cannot run, so it fails.
+            if fargs is None:
+                utils.generate_error_response(schedule, kvs, fname,
+                                              'could not read its arguments')
+                failed.append(idx)
+                continue
 
-        fargs = [serializer.load(arg) for arg in fargs]
+        value_sets.append(values)
         farg_sets.append(fargs)
 
+    # The requests that failed are finished, with an error as their result.
+    if len(failed) > 0:
+        schedules = [schedule for idx, schedule in enumerate(schedules) if
+                     idx not in failed]
+        if len(schedules) == 0:
+            return False, [True] * len(failed)
+
     if batching:
         fargs = [[]] * len(farg_sets[0])
         for idx in range(len(fargs)):
             fargs[idx] = [fset[idx] for fset in farg_sets]
-    else: # There will only be one thing in farg_sets
-        fargs = farg_sets[0]
 
-    result_list = _exec_func_normal(kvs, function, fargs, user_lib, cache)
+        result_list = _exec_func_normal(kvs, function, fargs, user_lib, cache,
+                                        node_cache)
+    else: # There will only be one thing in farg_sets
+        start = time.time()
+        result_list = _exec_func_memoized(kvs, function, fname, value_sets[0],
+                                          farg_sets[0], user_lib, cache, memo,
+                                          writer, node_cache)
+
+        if len(chain) > 0:
+            _record_stage(stage_runtimes, fname, time.time() - start)
+            result_list = _run_fused_stages(kvs, schedules[0], chain,
+                                            result_list, function_cache,
+                                            user_lib, cache, stage_runtimes,
+                                            node_cache)
+            fname = chain[-1]
     if not isinstance(result_list, list):
         result_list = [result_list]
 
@@ -313,15 +543,13 @@ def _exec_dag_function_normal(pusher_cache, kvs, trigger_sets, function,
                 continue
 
         successes.append(True)
-        new_trigger = _construct_trigger(schedule.id, fname, result)
+        new_trigger = _construct_trigger(schedule.id, fname, result, store,
+                                         _count_consumers(schedule, fname))
         for conn in schedule.dag.connections:
             if conn.source == fname:
                 is_sink = False
                 new_trigger.target_function = conn.sink
-
-                dest_ip = schedule.locations[conn.sink]
-                sckt = pusher_cache.get(sutils.get_dag_trigger_address(dest_ip))
-                sckt.send(new_trigger.SerializeToString())
+                _send_trigger(pusher_cache, schedule, new_trigger, binder)
 
     if is_sink:
         if schedule.continuation.name:
@@ -358,92 +586,307 @@ def _exec_dag_function_normal(pusher_cache, kvs, trigger_sets, function,
 
                     keys.append(output_key)
                     lattices.append(lattice)
-            kvs.put(keys, lattices)
+
+            if writer:
+                for key, lattice in zip(keys, lattices):
+                    writer.put(key, lattice)
+            else:
+                kvs.put(keys, lattices)
+
+    for idx in failed:
+        successes.insert(idx, True)
 
     return is_sink, successes
 
 
-# Causal mode does not currently support batching, so there should only ever be
-# one trigger set and oone schedule.
-def _exec_dag_function_causal(pusher_cache, kvs, triggers, function, schedule,
-                              user_lib):
-    schedule = schedule[0]
-    triggers = triggers[0]
+def _fetch_objects(store, fargs):
+    # Returns the arguments with the objects they refer to in place of their
+    # references, or None if one of the objects could not be fetched.
+    resolved = []
+    for arg in fargs:
+        if isinstance(arg, ObjectReference):
+            body = store.fetch(arg)
+            if body is None:
+                return None
 
-    fname = schedule.target_function
-    fargs = list(schedule.arguments[fname].values)
+            arg = serializer.load(body)
 
+        resolved.append(arg)
 
-    for trigger in triggers:
-        fargs += list(trigger.arguments.values)
+    return resolved
+
+
+def _count_consumers(schedule, fname):
+    # Each of the next functions reads our result once, and both replicas of a
+    # hedged function do.
+    consumers = 0
+    for conn in schedule.dag.connections:
+        if conn.source == fname:
+            consumers += 1
+            if sutils.get_hedge_location(schedule, conn.sink) is not None:
+                consumers += 1
+
+    return consumers
+
+
+def _run_fused_stages(kvs, schedule, chain, result, function_cache, user_lib,
+                      cache, stage_runtimes, node_cache=None):
+    '''
+    Runs the functions of a fused chain one after the other, passing each
+    function's result straight to the next one instead of serializing it into
+    a trigger. Returns the result of the last function.
+    '''
+    for fname in chain:
+        start = time.time()
+
+        fargs = [serializer.load(arg) for arg in
+                 schedule.arguments[fname].values]
+        if type(result) == tuple:
+            fargs += list(result)
+        else:
+            fargs.append(result)
+
+        result = _exec_func_normal(kvs, function_cache[fname], fargs, user_lib,
+                                   cache, node_cache)
+        _record_stage(stage_runtimes, fname, time.time() - start)
 
+    return result
 
-    fargs = [serializer.load(arg) for arg in fargs]
 
-    if(trigger.t_high == 0):
-        trigger.t_high = 2**64-1
-    result, new_t_low, new_t_high = _exec_func_causal(kvs, function, fargs, user_lib, schedule,
-                               trigger.t_low, trigger.t_high)
+def _record_stage(stage_runtimes, fname, runtime):
+    if stage_runtimes is None:
+        return
+
+    if fname not in stage_runtimes:
+        stage_runtimes[fname] = []
+
+    stage_runtimes[fname].append(runtime)
+
+
+def _exec_dag_function_causal(pusher_cache, kvs, trigger_sets, function,
+                              schedules, user_lib, batching, writer=None):
+    fname = schedules[0].target_function
+
+    # Each request reads from the snapshot interval that its predecessors
+    # agreed on; a request whose predecessors have not picked a snapshot yet
+    # (t_high of 0) can read from any snapshot.
+    farg_sets = []
+    windows = []
+    for schedule, trigger_set in zip(schedules, trigger_sets):
+        fargs = list(schedule.arguments[fname].values)
+
+        t_low, t_high = 0, MAX_TIMESTAMP
+        for trigger in trigger_set:
+            fargs += list(trigger.arguments.values)
+
+            t_low = max(t_low, trigger.t_low)
+            if trigger.t_high != 0:
+                t_high = min(t_high, trigger.t_high)
+
+        farg_sets.append([serializer.load(arg) for arg in fargs])
+        windows.append((t_low, t_high))
+
+    # Requests whose snapshot intervals overlap read their references with a
+    # single causal_get, from the intersection of their intervals.
+    # A request that reads no references keeps its own interval, so a request
+    # whose predecessors have not picked a snapshot still lets its successors
+    # read from any snapshot.
+    snapshots = [window[1] for window in windows]
+    for group, t_low, t_high in _group_by_snapshot(schedules, windows):
+        refs = {}
+        readers = []
+        future_read_set = set()
+        for idx in group:
+            for arg in farg_sets[idx]:
+                if isinstance(arg, CloudburstReference):
+                    refs[arg.key] = arg
+                    if idx not in readers:
+                        readers.append(idx)
+            future_read_set |= _compute_children_read_set(schedules[idx])
+
+        if len(refs) > 0:
+            kv_pairs, t_low, t_high = _resolve_ref_causal(
+                list(refs.values()), kvs, schedules[group[0]], t_low, t_high,
+                future_read_set - set(refs.keys()))
+
+            # We substitute the values into each request's arguments here,
+            # because the same key can be read at different versions by
+            # requests in different groups.
+            for idx in group:
+                farg_sets[idx] = [kv_pairs[arg.key] if
+                                  isinstance(arg, CloudburstReference) else
+                                  arg for arg in farg_sets[idx]]
+
+            for idx in readers:
+                snapshots[idx] = t_high
+
+    if batching:
+        fargs = [[fset[idx] for fset in farg_sets] for idx in
+                 range(len(farg_sets[0]))]
+        result_list = _run_function(function, {}, fargs, user_lib)
+        if not isinstance(result_list, list):
+            result_list = [result_list]
+    else: # There will only be one thing in farg_sets
+        result_list = [_run_function(function, {}, farg_sets[0], user_lib)]
+
+    successes = []
+    is_sink = True
 
     this_ref = None
-    for ref in schedule.dag.functions:
+    for ref in schedules[0].dag.functions:
         if ref.name == fname:
             this_ref = ref # There must be a match.
 
-    success = True
-    if this_ref.type == MULTIEXEC:
-        if serializer.dump(result) in this_ref.invalid_results:
-            return False, False
+    for schedule, result, window, snapshot in zip(schedules, result_list,
+                                                  windows, snapshots):
+        if this_ref.type == MULTIEXEC:
+            if serializer.dump(result) in this_ref.invalid_results:
+                successes.append(False)
+                continue
 
-    # Create a new trigger with the schedule ID and results of this execution.
-    new_trigger = _construct_trigger(schedule.id, fname, result)
+        successes.append(True)
 
-    if trigger.t_high == 2**64-1:
-        logging.info("Putting snapshot as: {}", new_t_high)
-        new_trigger.t_low = new_t_high
-        new_trigger.t_high = new_t_high
-    else:
-        logging.info("Snapshot continues as: trigger low {} trigger high {}", trigger.t_low, trigger.t_high)
-        new_trigger.t_low = trigger.t_low
-        new_trigger.t_high = trigger.t_high
+        # Create a new trigger with the schedule ID and results of this
+        # execution.
+        new_trigger = _construct_trigger(schedule.id, fname, result)
 
+        # If no predecessor picked a snapshot, this request's reads picked it,
+        # and the rest of the DAG has to read from it as well. Otherwise, we
+        # pass on the interval we were given.
+        if window[1] == MAX_TIMESTAMP:
+            logging.info('Putting snapshot as: %s' % (str(snapshot)))
+            new_trigger.t_low = snapshot
+            new_trigger.t_high = snapshot
+        else:
+            logging.info('Snapshot continues as: trigger low %s trigger high '
+                         '%s' % (str(window[0]), str(window[1])))
+            new_trigger.t_low = window[0]
+            new_trigger.t_high = window[1]
 
-    is_sink = True
-    for conn in schedule.dag.connections:
-        if conn.source == fname:
-            is_sink = False
-            new_trigger.target_function = conn.sink
-            logging.info("Was not sink, passing function along")
+        sink = True
+        for conn in schedule.dag.connections:
+            if conn.source == fname:
+                is_sink = sink = False
+                new_trigger.target_function = conn.sink
+                _send_trigger(pusher_cache, schedule, new_trigger)
 
-            dest_ip = schedule.locations[conn.sink]
-            sckt = pusher_cache.get(sutils.get_dag_trigger_address(dest_ip))
-            sckt.send(new_trigger.SerializeToString())
+        if sink:
+            logging.info('DAG %s (ID %s) completed in causal mode; result at '
+                         '%s.' % (schedule.dag.name, schedule.id,
+                                  schedule.output_key))
 
-    if is_sink:
-        logging.info('DAG %s (ID %s) completed in causal mode; result at %s.' %
-                     (schedule.dag.name, schedule.id, schedule.output_key))
+            # Serialize result into a MultiKeyCausalLattice.
+            lattice = serializer.dump_lattice(result, WrenLattice)
+
+            if writer:
+                writer.causal_put(schedule.output_key, lattice,
+                                  schedule.client_id)
+            else:
+                succeed = kvs.causal_put(schedule.output_key, lattice,
+                                         schedule.client_id)
+                while not succeed:
+                    succeed = kvs.causal_put(schedule.output_key, lattice,
+                                             schedule.client_id)
+
+            if schedule.response_address:
+                sckt = pusher_cache.get(schedule.response_address)
+                logging.info('DAG %s (ID %s) result returned to requester.' %
+                             (schedule.dag.name, schedule.id))
+                sckt.send(serializer.dump(lattice))
+
+    return is_sink, successes
+
+
+def _send_trigger(pusher_cache, schedule, trigger, binder=None):
+    # If the next function is late-bound, we pick its executor now, and send
+    # it the schedule ahead of the trigger.
+    if (trigger.target_function not in schedule.locations and
+            sutils.get_candidates(schedule, trigger.target_function)):
+        _bind(pusher_cache, schedule, trigger.target_function, binder)
+
+    # If the next function's request is hedged, both of its replicas need the
+    # trigger.
+    dest_ips = [schedule.locations[trigger.target_function]]
+
+    hedge = sutils.get_hedge_location(schedule, trigger.target_function)
+    if hedge is not None:
+        dest_ips.append(hedge)
 
+    msg = trigger.SerializeToString()
+    for dest_ip in dest_ips:
+        sckt = pusher_cache.get(sutils.get_dag_trigger_address(dest_ip))
+        sckt.send(msg)
 
-        # Serialize result into a MultiKeyCausalLattice.
-        result = serializer.dump_lattice(result,WrenLattice);
 
-        succeed = kvs.causal_put(schedule.output_key,
-                                 result, schedule.client_id)
-        while not succeed:
-            succeed = kvs.causal_put(schedule.output_key,
-                                     result, schedule.client_id)
-        if schedule.response_address:
-            sckt = pusher_cache.get(schedule.response_address)
-            logging.info('DAG %s (ID %s) result returned to requester.' %
-                         (schedule.dag.name, trigger.id))
-            sckt.send(serializer.dump(result))
+def _bind(pusher_cache, schedule, fname, binder):
+    location = binder.bind(schedule, fname)
+    schedule.locations[fname] = location
 
+    bound = DagSchedule()
+    bound.CopyFrom(schedule)
+    bound.target_function = fname
+    bound.ClearField('triggers')
+    bound.triggers.extend(sutils.get_dag_predecessors(schedule.dag, fname))
+    del bound.locations[sutils.CANDIDATES_LOCATION_PREFIX + fname]
 
-    return is_sink, [success]
+    logging.info('Binding request %s for function %s to %s.' %
+                 (schedule.id, fname, location))
+
+    sckt = pusher_cache.get(sutils.get_dag_queue_address(location))
+    sckt.send(bound.SerializeToString())
+
+
+def _group_by_snapshot(schedules, windows):
+    '''
+    Splits a batch of causal requests into groups whose snapshot intervals
+    overlap, and returns each group's request indices along with the
+    intersection of their intervals. Requests from different clients are
+    never grouped, since each read belongs to its client's session.
+    '''
+    by_client = {}
+    for idx, schedule in enumerate(schedules):
+        client = (schedule.client_id, schedule.consistency)
+        if client not in by_client:
+            by_client[client] = []
+        by_client[client].append(idx)
+
+    groups = []
+    for indices in by_client.values():
+        # Sweeping the requests in order of the start of their intervals, a
+        # request joins the current group as long as the intersection stays
+        # non-empty.
+        indices.sort(key=lambda idx: windows[idx][0])
+
+        group = []
+        t_low, t_high = 0, MAX_TIMESTAMP
+        for idx in indices:
+            low, high = windows[idx]
+            if len(group) > 0 and max(t_low, low) > min(t_high, high):
+                groups.append((group, t_low, t_high))
+                group = []
+                t_low, t_high = 0, MAX_TIMESTAMP
+
+            group.append(idx)
+            t_low = max(t_low, low)
+            t_high = min(t_high, high)
+
+        groups.append((group, t_low, t_high))
+
+    return groups
+
+
+def _unresolved(kv_pairs):
+    return [key for key in kv_pairs if kv_pairs[key] is None]
 
 
 def _compute_children_read_set(schedule):
-    future_read_set = set()
+    return set([ref.key for ref in _compute_children_refs(schedule)])
+
+
+def _compute_children_refs(schedule, local=False):
+    # Returns the references in the arguments of the functions downstream of
+    # this one; if local is set, only those of the functions that are
+    # scheduled on this node.
     fname = schedule.target_function
     children = set()
     delta = {fname}
@@ -456,11 +899,15 @@ def _compute_children_read_set(schedule):
                 new_delta.add(conn.sink)
         delta = new_delta
 
+    if local:
+        ip = schedule.locations.get(fname, '').split(':')[0]
+        children = [child for child in children if child in schedule.locations
+                    and schedule.locations[child].split(':')[0] == ip]
+
+    refs = []
     for child in children:
-        refs = list(filter(lambda arg: type(arg) == CloudburstReference,
-                           [serializer.load(arg) for arg in
-                            schedule.arguments[child].values]))
-        for ref in refs:
-            future_read_set.add(ref.key)
+        refs += list(filter(lambda arg: type(arg) == CloudburstReference,
+                            [serializer.load(arg) for arg in
+                             schedule.arguments[child].values]))
 
-    return future_read_set
+    return refs
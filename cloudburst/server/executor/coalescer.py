@@ -0,0 +1,144 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import logging
+import time
+
+# How long we hold a result write, waiting for others to send along with it,
+# in seconds.
+COALESCE_WINDOW = 0.005
+
+# The most writes we send in a single request.
+COALESCE_LIMIT = 100
+
+# How long we wait for a write to be acked before we send it again, in seconds.
+ACK_TIMEOUT = 1
+
+
+class WriteCoalescer():
+    '''
+    Gathers the result writes of many requests and sends them to the KVS
+    together, rather than waiting for an ack after every write. Normal mode
+    writes are sent as one multi-key put; causal writes are sent one per key,
+    since the KVS only supports single-key causal puts. Acks are processed as
+    they arrive, and writes that fail or are not acked in time are sent again.
+    '''
+
+    def __init__(self, kvs, window=COALESCE_WINDOW, limit=COALESCE_LIMIT):
+        self.kvs = kvs
+        self.window = window
+        self.limit = limit
+
+        # The writes that have not been sent yet, mapped from key to (lattice,
+        # client ID), where causal writes have a client ID and normal ones have
+        # None. A later write to the same key replaces an earlier one.
+        self.buffered = {}
+        self.first_buffered = None
+
+        # Writes that have been sent but not acked, mapped from key to
+        # (lattice, client ID, send time).
+        self.outstanding = {}
+
+    def __len__(self):
+        return len(self.buffered) + len(self.outstanding)
+
+    def put(self, key, lattice):
+        self._buffer(key, lattice, None)
+
+    def causal_put(self, key, lattice, client_id=0):
+        self._buffer(key, lattice, client_id)
+
+    def deadline(self):
+        '''
+        Returns the time by which flush should next be called, or None if
+        there is nothing to send.
+        '''
+        if len(self.buffered) > 0:
+            return self.first_buffered + self.window
+
+        if len(self.outstanding) > 0:
+            return min(sent for _, _, sent in self.outstanding.values()) + \
+                ACK_TIMEOUT
+
+        return None
+
+    def flush(self, now=None, force=False):
+        '''
+        Sends the buffered writes if the window has passed (or the buffer is
+        full), and re-sends writes whose acks timed out.
+        '''
+        if now is None:
+            now = time.time()
+
+        for key in list(self.outstanding.keys()):
+            lattice, client_id, sent = self.outstanding[key]
+            if now - sent > ACK_TIMEOUT:
+                del self.outstanding[key]
+
+                # If the key was written again since, the newer write replaces
+                # this one.
+                if key not in self.buffered:
+                    logging.error('Write to %s was not acked; retrying.' %
+                                  (key))
+                    self._buffer(key, lattice, client_id, now)
+                    force = True
+
+        if len(self.buffered) == 0:
+            return
+
+        if (not force and len(self.buffered) < self.limit and
+                now < self.first_buffered + self.window):
+            return
+
+        keys = []
+        lattices = []
+        for key, (lattice, client_id) in self.buffered.items():
+            if client_id is None:
+                keys.append(key)
+                lattices.append(lattice)
+            else:
+                self.kvs.causal_put_async(key, lattice, client_id)
+
+            self.outstanding[key] = (lattice, client_id, now)
+
+        for start in range(0, len(keys), self.limit):
+            self.kvs.put_async(keys[start:start + self.limit],
+                               lattices[start:start + self.limit])
+
+        self.buffered.clear()
+        self.first_buffered = None
+
+    def receive_acks(self, now=None):
+        '''
+        Processes the acks that have arrived, buffering failed writes to be
+        sent again.
+        '''
+        if now is None:
+            now = time.time()
+
+        for key, success in self.kvs.receive_put_acks().items():
+            if key not in self.outstanding:
+                continue
+
+            lattice, client_id, _ = self.outstanding.pop(key)
+            if not success:
+                logging.error('Write to %s failed; retrying.' % (key))
+                if key not in self.buffered:
+                    self._buffer(key, lattice, client_id, now)
+
+    def _buffer(self, key, lattice, client_id, now=None):
+        if len(self.buffered) == 0:
+            self.first_buffered = now if now is not None else time.time()
+
+        self.buffered[key] = (lattice, client_id)
@@ -0,0 +1,144 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from collections import deque
+import heapq
+
+from cloudburst.server import utils as sutils
+
+# The percentile of a function's recent runtimes that the second replica of a
+# hedged request waits for before running it.
+HEDGE_PERCENTILE = 95
+
+# The bounds on how long the second replica waits, in seconds. We wait for the
+# longest one until we have measured the function's runtime.
+MIN_HEDGE_DELAY = 0.005
+MAX_HEDGE_DELAY = 1.0
+
+# The number of recent runtimes per function that the delay is computed over.
+SAMPLE_WINDOW = 100
+
+
+class HedgeTracker():
+    '''
+    Tracks the hedged requests for which this executor is the second replica.
+    A hedged request is sent to two replicas of its function, and the second
+    one holds the request once it is ready to run, for as long as the
+    function's recent runtimes suggest the first replica should take. If the
+    first replica finishes in the meantime, it cancels the request here;
+    otherwise, we run it as well, and whichever replica finishes first cancels
+    it at the other.
+    '''
+
+    def __init__(self, address):
+        # Our own location, as 'ip:tid'.
+        self.address = address
+
+        # The recent runtimes of each function.
+        self.runtimes = {}
+
+        # The held requests, mapped to when they are due to run, and a heap of
+        # (due time, request key) pairs. Cancelled requests are left in the
+        # heap and skipped.
+        self.held = {}
+        self.due_times = []
+
+        # The number of hedged requests we ran as the second replica since the
+        # last report, and the number of requests for which we are the first
+        # replica that the second one finished before we did. Only the first
+        # replica knows that the second one's cancel arrived in time.
+        self.hedged = 0
+        self.wins = 0
+
+    def is_backup(self, schedule):
+        '''
+        Returns True if we are the second replica of this hedged request.
+        '''
+        fname = schedule.target_function
+        return sutils.get_hedge_location(schedule, fname) == self.address
+
+    def get_other(self, schedule):
+        '''
+        Returns the location of the other replica of a hedged request, or None
+        if it is not hedged.
+        '''
+        fname = schedule.target_function
+        hedge = sutils.get_hedge_location(schedule, fname)
+        if hedge is None:
+            return None
+
+        if hedge == self.address:
+            return schedule.locations[fname]
+
+        return hedge
+
+    def record(self, fname, runtime):
+        if fname not in self.runtimes:
+            self.runtimes[fname] = deque(maxlen=SAMPLE_WINDOW)
+
+        self.runtimes[fname].append(runtime)
+
+    def delay(self, fname):
+        if fname not in self.runtimes:
+            return MAX_HEDGE_DELAY
+
+        runtimes = sorted(self.runtimes[fname])
+        idx = min(len(runtimes) - 1, len(runtimes) * HEDGE_PERCENTILE // 100)
+        return min(MAX_HEDGE_DELAY, max(MIN_HEDGE_DELAY, runtimes[idx]))
+
+    def hold(self, key, schedule, now):
+        '''
+        Holds a request that just became ready, and returns True if we are the
+        second replica of a hedged request and so should not run it yet.
+        '''
+        if not self.is_backup(schedule):
+            return False
+
+        due = now + self.delay(key[1])
+        self.held[key] = due
+        heapq.heappush(self.due_times, (due, key))
+
+        return True
+
+    def cancel(self, key):
+        self.held.pop(key, None)
+
+    def deadline(self):
+        '''
+        Returns the time at which the next held request is due to run, or None
+        if no requests are held.
+        '''
+        while len(self.due_times) > 0:
+            due, key = self.due_times[0]
+            if self.held.get(key) == due:
+                return due
+
+            heapq.heappop(self.due_times)
+
+        return None
+
+    def take_due(self, now):
+        '''
+        Returns the keys of the held requests that are due to run, and stops
+        holding them.
+        '''
+        keys = []
+        while len(self.due_times) > 0 and self.due_times[0][0] <= now:
+            due, key = heapq.heappop(self.due_times)
+            if self.held.get(key) == due:
+                del self.held[key]
+                keys.append(key)
+
+        self.hedged += len(keys)
+        return keys
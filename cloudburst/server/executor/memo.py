@@ -0,0 +1,175 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from collections import OrderedDict
+import hashlib
+import time
+
+import cloudburst.server.utils as sutils
+from cloudburst.shared.reference import CloudburstReference
+from cloudburst.shared.serializer import Serializer
+from cloudburst.shared.utils import PURE_FUNCS_KEY
+
+serializer = Serializer()
+
+# The most bytes of serialized results an executor keeps in its memo cache.
+MEMO_CAPACITY = 64 * 1024 * 1024
+
+# The prefix of the KVS keys under which memoized results are shared between
+# executors.
+MEMO_KEY_PREFIX = 'memo/'
+
+
+class ResultCache():
+    '''
+    Memoizes the results of pure functions, keyed by the function's version
+    (a digest of its serialized body, so re-registering a function with new
+    code invalidates its results) and the digest of its serialized arguments.
+    Results are kept serialized, in a least recently used cache of bounded
+    size, and each hit deserializes a fresh copy, so callers may modify what
+    they get.
+
+    If kvs_ttl is set, results are also written to the KVS, where the other
+    executors find them on a miss in their own cache. The KVS does not expire
+    keys, so each result is stored with its expiry time, and expired ones are
+    ignored.
+
+    Only normal mode, non-batched requests are memoized, and requests with
+    CloudburstReference arguments never are, since the referenced keys may
+    change. Calls that raise an exception are not memoized.
+    '''
+
+    def __init__(self, kvs, capacity=MEMO_CAPACITY, kvs_ttl=None):
+        self.kvs = kvs
+        self.capacity = capacity
+        self.kvs_ttl = kvs_ttl
+
+        # The names of the functions that were registered as pure, and the
+        # version of each one we have memoized results for.
+        self.pure = set()
+        self.versions = {}
+
+        # The serialized results, by key, from least to most recently used,
+        # and their total size.
+        self.results = OrderedDict()
+        self.size = 0
+
+        # The number of lookups that hit in our own cache, that hit in the
+        # KVS, and that missed, since the last report.
+        self.hits = 0
+        self.kvs_hits = 0
+        self.misses = 0
+
+    def refresh(self):
+        '''
+        Reads the set of pure functions from the KVS.
+        '''
+        funcs = self.kvs.get(PURE_FUNCS_KEY)[PURE_FUNCS_KEY]
+        if funcs:
+            self.pure = set(map(lambda v: str(v, 'utf-8'), funcs.reveal()))
+
+    def key(self, fname, values, args):
+        '''
+        Returns the memo key of a call to a function with the given serialized
+        arguments (values) and deserialized ones (args), or None if the call
+        cannot be memoized.
+        '''
+        if fname not in self.pure:
+            return None
+
+        for arg in args:
+            if type(arg) != tuple:
+                arg = (arg,)
+
+            if any(isinstance(a, CloudburstReference) for a in arg):
+                return None
+
+        version = self._version(fname)
+        if version is None:
+            return None
+
+        digest = hashlib.sha256(version.encode())
+        for value in values:
+            serialized = value.SerializeToString()
+            digest.update(len(serialized).to_bytes(8, 'big'))
+            digest.update(serialized)
+
+        return fname + '/' + digest.hexdigest()
+
+    def get(self, key, now=None):
+        '''
+        Returns whether a result is memoized for the key, and the result.
+        '''
+        if key in self.results:
+            self.results.move_to_end(key)
+            self.hits += 1
+            return True, serializer.load(self.results[key])
+
+        if self.kvs_ttl is not None:
+            if now is None:
+                now = time.time()
+
+            lattice = self.kvs.get(MEMO_KEY_PREFIX + key)[MEMO_KEY_PREFIX +
+                                                          key]
+            if lattice:
+                expiry, serialized = serializer.load_lattice(lattice)
+                if expiry > now:
+                    self._insert(key, serialized)
+                    self.kvs_hits += 1
+                    return True, serializer.load(serialized)
+
+        self.misses += 1
+        return False, None
+
+    def put(self, key, result, writer=None, now=None):
+        serialized = serializer.dump(result)
+        self._insert(key, serialized)
+
+        if self.kvs_ttl is not None:
+            if now is None:
+                now = time.time()
+
+            lattice = serializer.dump_lattice((now + self.kvs_ttl,
+                                               serialized))
+            if writer:
+                writer.put(MEMO_KEY_PREFIX + key, lattice)
+            else:
+                self.kvs.put(MEMO_KEY_PREFIX + key, lattice)
+
+    def _insert(self, key, serialized):
+        # A result that does not fit on its own is not kept at all.
+        if len(serialized) > self.capacity:
+            return
+
+        if key in self.results:
+            self.size -= len(self.results.pop(key))
+
+        self.results[key] = serialized
+        self.size += len(serialized)
+
+        while self.size > self.capacity:
+            _, evicted = self.results.popitem(last=False)
+            self.size -= len(evicted)
+
+    def _version(self, fname):
+        if fname not in self.versions:
+            kvs_name = sutils.get_func_kvs_name(fname)
+            lattice = self.kvs.get(kvs_name)[kvs_name]
+            if not lattice:
+                return None
+
+            self.versions[fname] = hashlib.sha256(lattice.reveal()) \
+                .hexdigest()
+
+        return self.versions[fname]
@@ -0,0 +1,482 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from contextlib import contextmanager
+import fcntl
+import hashlib
+import logging
+from multiprocessing import resource_tracker, shared_memory
+import random
+import struct
+import time
+
+from anna.lattices import LWWPairLattice
+import pyarrow as pa
+
+from cloudburst.server import utils as sutils
+from cloudburst.server.executor import transport
+from cloudburst.shared.proto.cloudburst_pb2 import NUMPY, Value
+from cloudburst.shared.proto.shared_pb2 import StringSet
+
+# The most bytes of values the executors on a node keep in their shared cache.
+NODE_CACHE_CAPACITY = 512 * 1024 * 1024
+
+# The number of entries in the cache's index. The cache holds at most
+# NODE_CACHE_LOAD of this many values, so that lookups stay short.
+NODE_CACHE_SLOTS = 1024
+NODE_CACHE_LOAD = 0.75
+
+# The name of the shared memory segment that holds the cache's index. Each
+# value is kept in a segment of its own, named after the index.
+NODE_CACHE_NAME = 'cb-node-cache'
+
+# When the cache is full, we evict the oldest of this many values, taken from
+# consecutive slots starting at a random one, rather than scanning the whole
+# index for the oldest value while holding the lock.
+EVICTION_SAMPLES = 8
+
+# Keys longer than this many bytes are not cached.
+MAX_KEY_SIZE = 128
+
+# The index starts with a header, which holds the sequence number of the
+# index, the generation of the newest value, the number of bytes and values
+# held, and the capacity. Each of its slots holds whether it is in use, the
+# generation and size of its value, and its key.
+HEADER = struct.Struct('<QQQQQ')
+SLOT = struct.Struct('<QQQ%ds' % MAX_KEY_SIZE)
+
+EMPTY = 0
+USED = 1
+
+
+class NodeCache():
+    '''
+    A cache of deserialized values shared by every executor on a node, so that
+    a value several executors read is fetched from the KVS and held in memory
+    once. Only NumPy arrays and DataFrames, which are serialized with Arrow,
+    are cached: each is kept in a shared memory segment, and executors
+    deserialize it from there without copying it. Values are treated as
+    immutable, as in each executor's own cache.
+
+    The cache's index is an open-addressing hash table in shared memory.
+    Executors look values up without taking a lock: writers, which take a lock
+    file, make the index's sequence number odd while they change it, and
+    readers retry if it was odd or changed while they read. A writer that died
+    while the sequence number was odd no longer holds the lock, and whoever
+    takes it next clears the index. When the cache is full, old values are
+    evicted, the oldest of a small sample at a time; executors that are still
+    using one keep it mapped until they are done.
+
+    Each executor holds a shared lock on a second file while it uses the
+    cache, so the executor that finds no one else holding it knows it is the
+    only one on the node: the first one clears what executors that did not
+    depart left behind, and the last one removes the cache.
+    '''
+
+    def __init__(self, ip, capacity=NODE_CACHE_CAPACITY,
+                 slots=NODE_CACHE_SLOTS, name=NODE_CACHE_NAME):
+        self.ip = ip
+        self.slots = slots
+        self.name = name
+        self.max_entries = int(slots * NODE_CACHE_LOAD)
+
+        self.lock_file = open('/tmp/%s.lock' % name, 'a')
+        self.users_file = open('/tmp/%s.users' % name, 'a')
+
+        alone = self._only_user()
+        fcntl.flock(self.users_file, fcntl.LOCK_SH)
+
+        # The first executor on the node creates the index; the others attach
+        # to it.
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        try:
+            try:
+                self.index = shared_memory.SharedMemory(
+                    name=name, create=True,
+                    size=HEADER.size + slots * SLOT.size)
+                resource_tracker.unregister(self.index._name,
+                                            'shared_memory')
+                self._write_header(0, 0, 0, 0, capacity)
+            except FileExistsError:
+                self.index = transport.attach_segment(name)
+
+                # If no one else uses the index, the executors that did are
+                # gone without removing it, and nothing in it is in use.
+                if alone:
+                    self._clear()
+                else:
+                    self._repair()
+
+                if self.capacity() != capacity:
+                    logging.info('Resizing the node cache from %d to %d '
+                                 'bytes.' % (self.capacity(), capacity))
+                    self._resize(capacity)
+        finally:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+        # The segments of the values we have read, by name.
+        self.segments = {}
+
+        # The sequence number of the index when we last wrote its keys to the
+        # KVS.
+        self.published = None
+
+        # The number of lookups that found a value, lookups that did not, and
+        # values we added since the last report.
+        self.hits = 0
+        self.misses = 0
+        self.inserts = 0
+
+    def get(self, key):
+        '''
+        Returns the value cached for a key, or None if there is none.
+        '''
+        found = self._lookup(key.encode())
+        if found is not None:
+            value = self._load(*found)
+            if value is not None:
+                self.hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    def insert(self, key, data):
+        '''
+        Caches a serialized value that was read from the KVS, and returns it
+        deserialized, or None if it is not a value that is cached.
+        '''
+        encoded = key.encode()
+        if len(encoded) > MAX_KEY_SIZE:
+            return None
+
+        val = Value()
+        val.ParseFromString(data)
+        if val.type != NUMPY or len(val.body) > self.capacity():
+            return None
+
+        with self._locked():
+            found = self._probe(encoded)
+            if found is None:
+                found = self._insert(encoded, val.body)
+                if found is None:
+                    return None
+
+                self.inserts += 1
+
+        return self._load(*found)
+
+    def size(self):
+        return self._read_header()[2]
+
+    def capacity(self):
+        return self._read_header()[4]
+
+    def keys(self):
+        '''
+        Returns the keys of the values in the cache.
+        '''
+        while True:
+            start = self._sequence()
+            if start % 2 == 1:
+                self._wait_for_writer()
+                continue
+
+            keys = []
+            for idx in range(self.slots):
+                state, _, _, key = self._read_slot(idx)
+                if state == USED:
+                    keys.append(key.rstrip(b'\0').decode())
+
+            if self._sequence() == start:
+                return keys
+
+    def publish(self, kvs, writer=None):
+        '''
+        Writes the keys in the cache to the KVS, if they changed since we last
+        did, so that schedulers send requests that read them to this node.
+        '''
+        sequence = self._sequence()
+        if sequence == self.published:
+            return
+
+        keys = StringSet()
+        keys.keys.extend(self.keys())
+        lattice = LWWPairLattice(sutils.generate_timestamp(0),
+                                 keys.SerializeToString())
+
+        key = sutils.get_node_cache_key(self.ip)
+        if writer:
+            writer.put(key, lattice)
+        else:
+            kvs.put(key, lattice)
+
+        self.published = sequence
+
+    def trim(self):
+        '''
+        Closes the segments of values that were evicted, unless we still use
+        them.
+        '''
+        live = set()
+        for idx in range(self.slots):
+            state, generation, _, _ = self._read_slot(idx)
+            if state == USED:
+                live.add(self._segment_name(generation))
+
+        for name in list(self.segments.keys()):
+            if name not in live:
+                try:
+                    self.segments[name].close()
+                except BufferError:
+                    # A value read from this segment is still in use.
+                    continue
+
+                del self.segments[name]
+
+    def close(self, unlink=False):
+        '''
+        Detaches from the cache. If we are the last executor on the node that
+        uses it, or unlink is set, the cache is removed from the node.
+        '''
+        if unlink or self._only_user():
+            with self._locked():
+                self._clear()
+
+            # The lock files stay, because an executor that is starting may
+            # be waiting on them.
+            self._unlink(self.name)
+
+        for segment in self.segments.values():
+            try:
+                segment.close()
+            except BufferError:
+                pass
+
+        self.segments.clear()
+        self.index.close()
+        self.lock_file.close()
+        self.users_file.close()
+
+    def _lookup(self, encoded):
+        while True:
+            start = self._sequence()
+            if start % 2 == 1:
+                self._wait_for_writer()
+                continue
+
+            found = self._probe(encoded)
+            if self._sequence() == start:
+                return found
+
+    def _probe(self, encoded):
+        # Returns the generation and size of the value of a key, or None if it
+        # is not in the index.
+        idx = self._home(encoded)
+        for _ in range(self.slots):
+            state, generation, size, key = self._read_slot(idx)
+            if state == EMPTY:
+                return None
+
+            if key.rstrip(b'\0') == encoded:
+                return generation, size
+
+            idx = (idx + 1) % self.slots
+
+        return None
+
+    def _insert(self, encoded, body):
+        sequence, generation, used, entries, capacity = self._read_header()
+        generation += 1
+
+        segment = transport.create_segment(self._segment_name(generation),
+                                           body, shared=True)
+        if segment is None:
+            return None
+
+        self.segments[self._segment_name(generation)] = segment
+
+        self._write_sequence(sequence + 1)
+        while len(body) + used > capacity or entries >= self.max_entries:
+            used, entries = self._evict(used, entries)
+
+        idx = self._home(encoded)
+        while self._read_slot(idx)[0] == USED:
+            idx = (idx + 1) % self.slots
+
+        self._write_slot(idx, USED, generation, len(body), encoded)
+        self._write_header(sequence + 1, generation, used + len(body),
+                           entries + 1, capacity)
+        self._write_sequence(sequence + 2)
+
+        return generation, len(body)
+
+    def _evict(self, used, entries):
+        # Removes the oldest of a sample of the values, and shifts back the
+        # entries after it that would otherwise no longer be found. Keys are
+        # spread over the index by their hash, so consecutive slots make for a
+        # random sample.
+        start = random.randrange(self.slots)
+        oldest = None
+        sampled = 0
+        for offset in range(self.slots):
+            idx = (start + offset) % self.slots
+            state, generation, size, _ = self._read_slot(idx)
+            if state != USED:
+                continue
+
+            if oldest is None or generation < oldest[1]:
+                oldest = (idx, generation, size)
+
+            sampled += 1
+            if sampled == EVICTION_SAMPLES:
+                break
+
+        hole, generation, size = oldest
+        self._unlink(self._segment_name(generation))
+
+        idx = hole
+        while True:
+            idx = (idx + 1) % self.slots
+            state, _, _, key = self._read_slot(idx)
+            if state == EMPTY:
+                break
+
+            home = self._home(key.rstrip(b'\0'))
+            if (home - hole - 1) % self.slots <= (idx - hole - 1) % self.slots:
+                # This entry's probe sequence starts after the hole.
+                continue
+
+            self._copy_slot(idx, hole)
+            hole = idx
+
+        self._write_slot(hole, EMPTY, 0, 0, b'')
+        return used - size, entries - 1
+
+    def _clear(self):
+        # Removes every value, including one a writer that died may have
+        # created before adding it. The generation keeps growing, so that no
+        # segment name is reused.
+        sequence, generation, _, _, capacity = self._read_header()
+        sequence |= 1
+
+        self._write_sequence(sequence)
+        for idx in range(self.slots):
+            state, slot_generation, _, _ = self._read_slot(idx)
+            if state == USED:
+                self._unlink(self._segment_name(slot_generation))
+
+            self._write_slot(idx, EMPTY, 0, 0, b'')
+
+        self._unlink(self._segment_name(generation + 1))
+        self._write_header(sequence, generation + 1, 0, 0, capacity)
+        self._write_sequence(sequence + 1)
+
+    def _resize(self, capacity):
+        sequence, generation, used, entries, _ = self._read_header()
+
+        self._write_sequence(sequence + 1)
+        while used > capacity:
+            used, entries = self._evict(used, entries)
+
+        self._write_header(sequence + 1, generation, used, entries, capacity)
+        self._write_sequence(sequence + 2)
+
+    def _wait_for_writer(self):
+        # The index is being changed. If no one holds the lock, the writer
+        # that was changing it died, and taking the lock repairs the index.
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            time.sleep(0)
+            return
+
+        try:
+            self._repair()
+        finally:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+    def _repair(self):
+        if self._sequence() % 2 == 1:
+            logging.error('An executor died while changing the node cache; '
+                          'clearing it.')
+            self._clear()
+
+    def _only_user(self):
+        # Whether no other executor on the node uses the cache. We give up our
+        # own shared lock to find out.
+        try:
+            fcntl.flock(self.users_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+
+        return True
+
+    def _load(self, generation, size):
+        name = self._segment_name(generation)
+        if name not in self.segments:
+            segment = transport.attach_segment(name)
+            if segment is None:
+                # The value was evicted after we looked it up.
+                return None
+
+            self.segments[name] = segment
+
+        segment = self.segments[name]
+        start = transport.HEADER_SIZE
+        return pa.deserialize(pa.py_buffer(segment.buf[start:start + size]))
+
+    def _home(self, encoded):
+        digest = hashlib.sha1(encoded).digest()
+        return int.from_bytes(digest[:8], 'big') % self.slots
+
+    def _segment_name(self, generation):
+        return '%s-%x' % (self.name, generation)
+
+    def _unlink(self, name):
+        segment = transport.attach_segment(name)
+        if segment is not None:
+            segment.close()
+            transport.remove_segment(segment)
+
+    def _sequence(self):
+        return struct.unpack_from('<Q', self.index.buf, 0)[0]
+
+    def _write_sequence(self, sequence):
+        struct.pack_into('<Q', self.index.buf, 0, sequence)
+
+    def _read_header(self):
+        return HEADER.unpack_from(self.index.buf, 0)
+
+    def _write_header(self, *fields):
+        HEADER.pack_into(self.index.buf, 0, *fields)
+
+    def _read_slot(self, idx):
+        return SLOT.unpack_from(self.index.buf, HEADER.size + idx * SLOT.size)
+
+    def _write_slot(self, idx, state, generation, size, key):
+        SLOT.pack_into(self.index.buf, HEADER.size + idx * SLOT.size, state,
+                       generation, size, key)
+
+    def _copy_slot(self, source, dest):
+        self._write_slot(dest, *self._read_slot(source))
+
+    @contextmanager
+    def _locked(self):
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        try:
+            self._repair()
+            yield
+        finally:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
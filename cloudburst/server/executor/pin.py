@@ -17,6 +17,7 @@ import sys
 
 import cloudburst.server.utils as sutils
 from cloudburst.server.executor import utils
+from cloudburst.shared.proto.cloudburst_pb2 import GenericResponse
 from cloudburst.shared.proto.internal_pb2 import PinFunction
 
 
@@ -29,31 +30,40 @@ def pin(pin_socket, pusher_cache, kvs, status, function_cache, runtimes,
     sckt = pusher_cache.get(sutils.get_pin_accept_port(pin_msg.response_address))
     name = pin_msg.name
 
+    # The scheduler may have many pin requests outstanding, so we tell it which
+    # one we are responding to.
+    response = GenericResponse()
+    response.response_id = pin_msg.id
+
     # We currently only allow one pinned function per container in non-local
     # mode.
     if not local:
         if (len(function_cache) > 0 and name not in function_cache):
-            sutils.error.SerializeToString()
-            sckt.send(sutils.error.SerializeToString())
+            response.success = False
+            sckt.send(response.SerializeToString())
             return batching
 
-    func = utils.retrieve_function(pin_msg.name, kvs, user_library)
+    # The functions fused after this one are pinned along with it, since they
+    # run as part of its requests.
+    for fname in [name] + list(pin_msg.fused):
+        func = utils.retrieve_function(fname, kvs, user_library)
 
-    # The function must exist -- because otherwise the DAG couldn't be
-    # registered -- so we keep trying to retrieve it.
-    while not func:
-        func = utils.retrieve_function(name, kvs, user_library)
+        # The function must exist -- because otherwise the DAG couldn't be
+        # registered -- so we keep trying to retrieve it.
+        while not func:
+            func = utils.retrieve_function(fname, kvs, user_library)
 
-    if name not in function_cache:
-        function_cache[name] = func
+        if fname not in function_cache:
+            function_cache[fname] = func
 
-    if name not in status.functions:
-        status.functions.append(name)
+        if fname not in status.functions:
+            status.functions.append(fname)
 
-    # Add metadata tracking for the newly pinned functions.
-    runtimes[name] = []
-    exec_counts[name] = 0
-    logging.info('Adding function %s to my local pinned functions.' % (name))
+        # Add metadata tracking for the newly pinned functions.
+        runtimes[fname] = []
+        exec_counts[fname] = 0
+        logging.info('Adding function %s to my local pinned functions.' %
+                     (fname))
 
     if pin_msg.batching and len(status.functions) > 1:
         raise RuntimeError('There is more than one pinned function (we are'
@@ -62,7 +72,8 @@ def pin(pin_socket, pusher_cache, kvs, status, function_cache, runtimes,
                            + ' is not allowed -- you can only use batching in'
                            + ' cluster mode or in local mode with one function.')
 
-    sckt.send(sutils.ok_resp)
+    response.success = True
+    sckt.send(response.SerializeToString())
 
     return pin_msg.batching
 
@@ -0,0 +1,83 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import heapq
+
+from cloudburst.server.executor import utils
+
+
+class ReadyQueue():
+    '''
+    The requests on an executor that are ready to run, as (function name,
+    request keys) entries: a single request, or a batch for a batching-enabled
+    function. Entries are taken in order of priority class (highest first),
+    then by deadline (earliest first, with requests without a deadline last).
+
+    Otherwise, tenants share the executor in proportion to their weights, by
+    self-clocked weighted fair queueing: each request is tagged with a virtual
+    finish time, which is its tenant's previous finish time (or the virtual
+    time, if that is later) plus the inverse of the tenant's weight, and the
+    virtual time advances to the tag of each entry that is taken. Requests
+    that are equally urgent are taken in the order they were added. A batch is
+    as urgent as its most urgent request.
+    '''
+
+    def __init__(self):
+        self.heap = []
+
+        # The virtual time, and the virtual finish time of each tenant's most
+        # recently added request.
+        self.virtual_time = 0.0
+        self.finish_times = {}
+
+        # Breaks ties between entries that are equally urgent, so they are
+        # taken in the order in which they were added.
+        self.count = 0
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, fname, keys, schedules):
+        priority = max(utils.get_priority(schedule) for schedule in schedules)
+
+        deadline = float('inf')
+        finish = float('inf')
+        for schedule in schedules:
+            request_deadline = utils.get_deadline(schedule)
+            if request_deadline is not None:
+                deadline = min(deadline, request_deadline)
+
+            tenant = utils.get_tenant(schedule)
+            start = max(self.virtual_time, self.finish_times.get(tenant, 0.0))
+            self.finish_times[tenant] = start + 1 / utils.get_weight(schedule)
+            finish = min(finish, self.finish_times[tenant])
+
+        heapq.heappush(self.heap, (-priority, deadline, finish, self.count,
+                                   fname, keys))
+        self.count += 1
+
+    def pop(self):
+        '''
+        Removes the most urgent entry and returns its function name and request
+        keys.
+        '''
+        _, _, finish, _, fname, keys = heapq.heappop(self.heap)
+        self.virtual_time = max(self.virtual_time, finish)
+
+        # Once nothing is queued, every tenant starts over at the virtual time,
+        # so we no longer need to remember their finish times.
+        if len(self.heap) == 0:
+            self.finish_times.clear()
+
+        return fname, keys
@@ -24,13 +24,45 @@ import zmq
 
 from cloudburst.server import utils as sutils
 from cloudburst.server.executor import utils
-from cloudburst.server.executor.call import exec_function, exec_dag_function
+from cloudburst.server.executor.batching import (
+    AdaptiveBatcher,
+    BATCH_SIZE_LIMIT
+)
+from cloudburst.server.executor.binding import LateBinder
+from cloudburst.server.executor.coalescer import WriteCoalescer
+from cloudburst.server.executor.hedging import HedgeTracker
+from cloudburst.server.executor.call import (
+    exec_function,
+    exec_dag_function,
+    object_references,
+    prefetch_references,
+    receive_prefetched
+)
+from cloudburst.server.executor.memo import MEMO_CAPACITY, ResultCache
+from cloudburst.server.executor.node_cache import (
+    NODE_CACHE_CAPACITY,
+    NodeCache
+)
 from cloudburst.server.executor.pin import pin, unpin
+from cloudburst.server.executor.ready import ReadyQueue
+from cloudburst.server.executor.status import StatusReporter
+from cloudburst.server.executor.store import (
+    OBJECT_CAPACITY,
+    OBJECT_THRESHOLD,
+    OBJECT_TTL,
+    ObjectStore
+)
+from cloudburst.server.executor.tracker import RequestTracker
+from cloudburst.server.executor.transport import (
+    bind_peer_socket,
+    TransportCache
+)
 from cloudburst.server.executor.user_library import CloudburstUserLibrary
 from cloudburst.shared.anna_ipc_client import AnnaIpcClient
 from cloudburst.shared.proto.cloudburst_pb2 import (
     DagSchedule,
     DagTrigger,
+    NORMAL, # Cloudburst's consistency modes
     MULTIEXEC # Cloudburst's execution types
 )
 from cloudburst.shared.proto.internal_pb2 import (
@@ -40,10 +72,31 @@ from cloudburst.shared.proto.internal_pb2 import (
 )
 
 REPORT_THRESH = 5
-BATCH_SIZE_MAX = 20
 
+# How long we remember a finished request, so that we can drop duplicate
+# schedules and triggers for it.
+FINISHED_TTL = 10
+
+# How long a request may wait for its schedule and triggers before we assume
+# that an upstream function failed and drop it.
+REQUEST_TTL = 300
 
-def executor(ip, mgmt_ip, schedulers, thread_id):
+# How long a departing executor keeps running at least, so that schedules and
+# triggers that were already in flight when it left still reach it and can be
+# re-routed.
+DRAIN_GRACE = 1
+
+# The upper bound on how long a departing executor waits for outstanding work
+# before handing off everything that is left and exiting.
+DRAIN_TIMEOUT = 30
+
+
+def executor(ip, mgmt_ip, schedulers, thread_id, request_ttl=REQUEST_TTL,
+             finished_ttl=FINISHED_TTL, prefetch_children=False,
+             memo_capacity=MEMO_CAPACITY, memo_ttl=None,
+             object_threshold=OBJECT_THRESHOLD,
+             object_capacity=OBJECT_CAPACITY, object_ttl=OBJECT_TTL,
+             node_cache_capacity=NODE_CACHE_CAPACITY, batching_conf=None):
     logging.basicConfig(filename='log_executor.txt', level=logging.INFO,
                         format='%(asctime)s %(message)s')
 
@@ -67,19 +120,19 @@ def executor(ip, mgmt_ip, schedulers, thread_id):
     exec_socket.bind(sutils.BIND_ADDR_TEMPLATE % (sutils.FUNC_EXEC_PORT +
                                                   thread_id))
 
+    # The sockets other executors send to are also bound on IPC, which the
+    # executors on our own node use instead of TCP.
     dag_queue_socket = context.socket(zmq.PULL)
-    dag_queue_socket.bind(sutils.BIND_ADDR_TEMPLATE % (sutils.DAG_QUEUE_PORT
-                                                       + thread_id))
+    bind_peer_socket(dag_queue_socket, sutils.DAG_QUEUE_PORT + thread_id)
 
     dag_exec_socket = context.socket(zmq.PULL)
-    dag_exec_socket.bind(sutils.BIND_ADDR_TEMPLATE % (sutils.DAG_EXEC_PORT
-                                                      + thread_id))
+    bind_peer_socket(dag_exec_socket, sutils.DAG_EXEC_PORT + thread_id)
 
     self_depart_socket = context.socket(zmq.PULL)
     self_depart_socket.bind(sutils.BIND_ADDR_TEMPLATE %
                             (sutils.SELF_DEPART_PORT + thread_id))
 
-    pusher_cache = SocketCache(context, zmq.PUSH)
+    pusher_cache = TransportCache(SocketCache(context, zmq.PUSH), ip)
 
     poller = zmq.Poller()
     poller.register(pin_socket, zmq.POLLIN)
@@ -101,19 +154,48 @@ def executor(ip, mgmt_ip, schedulers, thread_id):
     user_library = CloudburstUserLibrary(context, pusher_cache, ip, thread_id,
                                       client)
 
+    # Responses to the reference prefetches we start when a schedule arrives.
+    prefetch_socket = client.prefetch_response_socket
+    poller.register(prefetch_socket, zmq.POLLIN)
+
+    # Function results are written to the KVS in batches, and their acks are
+    # processed as they arrive on these sockets.
+    writer = WriteCoalescer(client)
+    put_ack_socket = client.put_ack_socket
+    causal_put_ack_socket = client.causal_put_ack_socket
+    poller.register(put_ack_socket, zmq.POLLIN)
+    poller.register(causal_put_ack_socket, zmq.POLLIN)
+
+    # Holds the large results we pass to other functions until they read them.
+    store = ObjectStore(ip, thread_id, context, pusher_cache, client, writer,
+                        object_threshold, object_capacity, object_ttl)
+    poller.register(store.request_socket, zmq.POLLIN)
+    poller.register(store.response_socket, zmq.POLLIN)
+
     status = ThreadStatus()
     status.ip = ip
     status.tid = thread_id
     status.running = True
     status.type = exec_type
-    utils.push_status(schedulers, pusher_cache, status)
+
+    # Sends our status to the schedulers: changes are sent as rate-limited
+    # deltas, and the full status on every report tick.
+    reporter = StatusReporter(schedulers, pusher_cache, status)
+    reporter.push_full()
 
     departing = False
+    depart_start = None
+
+    # Requests that we handed off to another replica while departing, mapped
+    # to their schedule and the number of triggers we still expect to receive
+    # (and forward) for them.
+    handed_off = {}
 
-    # Maintains a request queue for each function pinned on this executor. Each
-    # function will have a set of request IDs mapped to it, and this map stores
-    # a schedule for each request ID.
-    queue = {}
+    # Tracks every outstanding DAG request for the functions pinned on this
+    # executor: its schedule, the triggers received so far (which may arrive
+    # before the schedule), and when it arrived. It also remembers recently
+    # finished requests so that we can drop duplicate triggers for them.
+    requests = RequestTracker()
 
     # Tracks the actual function objects that are pinned to this executor.
     function_cache = {}
@@ -121,15 +203,6 @@ def executor(ip, mgmt_ip, schedulers, thread_id):
     # Tracks runtime cost of excuting a DAG function.
     runtimes = {}
 
-    # If multiple triggers are necessary for a function, track the triggers as
-    # we receive them. This is also used if a trigger arrives before its
-    # corresponding schedule.
-    received_triggers = {}
-
-    # Tracks when we received a function request, so we can report end-to-end
-    # latency for the whole executio.
-    receive_times = {}
-
     # Tracks the number of requests we are finishing for each function pinned
     # here.
     exec_counts = {}
@@ -138,36 +211,104 @@ def executor(ip, mgmt_ip, schedulers, thread_id):
     # sink function.
     dag_runtimes = {}
 
+    # Tracks how long after it was scheduled each request we finished took,
+    # for each tenant.
+    tenant_latencies = {}
+
     # A map with KVS keys and their corresponding deserialized payloads.
     cache = {}
 
-    # A map which tracks the most recent DAGs for which we have finished our
-    # work.
-    finished_executions = {}
+    # The arrays read by any executor on our node, which we share with them.
+    node_cache = None
+    if node_cache_capacity > 0:
+        node_cache = NodeCache(ip, node_cache_capacity)
+
+    # The KVS keys we have requested but not yet received, mapped to whether
+    # their payloads should be deserialized.
+    prefetching = {}
 
     # The set of pinned functions and whether they support batching. NOTE: This
     # is only a set for local mode -- in cluster mode, there will only be one
     # pinned function per executor.
     batching = False
 
+    # The batchers that form batches for each batching-enabled function. The
+    # functions in batching_conf have their own batch size and linger limits;
+    # the others get the default ones when their first request is queued.
+    if batching_conf is None:
+        batching_conf = {}
+
+    batchers = {fname: AdaptiveBatcher(**limits) for fname, limits in
+                batching_conf.items()}
+
+    # The ready queue: (function name, request keys) pairs that are ready to
+    # run, regardless of whether their schedule or their last trigger arrived
+    # last. We run the most urgent one in each iteration of the event loop.
+    ready = ReadyQueue()
+
+    # Holds the hedged requests for which we are the second replica until the
+    # first replica has had a chance to finish them.
+    hedges = HedgeTracker(ip + ':' + str(thread_id))
+
+    # Picks the executors of the late-bound functions we send triggers to.
+    binder = LateBinder(status)
+
+    # The memoized results of the pure functions we run. If memo_ttl is set,
+    # results are shared with the other executors through the KVS.
+    memo = ResultCache(client, memo_capacity, memo_ttl)
+    memo.refresh()
+
     # Internal metadata to track thread utilization.
     report_start = time.time()
     event_occupancy = {'pin': 0.0,
                        'unpin': 0.0,
                        'func_exec': 0.0,
                        'dag_queue': 0.0,
-                       'dag_exec': 0.0}
+                       'dag_exec': 0.0,
+                       'prefetch': 0.0,
+                       'write': 0.0}
     total_occupancy = 0.0
 
+    # The number of requests dropped since the last report, split by whether
+    # their schedule had arrived.
+    expired_schedules = 0
+    expired_triggers = 0
+
+    # The number of ready requests dropped since the last report because their
+    # deadline had passed.
+    missed_deadlines = 0
+
     while True:
-        socks = dict(poller.poll(timeout=1000))
+        # Wake up in time to run any batch whose linger time runs out, to send
+        # any writes whose coalescing window runs out, to send any held back
+        # status change, to run any hedged request that is due, and to check
+        # the KVS for objects whose owners have not answered.
+        deadlines = [batchers[fname].deadline() for fname in batchers]
+        deadlines.append(writer.deadline())
+        deadlines.append(reporter.deadline())
+        deadlines.append(hedges.deadline())
+        deadlines.append(store.deadline())
+
+        timeout = 1000
+        for deadline in deadlines:
+            if deadline is not None:
+                timeout = min(timeout, max(0, (deadline - time.time()) * 1000))
+
+        # If there is work to do, we only check for new messages.
+        if len(ready) > 0:
+            timeout = 0
+
+        socks = dict(poller.poll(timeout=timeout))
 
         if pin_socket in socks and socks[pin_socket] == zmq.POLLIN:
             work_start = time.time()
             batching = pin(pin_socket, pusher_cache, client, status,
                            function_cache, runtimes, exec_counts, user_library,
                            local, batching)
-            utils.push_status(schedulers, pusher_cache, status)
+            reporter.update()
+
+            # The newly pinned function may have been registered as pure.
+            memo.refresh()
 
             elapsed = time.time() - work_start
             event_occupancy['pin'] += elapsed
@@ -177,7 +318,7 @@ def executor(ip, mgmt_ip, schedulers, thread_id):
             work_start = time.time()
             unpin(unpin_socket, status, function_cache, runtimes,
                   exec_counts)
-            utils.push_status(schedulers, pusher_cache, status)
+            reporter.update()
 
             elapsed = time.time() - work_start
             event_occupancy['unpin'] += elapsed
@@ -186,11 +327,9 @@ def executor(ip, mgmt_ip, schedulers, thread_id):
         if exec_socket in socks and socks[exec_socket] == zmq.POLLIN:
             work_start = time.time()
             exec_function(exec_socket, client, user_library, cache,
-                          function_cache)
+                          function_cache, writer, memo, node_cache)
             user_library.close()
 
-            utils.push_status(schedulers, pusher_cache, status)
-
             elapsed = time.time() - work_start
             event_occupancy['func_exec'] += elapsed
             total_occupancy += elapsed
@@ -199,10 +338,10 @@ def executor(ip, mgmt_ip, schedulers, thread_id):
             work_start = time.time()
 
             # In order to effectively support batching, we have to make sure we
-            # dequeue lots of schedules in addition to lots of triggers. Right
-            # now, we're not going to worry about supporting batching here,
-            # just on the trigger dequeue side, but we still have to dequeue
-            # all schedules we've received. We just process them one at a time.
+            # dequeue lots of schedules in addition to lots of triggers. A
+            # schedule that completes a request (because its triggers arrived
+            # first) is handled exactly like a trigger that does: the request
+            # joins the ready queue, from which batches are formed below.
             while True:
                 schedule = DagSchedule()
                 try:
@@ -215,78 +354,56 @@ def executor(ip, mgmt_ip, schedulers, thread_id):
 
                 schedule.ParseFromString(msg)
                 fname = schedule.target_function
+                key = (schedule.id, fname)
 
                 logging.info('Received a schedule for DAG %s (%s), function %s.' %
                              (schedule.dag.name, schedule.id, fname))
+                binder.observe(schedule)
 
-                if fname not in queue:
-                    queue[fname] = {}
-
-                queue[fname][schedule.id] = schedule
-
-                if (schedule.id, fname) not in receive_times:
-                    receive_times[(schedule.id, fname)] = time.time()
+                # Start fetching the request's references now, so that they
+                # are not on the critical path once its triggers arrive. Only
+                # normal mode reads go through the cache.
+                if (schedule.consistency == NORMAL and not departing and
+                        not requests.is_finished(key)):
+                    prefetch_references(client, schedule, cache, prefetching,
+                                        prefetch_children, node_cache)
 
                 # In case we receive the trigger before we receive the schedule, we
                 # can trigger from this operation as well.
-                trkey = (schedule.id, fname)
-                fref = None
-
-                # Check to see what type of execution this function is.
-                for ref in schedule.dag.functions:
-                    if ref.name == fname:
-                        fref = ref
-
-                if (trkey in received_triggers and
-                        ((len(received_triggers[trkey]) == len(schedule.triggers))
-                         or (fref.type == MULTIEXEC))):
-
-                    triggers = list(received_triggers[trkey].values())
-
-                    if fname not in function_cache:
-                        logging.error('%s not in function cache', fname)
-                        utils.generate_error_response(schedule, client, fname)
-                        continue
-
-                    # We don't support actual batching for when we receive a
-                    # schedule before a trigger, so everything is just a batch of
-                    # size 1 if anything.
-                    success = exec_dag_function(pusher_cache, client,
-                                                [triggers], function_cache[fname],
-                                                [schedule], user_library,
-                                                dag_runtimes, cache, schedulers,
-                                                batching)[0]
-                    user_library.close()
-
-                    del received_triggers[trkey]
-                    if success:
-                        logging.info("Function %s was a success" % (fname))
-                        del queue[fname][schedule.id]
-
-                        fend = time.time()
-                        fstart = receive_times[(schedule.id, fname)]
-                        runtimes[fname].append(fend - work_start)
-                        exec_counts[fname] += 1
-
-                        finished_executions[(schedule.id, fname)] = time.time()
+                if requests.add_schedule(schedule, time.time()):
+                    _mark_ready(key, requests, function_cache, client,
+                                batching, batchers, ready, hedges, store)
+                elif departing and key in requests:
+                    # We cannot run this request right now; if we are leaving,
+                    # another replica will have to run it instead.
+                    _handoff(key, requests, handed_off, schedulers,
+                             pusher_cache, status, store)
 
             elapsed = time.time() - work_start
             event_occupancy['dag_queue'] += elapsed
             total_occupancy += elapsed
 
-        if dag_exec_socket in socks and socks[dag_exec_socket] == zmq.POLLIN:
+        # The objects that requests were waiting for and that arrived, or
+        # were given up on, in this iteration.
+        arrived = []
+
+        if prefetch_socket in socks and socks[prefetch_socket] == zmq.POLLIN:
             work_start = time.time()
+            arrived = receive_prefetched(client, cache, prefetching,
+                                         node_cache, store)
 
-            # How many messages to dequeue -- BATCH_SIZE_MAX or 1 depending on
-            # the function configuration.
-            if batching:
-                count = BATCH_SIZE_MAX
-            else:
-                count = 1
+            elapsed = time.time() - work_start
+            event_occupancy['prefetch'] += elapsed
+            total_occupancy += elapsed
 
-            trigger_keys = set()
+        if dag_exec_socket in socks and socks[dag_exec_socket] == zmq.POLLIN:
+            work_start = time.time()
 
-            for _ in range(count): # Dequeue count number of messages.
+            # We dequeue up to BATCH_SIZE_LIMIT triggers, so that requests that
+            # become ready are ordered by urgency in the ready queue rather
+            # than by when they arrived. Batches themselves are formed by the
+            # function's batcher below.
+            for _ in range(BATCH_SIZE_LIMIT):
                 trigger = DagTrigger()
 
                 try:
@@ -299,110 +416,215 @@ def executor(ip, mgmt_ip, schedulers, thread_id):
 
                 trigger.ParseFromString(msg)
 
-
-                # We have received a repeated trigger for a function that has
-                # already finished executing.
-                if trigger.id in finished_executions:
-                    continue
-
                 fname = trigger.target_function
                 logging.info('Received a trigger for schedule %s, function %s.' %
                              (trigger.id, fname))
 
                 key = (trigger.id, fname)
-                trigger_keys.add(key)
-                if key not in received_triggers:
-                    received_triggers[key] = {}
-
-                if (trigger.id, fname) not in receive_times:
-                    receive_times[(trigger.id, fname)] = time.time()
-
-                received_triggers[key][trigger.source] = trigger
-
-            # Only execute the functions for which we have received a schedule.
-            # Everything else will wait.
-            for tid, fname in list(trigger_keys):
-                if fname not in queue or tid not in queue[fname]:
-                    trigger_keys.remove((tid, fname))
-
-            if len(trigger_keys) == 0:
-                continue
-
-            fref = None
-            schedule = queue[fname][list(trigger_keys)[0][0]] # Pick a random schedule to check.
-            # Check to see what type of execution this function is.
-            for ref in schedule.dag.functions:
-                if ref.name == fname:
-                    fref = ref
-                    break
-
-            # Compile a list of all the trigger sets for which we have
-            # enough triggers.
-            trigger_sets = []
-            schedules = []
-            for key in trigger_keys:
-                if (len(received_triggers[key]) == len(schedule.triggers)) or \
-                        fref.type == MULTIEXEC:
-
-                    if fref.type == MULTIEXEC:
-                        triggers = [trigger]
+
+                # The other replica of a hedged request finished it first, so
+                # we drop our copy, unless we already ran it. If we are the
+                # first replica and have not, the second one won.
+                if trigger.source == sutils.HEDGE_CANCEL:
+                    if (key in requests and
+                            requests.schedule(key) is not None and
+                            not hedges.is_backup(requests.schedule(key))):
+                        hedges.wins += 1
+
+                    if key in requests:
+                        _abandon_objects(requests.get(key), store)
+
+                    # Our copy may be waiting in its batcher.
+                    if fname in batchers and key in batchers[fname]:
+                        batchers[fname].remove(key)
+
+                    hedges.cancel(key)
+                    requests.cancel(key, time.time())
+                    continue
+
+                # We already handed this request off, so we forward the trigger
+                # to the scheduler, which knows where the request went.
+                if key in handed_off:
+                    schedule, remaining = handed_off[key]
+                    utils.handoff_request(schedulers, pusher_cache, status,
+                                          schedule, [trigger])
+
+                    if remaining <= 1:
+                        del handed_off[key]
                     else:
-                        triggers = list(received_triggers[key].values())
+                        handed_off[key][1] = remaining - 1
+                    continue
+
+                # Only execute the functions for which we have received a
+                # schedule and all triggers. Everything else will wait.
+                # Repeated triggers for requests that already finished are
+                # ignored.
+                if requests.add_trigger(trigger, time.time()):
+                    _mark_ready(key, requests, function_cache, client,
+                                batching, batchers, ready, hedges, store)
 
-                    if fname not in function_cache:
-                        logging.error('%s not in function cache', fname)
-                        utils.generate_error_response(schedule, client, fname)
-                        continue
+            elapsed = time.time() - work_start
+            event_occupancy['dag_exec'] += elapsed
+            total_occupancy += elapsed
 
-                    trigger_sets.append(triggers)
-                    schedule = queue[fname][key[0]]
-                    schedules.append(schedule)
+        # Requests that were waiting for objects held on other executors run
+        # once the objects have arrived, or have been given up on.
+        if (store.response_socket in socks and
+                socks[store.response_socket] == zmq.POLLIN):
+            arrived += store.receive()
+        arrived += store.retry()
+
+        for key in requests.objects_arrived(arrived):
+            _enqueue(key, requests, batching, batchers, ready)
+
+        # Hedged requests that the first replica has not finished in time are
+        # run here as well.
+        for key in hedges.take_due(time.time()):
+            if key in requests:
+                _queue(key, requests, batching, batchers, ready, store)
+
+        # Form batches out of requests that have either filled up their batch
+        # or have lingered long enough waiting for more requests. Requests
+        # that are cancelled are removed from their batcher.
+        for fname in batchers:
+            batch = batchers[fname].take()
+            if len(batch) > 0:
+                ready.push(fname, batch, [requests.schedule(key) for key in
+                                          batch])
+
+        # Requests whose deadline has passed are failed rather than run, since
+        # their result would arrive too late to be of use. Hedged requests
+        # that were cancelled while they waited are dropped.
+        keys = []
+        if len(ready) > 0:
+            fname, keys = ready.pop()
+            keys = [key for key in keys if key in requests]
+            keys, missed = _drop_missed_deadlines(keys, requests, client,
+                                                  store)
+            missed_deadlines += missed
+
+        if len(keys) > 0:
+            work_start = time.time()
 
+            # Compile a list of all the trigger sets for the ready requests.
+            schedules = [requests.schedule(key) for key in keys]
+            trigger_sets = [requests.triggers(key) for key in keys]
 
             # Pass all of the trigger_sets into exec_dag_function at once.
             # We also include the batching variaible to make sure we know
             # whether to pass lists into the fn or not.
-            if len(trigger_sets) > 0:
-                successes = exec_dag_function(pusher_cache, client,
-                                              trigger_sets,
-                                              function_cache[fname],
-                                              schedules, user_library,
-                                              dag_runtimes, cache,
-                                              schedulers, batching)
-                user_library.close()
-                del received_triggers[key]
-
-                for key, success in zip(trigger_keys, successes):
-                    if success:
-                        del queue[fname][key[0]] # key[0] is trigger.id.
-
-                        fend = time.time()
-                        fstart = receive_times[key]
-
-                        average_time = (fend - work_start) / len(trigger_keys)
-
-                        runtimes[fname].append(average_time)
+            # The functions of a fused chain report their own runtimes.
+            stage_runtimes = {}
+            successes = exec_dag_function(pusher_cache, client, trigger_sets,
+                                          function_cache[fname], schedules,
+                                          user_library, dag_runtimes, cache,
+                                          schedulers, batching, writer, memo,
+                                          function_cache, stage_runtimes,
+                                          binder, store, node_cache)
+            user_library.close()
+
+            elapsed = time.time() - work_start
+            if fname in batchers:
+                batchers[fname].record(len(keys), elapsed)
+
+            hedges.record(fname, elapsed / len(keys))
+
+            for stage in stage_runtimes:
+                runtimes[stage].extend(stage_runtimes[stage])
+                exec_counts[stage] += len(stage_runtimes[stage])
+
+            for key, schedule, success in zip(keys, schedules, successes):
+                if success:
+                    now = time.time()
+                    requests.finish(key, now)
+
+                    if fname not in stage_runtimes:
+                        runtimes[fname].append(elapsed / len(keys))
                         exec_counts[fname] += 1
 
-                        finished_executions[(schedule.id, fname)] = time.time()
+                    tenant = utils.get_tenant(schedule)
+                    if tenant not in tenant_latencies:
+                        tenant_latencies[tenant] = []
+                    tenant_latencies[tenant].append(now -
+                                                    schedule.start_time)
+
+                    # Whichever replica of a hedged request finishes first
+                    # tells the other one to drop it.
+                    other = hedges.get_other(schedule)
+                    if other is not None:
+                        _cancel_hedge(pusher_cache, key, other)
+                else:
+                    # A MULTIEXEC function returned an invalid result, so we
+                    # wait for its next trigger, unless it already arrived.
+                    if requests.clear_triggers(key):
+                        _mark_ready(key, requests, function_cache, client,
+                                    batching, batchers, ready, hedges, store)
 
-            elapsed = time.time() - work_start
             event_occupancy['dag_exec'] += elapsed
             total_occupancy += elapsed
 
+        work_start = time.time()
+        if ((put_ack_socket in socks and socks[put_ack_socket] == zmq.POLLIN)
+                or (causal_put_ack_socket in socks and
+                    socks[causal_put_ack_socket] == zmq.POLLIN)):
+            writer.receive_acks()
+
+        if (store.request_socket in socks and socks[store.request_socket] ==
+                zmq.POLLIN):
+            store.serve()
+
+        # Objects that not every consumer has read in time are written to the
+        # KVS along with our results.
+        store.expire()
+
+        writer.flush()
+
+        # The schedulers use our backlog to reject calls when we are
+        # saturated.
+        if len(requests) != status.backlog:
+            status.backlog = len(requests)
+            reporter.update()
+
+        # Send any status change that was held back by the rate limit.
+        reporter.flush()
+
+        elapsed = time.time() - work_start
+        event_occupancy['write'] += elapsed
+        total_occupancy += elapsed
+
         if self_depart_socket in socks and socks[self_depart_socket] == \
                 zmq.POLLIN:
             # This message does not matter.
             self_depart_socket.recv()
 
             logging.info('Preparing to depart. No longer accepting requests ' +
-                         'and clearing all queues.')
+                         'and handing off all pending requests.')
 
             status.ClearField('functions')
             status.running = False
-            utils.push_status(schedulers, pusher_cache, status)
+
+            # The schedulers need to stop sending us work right away.
+            reporter.update(urgent=True)
 
             departing = True
+            depart_start = time.time()
+
+            # Consumers of the objects we hold will find them in the KVS, and
+            # the results of the requests we still run are sent in triggers.
+            store.depart()
+
+            # Any request that is still waiting on triggers will be run by
+            # another replica; requests that are ready will be run here as
+            # they are dequeued.
+            for key in requests.keys():
+                if (requests.schedule(key) is not None and
+                        not requests.is_ready(key)):
+                    _handoff(key, requests, handed_off, schedulers,
+                             pusher_cache, status, store)
+
+        if departing:
+            _drain(depart_start, requests, handed_off, writer, schedulers,
+                   pusher_cache, status, mgmt_ip, ip, store, node_cache)
 
         # periodically report function occupancy
         report_end = time.time()
@@ -412,12 +634,25 @@ def executor(ip, mgmt_ip, schedulers, thread_id):
                 for key in extra_keys:
                     del cache[key]
 
+            # Any prefetch that has not been answered by now is not going to
+            # be; the request will fetch its references itself.
+            prefetching.clear()
+
+            # The schedulers send requests that read the arrays in our node's
+            # cache to this node.
+            if node_cache is not None:
+                node_cache.trim()
+                node_cache.publish(client, writer)
+
+                status.node_cache_size = node_cache.size()
+                status.node_cache_capacity = node_cache.capacity()
+
             utilization = total_occupancy / (report_end - report_start)
             status.utilization = utilization
 
             # Periodically report my status to schedulers with the utilization
             # set.
-            utils.push_status(schedulers, pusher_cache, status)
+            reporter.push_full()
 
             logging.info('Total thread occupancy: %.6f' % (utilization))
 
@@ -445,6 +680,61 @@ def executor(ip, mgmt_ip, schedulers, thread_id):
 
                 dag_runtimes[dname].clear()
 
+            for tenant in tenant_latencies:
+                tstats = stats.tenants.add()
+                tstats.name = tenant
+                tstats.call_count = len(tenant_latencies[tenant])
+                tstats.latencies.extend(tenant_latencies[tenant])
+            tenant_latencies.clear()
+
+            stats.expired_schedules = expired_schedules
+            stats.expired_triggers = expired_triggers
+            stats.missed_deadlines = missed_deadlines
+            stats.hedged_requests = hedges.hedged
+            stats.hedge_wins = hedges.wins
+            hedges.hedged = 0
+            hedges.wins = 0
+
+            stats.late_bound = binder.late_bound
+            stats.late_bound_local = binder.local
+            binder.late_bound = 0
+            binder.local = 0
+
+            stats.objects_stored = store.stored
+            stats.object_local_fetches = store.local_fetches
+            stats.object_remote_fetches = store.remote_fetches
+            stats.objects_spilled = store.spilled
+            store.stored = 0
+            store.local_fetches = 0
+            store.remote_fetches = 0
+            store.spilled = 0
+
+            if node_cache is not None:
+                stats.node_cache_hits = node_cache.hits
+                stats.node_cache_misses = node_cache.misses
+                stats.node_cache_inserts = node_cache.inserts
+                node_cache.hits = 0
+                node_cache.misses = 0
+                node_cache.inserts = 0
+
+            stats.memo_hits = memo.hits
+            stats.memo_kvs_hits = memo.kvs_hits
+            stats.memo_misses = memo.misses
+            lookups = memo.hits + memo.kvs_hits + memo.misses
+            if lookups > 0:
+                logging.info('Memoized result hit rate: %.3f (%d lookups).' %
+                             ((memo.hits + memo.kvs_hits) / lookups, lookups))
+            memo.hits = 0
+            memo.kvs_hits = 0
+            memo.misses = 0
+
+            # Functions may have been registered as pure since we last
+            # checked.
+            memo.refresh()
+            expired_schedules = 0
+            expired_triggers = 0
+            missed_deadlines = 0
+
             # If we are running in cluster mode, mgmt_ip will be set, and we
             # will report our status and statistics to it. Otherwise, we will
             # write to the local conf file
@@ -464,34 +754,196 @@ def executor(ip, mgmt_ip, schedulers, thread_id):
 
             # Periodically clear any old functions we have cached that we are
             # no longer accepting requests for.
-            del_list = []
-            for fname in queue:
-                if len(queue[fname]) == 0 and fname not in status.functions:
-                    del_list.append(fname)
+            for fname in list(runtimes.keys()):
+                if (requests.pending(fname) == 0 and fname not in
+                        status.functions and not departing):
                     del function_cache[fname]
                     del runtimes[fname]
                     del exec_counts[fname]
 
-            for fname in del_list:
-                del queue[fname]
+            # Drop any requests that have been waiting for too long; their
+            # missing schedules or triggers are not going to arrive.
+            now = time.time()
+            for request in requests.expire(now - request_ttl, now):
+                _abandon_objects(request, store)
+
+                # The first replica of a hedged request reports it if it
+                # expires, so the second one drops it silently.
+                if (request.schedule is not None and
+                        hedges.is_backup(request.schedule)):
+                    continue
+
+                if request.schedule is not None:
+                    schedule = request.schedule
+                    logging.error('Request %s for function %s expired.' %
+                                  (schedule.id, schedule.target_function))
+                    utils.generate_error_response(schedule, client,
+                                                  schedule.target_function,
+                                                  'timed out waiting for ' +
+                                                  'triggers')
+                    expired_schedules += 1
+                else:
+                    expired_triggers += 1
+
+            requests.prune_finished(now - finished_ttl)
+
+
+def _mark_ready(key, requests, function_cache, client, batching, batchers,
+                ready, hedges, store):
+    fname = key[1]
+    if fname not in function_cache:
+        logging.error('%s not in function cache', fname)
+        utils.generate_error_response(requests.schedule(key), client, fname)
+        _abandon_objects(requests.get(key), store)
+        requests.finish(key, time.time())
+        return
+
+    # We only run our copy of a hedged request if the first replica does not
+    # finish it in time.
+    if hedges.hold(key, requests.schedule(key), time.time()):
+        return
+
+    _queue(key, requests, batching, batchers, ready, store)
+
+
+def _queue(key, requests, batching, batchers, ready, store):
+    # Requests that read objects held on other executors wait until those
+    # arrive, so that fetching them never holds up the event loop.
+    objects = [ref.key for ref in object_references(requests.triggers(key))
+               if store.request(ref)]
+    requests.wait_for_objects(key, objects)
+    if len(objects) > 0:
+        return
+
+    _enqueue(key, requests, batching, batchers, ready)
+
+
+def _enqueue(key, requests, batching, batchers, ready):
+    # Requests for batching functions wait in their batcher until a batch is
+    # formed; everything else joins the ready queue right away.
+    fname = key[1]
+    if batching:
+        if fname not in batchers:
+            batchers[fname] = AdaptiveBatcher(BATCH_SIZE_LIMIT)
+
+        batchers[fname].add(key)
+    else:
+        ready.push(fname, [key], [requests.schedule(key)])
+
 
-            del_list = []
-            for tid in finished_executions:
-                if (time.time() - finished_executions[tid]) > 10:
-                    del_list.append(tid)
+def _cancel_hedge(pusher_cache, key, location):
+    trigger = DagTrigger()
+    trigger.id, trigger.target_function = key
+    trigger.source = sutils.HEDGE_CANCEL
 
-            for tid in del_list:
-                del finished_executions[tid]
+    sckt = pusher_cache.get(sutils.get_dag_trigger_address(location))
+    sckt.send(trigger.SerializeToString())
 
-            # If we are departing and have cleared our queues, let the
-            # management server know, and exit the process.
-            if departing and len(queue) == 0:
-                sckt = pusher_cache.get(utils.get_depart_done_addr(mgmt_ip))
-                sckt.send_string(ip)
 
-                # We specifically pass 1 as the exit code when ending our
-                # process so that the wrapper script does not restart us.
-                sys.exit(1)
+def _abandon_objects(request, store):
+    # Lets the owners of the objects a dropped request refers to know that it
+    # is not going to read them, so that they are freed without waiting for
+    # their TTL. A MULTIEXEC request has only fetched the objects of the
+    # trigger it runs with next.
+    if request.multiexec:
+        triggers = request.unrun
+    else:
+        triggers = list(request.triggers.values())
+
+    for i, trigger in enumerate(triggers):
+        requested = request.requested and (i == 0 or not request.multiexec)
+        for ref in object_references([trigger]):
+            store.abandon(ref, requested)
+
+
+def _drop_missed_deadlines(keys, requests, client, store):
+    '''
+    Fails the requests whose deadline has passed, and returns the keys of the
+    remaining requests and the number of requests that were failed.
+    '''
+    now = time.time()
+
+    remaining = []
+    for key in keys:
+        schedule = requests.schedule(key)
+        deadline = utils.get_deadline(schedule)
+
+        if deadline is not None and deadline < now:
+            logging.info('Request %s for function %s missed its deadline.' %
+                         key)
+            utils.generate_error_response(schedule, client, key[1],
+                                          'missed its deadline')
+            _abandon_objects(requests.get(key), store)
+            requests.finish(key, now)
+        else:
+            remaining.append(key)
+
+    return remaining, len(keys) - len(remaining)
+
+
+def _handoff(key, requests, handed_off, schedulers, pusher_cache, status,
+             store):
+    # If we are the second replica of a hedged request, the first one will
+    # run it, so there is nothing to hand off.
+    schedule = requests.schedule(key)
+    address = status.ip + ':' + str(status.tid)
+    if sutils.get_hedge_location(schedule, key[1]) == address:
+        _abandon_objects(requests.get(key), store)
+        requests.cancel(key, time.time())
+        return
+
+    request = requests.release(key)
+    triggers = list(request.triggers.values())
+
+    logging.info('Handing off request %s for function %s.' % key)
+    utils.handoff_request(schedulers, pusher_cache, status, schedule,
+                          triggers)
+
+    remaining = len(schedule.triggers) - len(triggers)
+    if remaining > 0:
+        handed_off[key] = [schedule, remaining]
+
+
+def _drain(depart_start, requests, handed_off, writer, schedulers,
+           pusher_cache, status, mgmt_ip, ip, store, node_cache=None):
+    elapsed = time.time() - depart_start
+
+    if elapsed > DRAIN_TIMEOUT:
+        # We have waited long enough: hand off everything we still have, and
+        # leave. Triggers whose schedule never arrived are sent along without
+        # one; the scheduler forwards them if it knows where they belong.
+        for key in requests.keys():
+            if requests.schedule(key) is not None:
+                _handoff(key, requests, handed_off, schedulers, pusher_cache,
+                         status, store)
+            else:
+                triggers = list(requests.release(key).triggers.values())
+                utils.handoff_request(schedulers, pusher_cache, status, None,
+                                      triggers)
+
+        if len(handed_off) > 0:
+            logging.info('Departing with %d handed off requests still '
+                         'awaiting triggers.' % (len(handed_off)))
+
+        # Send whatever results we have not written yet, though we cannot wait
+        # for them to be acked.
+        writer.flush(force=True)
+    elif (elapsed < DRAIN_GRACE or len(requests) > 0 or len(handed_off) > 0
+          or len(writer) > 0):
+        return
+
+    # If we are the last executor on the node, the node's cache goes with us.
+    if node_cache is not None:
+        node_cache.close()
+
+    # Let the management server know that we are done, and exit the process.
+    if mgmt_ip:
+        sckt = pusher_cache.get(utils.get_depart_done_addr(mgmt_ip))
+        sckt.send_string(ip)
+
+    # We specifically pass 1 as the exit code when ending our process so that
+    # the wrapper script does not restart us.
+    sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -503,5 +955,20 @@ if __name__ == '__main__':
     conf = sutils.load_conf(conf_file)
     exec_conf = conf['executor']
 
+    # Memoized results are only shared through the KVS if a TTL is set.
+    memo_ttl = exec_conf.get('memo_ttl')
+    if memo_ttl is not None:
+        memo_ttl = float(memo_ttl)
+
     executor(conf['ip'], conf['mgmt_ip'], exec_conf['scheduler_ips'],
-             int(exec_conf['thread_id']))
+             int(exec_conf['thread_id']),
+             float(exec_conf.get('request_ttl', REQUEST_TTL)),
+             float(exec_conf.get('finished_ttl', FINISHED_TTL)),
+             bool(exec_conf.get('prefetch_children', False)),
+             int(exec_conf.get('memo_capacity', MEMO_CAPACITY)),
+             memo_ttl,
+             int(exec_conf.get('object_threshold', OBJECT_THRESHOLD)),
+             int(exec_conf.get('object_capacity', OBJECT_CAPACITY)),
+             float(exec_conf.get('object_ttl', OBJECT_TTL)),
+             int(exec_conf.get('node_cache_capacity', NODE_CACHE_CAPACITY)),
+             exec_conf.get('batching'))
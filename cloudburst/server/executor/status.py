@@ -0,0 +1,122 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import time
+
+from cloudburst.server.executor import utils
+from cloudburst.shared.proto.internal_pb2 import ThreadStatus
+
+# The shortest interval between two status updates sent to the schedulers, in
+# seconds, unless the update is urgent.
+STATUS_INTERVAL = 0.1
+
+# How much an executor's backlog has to change before the schedulers are told
+# about it, so that every request received or finished does not cause a delta.
+BACKLOG_STEP = 5
+
+
+class StatusReporter():
+    '''
+    Sends an executor's ThreadStatus to the schedulers. Changes are sent as
+    deltas that only carry the functions that were pinned or unpinned, at most
+    once per interval, and nothing is sent if nothing changed. Changes in the
+    backlog are only sent once they add up to BACKLOG_STEP requests, or when
+    the backlog drains, since schedulers only use it to shed load. A full
+    status, which also carries the utilization, is sent on every report tick,
+    so schedulers that missed a delta (or just started) catch up.
+    '''
+
+    def __init__(self, schedulers, pusher_cache, status,
+                 interval=STATUS_INTERVAL):
+        self.schedulers = schedulers
+        self.pusher_cache = pusher_cache
+        self.status = status
+        self.interval = interval
+
+        # What the schedulers were last told.
+        self.sent_functions = set()
+        self.sent_running = None
+        self.sent_backlog = 0
+        self.last_sent = 0.0
+
+        # Whether the status may have changed since it was last sent.
+        self.dirty = False
+
+    def update(self, urgent=False, now=None):
+        '''
+        Notes that the status may have changed, and sends a delta right away
+        if it did and either the update is urgent or the interval has passed.
+        '''
+        self.dirty = True
+        self.flush(urgent, now)
+
+    def deadline(self):
+        '''
+        Returns the time at which a pending delta should be sent, or None if
+        there is nothing to send.
+        '''
+        if not self.dirty:
+            return None
+
+        return self.last_sent + self.interval
+
+    def flush(self, urgent=False, now=None):
+        if not self.dirty:
+            return
+
+        if now is None:
+            now = time.time()
+
+        if not urgent and now < self.last_sent + self.interval:
+            return
+
+        self.dirty = False
+        functions = set(self.status.functions)
+        backlog_changed = (
+            abs(self.status.backlog - self.sent_backlog) >= BACKLOG_STEP or
+            (self.status.backlog == 0 and self.sent_backlog > 0))
+        if (functions == self.sent_functions and
+                self.status.running == self.sent_running and
+                not backlog_changed):
+            return
+
+        delta = ThreadStatus()
+        delta.ip = self.status.ip
+        delta.tid = self.status.tid
+        delta.running = self.status.running
+        delta.type = self.status.type
+        delta.backlog = self.status.backlog
+        delta.delta = True
+        delta.added_functions.extend(functions - self.sent_functions)
+        delta.removed_functions.extend(self.sent_functions - functions)
+
+        self._send(delta, now)
+
+    def push_full(self, now=None):
+        '''
+        Sends the complete status, including the utilization.
+        '''
+        if now is None:
+            now = time.time()
+
+        self.dirty = False
+        self._send(self.status, now)
+
+    def _send(self, status, now):
+        utils.push_status(self.schedulers, self.pusher_cache, status)
+
+        self.sent_functions = set(self.status.functions)
+        self.sent_running = self.status.running
+        self.sent_backlog = self.status.backlog
+        self.last_sent = now
@@ -0,0 +1,491 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from collections import OrderedDict
+import hashlib
+import logging
+import time
+import uuid
+
+from anna.lattices import LWWPairLattice
+import zmq
+
+from cloudburst.server import utils as sutils
+from cloudburst.server.executor import transport
+from cloudburst.shared.proto.internal_pb2 import ObjectRequest, ObjectResponse
+
+# Results whose serialized size is above this many bytes are kept in the
+# producing executor's object store, rather than passed in triggers.
+OBJECT_THRESHOLD = 1024 * 1024
+
+# The most bytes of objects an executor keeps in its store. Beyond this, the
+# oldest objects are written to the KVS.
+OBJECT_CAPACITY = 256 * 1024 * 1024
+
+# How long an executor keeps an object that has not been read by each of its
+# consumers, in seconds, before writing it to the KVS.
+OBJECT_TTL = 60
+
+# How long an object written to the KVS is kept there for the consumers that
+# have not read it yet, in seconds.
+SPILL_TTL = 600
+
+# How long a consumer waits for an object's owner to answer before checking
+# whether the object has been written to the KVS, and between checks, in
+# seconds.
+FETCH_RETRY = 0.1
+
+# How long a consumer waits for an object, in seconds, before giving up on it:
+# its owner may have failed without writing it to the KVS.
+FETCH_TIMEOUT = 10
+
+# The prefix of the keys objects are stored under, both in the store and in
+# the KVS.
+OBJECT_KEY_PREFIX = 'objects/'
+
+
+class ObjectReference():
+    '''
+    A reference to an object held in an executor's object store, which is
+    passed in a trigger in place of the object itself. location is the owner of
+    the object, as 'ip:tid'.
+    '''
+
+    def __init__(self, key, location):
+        self.key = key
+        self.location = location
+
+
+class ObjectStore():
+    '''
+    Holds the large results this executor passes to other functions, so that
+    they are not sent in triggers. Each object is kept in a shared memory
+    segment, which executors on the same node read directly; executors on
+    other nodes fetch the object from us. Each consumer lets us know once it
+    has read an object, or will not read it because its request was dropped,
+    and we free the object once every consumer has.
+
+    A request that reads objects held on other nodes does not run until they
+    have arrived: request() starts fetching them, receive() and receive_kvs()
+    take in the answers, and retry() falls back to the KVS and gives up on
+    objects that take too long. None of these wait, so the executor keeps
+    serving other requests in the meantime.
+
+    An object that is evicted to make room for newer ones, or that not every
+    consumer has read within the TTL, is written to the KVS under its key,
+    where consumers find it if we no longer have it. Once the remaining
+    consumers have read it, or after SPILL_TTL, we overwrite it with an empty
+    value, since the KVS cannot delete keys.
+    '''
+
+    def __init__(self, ip, tid, context, pusher_cache, kvs, writer=None,
+                 threshold=OBJECT_THRESHOLD, capacity=OBJECT_CAPACITY,
+                 ttl=OBJECT_TTL, timeout=FETCH_TIMEOUT,
+                 spill_ttl=SPILL_TTL):
+        self.ip = ip
+        self.address = ip + ':' + str(tid)
+
+        self.pusher_cache = pusher_cache
+        self.kvs = kvs
+        self.writer = writer
+
+        self.threshold = threshold
+        self.capacity = capacity
+        self.ttl = ttl
+        self.timeout = timeout
+        self.spill_ttl = spill_ttl
+
+        # Whether we are departing, in which case we no longer store objects.
+        self.departing = False
+
+        # Requests for our objects from other executors, and the answers to our
+        # own requests.
+        self.request_socket = context.socket(zmq.PULL)
+        transport.bind_peer_socket(self.request_socket,
+                                   sutils.OBJECT_REQUEST_PORT + tid)
+
+        self.response_socket = context.socket(zmq.PULL)
+        transport.bind_peer_socket(self.response_socket,
+                                   sutils.OBJECT_RESPONSE_PORT + tid)
+        self.response_address = 'tcp://' + ip + ':' + \
+            str(sutils.OBJECT_RESPONSE_PORT + tid)
+
+        # The objects we hold, in the order they were stored, mapped to their
+        # shared memory segment, their size, the number of consumers that have
+        # not read them yet, and when they expire. Every object has the same
+        # TTL, so objects expire in the order they were stored.
+        self.objects = OrderedDict()
+        self.size = 0
+
+        # The objects we wrote to the KVS, mapped to the number of consumers
+        # that have not read them yet and when we remove them regardless.
+        self.spilled_objects = OrderedDict()
+
+        # The objects we are fetching for our requests, mapped to their owner,
+        # when we give up on them, when we next check the KVS for them, and
+        # the number of our requests waiting for them, and the objects we
+        # fetched, mapped to their body (None if we gave up), the number of our
+        # requests that will read them, and when we drop them if they are not
+        # read.
+        self.fetching = {}
+        self.fetched = {}
+
+        # The number of objects stored, read from shared memory, fetched from
+        # another node, and written to the KVS since the last report.
+        self.stored = 0
+        self.local_fetches = 0
+        self.remote_fetches = 0
+        self.spilled = 0
+
+    def put(self, body, consumers, now=None):
+        '''
+        Stores a serialized object that the given number of consumers will
+        read, and returns a reference to it, or None if it could not be stored.
+        '''
+        if self.departing:
+            return None
+
+        if now is None:
+            now = time.time()
+
+        key = OBJECT_KEY_PREFIX + str(uuid.uuid4())
+        size = len(body)
+
+        # If we are out of shared memory, the object is passed along the usual
+        # way.
+        segment = transport.create_segment(_segment_name(key), body)
+        if segment is None:
+            return None
+
+        self.objects[key] = [segment, size, consumers, now + self.ttl]
+        self.size += size
+        self.stored += 1
+
+        while self.size > self.capacity and len(self.objects) > 1:
+            self._spill(next(iter(self.objects)), now)
+
+        return ObjectReference(key, self.address)
+
+    def request(self, ref, now=None):
+        '''
+        Starts fetching the object a reference points to for one of our
+        requests, and returns True if the request has to wait for it.
+        '''
+        if now is None:
+            now = time.time()
+
+        if ref.key in self.fetched:
+            self.fetched[ref.key][1] += 1
+            self._notify(ref.location, ref.key)
+            return False
+
+        if ref.key in self.fetching:
+            self.fetching[ref.key][3] += 1
+            return True
+
+        retry = now
+        if ref.location == self.address:
+            if ref.key in self.objects:
+                return False
+        elif ref.location.split(':')[0] == self.ip:
+            body = transport.read_segment(_segment_name(ref.key))
+            if body is not None:
+                self.local_fetches += 1
+                self._notify(ref.location, ref.key)
+                self.fetched[ref.key] = [body, 1, now + self.ttl]
+                return False
+        else:
+            request = ObjectRequest(key=ref.key,
+                                    response_address=self.response_address)
+            self._send_request(ref.location, request)
+            retry = now + FETCH_RETRY
+
+        # If the object is not where it was stored, its owner wrote it to the
+        # KVS, or is about to.
+        self.fetching[ref.key] = [ref.location, now + self.timeout, retry, 1]
+        return True
+
+    def fetch(self, ref):
+        '''
+        Returns the serialized object a reference points to, or None if it
+        could not be found.
+        '''
+        if ref.key in self.fetched:
+            entry = self.fetched[ref.key]
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self.fetched[ref.key]
+
+            return entry[0]
+
+        body = None
+        if ref.location == self.address:
+            if ref.key in self.objects:
+                body = self._read(ref.key)
+        elif ref.location.split(':')[0] == self.ip:
+            body = transport.read_segment(_segment_name(ref.key))
+            if body is not None:
+                self.local_fetches += 1
+
+        if body is None:
+            lattice = self.kvs.get(ref.key)[ref.key]
+            if lattice and lattice.reveal():
+                body = lattice.reveal()
+
+        if body is not None:
+            self._notify(ref.location, ref.key)
+
+        return body
+
+    def abandon(self, ref, requested):
+        '''
+        Lets the owner of an object know that one of our requests is not going
+        to read it, because the request was dropped. requested is whether we
+        had called request() for it.
+        '''
+        if requested and ref.key in self.fetched:
+            # We let the owner know when the object arrived.
+            entry = self.fetched[ref.key]
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self.fetched[ref.key]
+        else:
+            if requested and ref.key in self.fetching:
+                self.fetching[ref.key][3] -= 1
+                if self.fetching[ref.key][3] <= 0:
+                    del self.fetching[ref.key]
+
+            self._notify(ref.location, ref.key)
+
+    def receive(self, now=None):
+        '''
+        Takes in the answers to our requests for objects, and returns the keys
+        of the objects that are no longer being fetched.
+        '''
+        if now is None:
+            now = time.time()
+
+        done = []
+        while self.response_socket.poll(0):
+            response = ObjectResponse()
+            response.ParseFromString(self.response_socket.recv())
+
+            if response.key not in self.fetching:
+                continue
+
+            if response.found:
+                self.remote_fetches += 1
+                self._fetched(response.key, response.body, now)
+                done.append(response.key)
+            else:
+                # The owner no longer has the object, so we read it from the
+                # KVS.
+                self.fetching[response.key][2] = now
+
+        return done
+
+    def receive_kvs(self, kv_pairs, now=None):
+        '''
+        Takes in the objects among the answers to asynchronous KVS reads, and
+        returns their keys.
+        '''
+        if now is None:
+            now = time.time()
+
+        done = []
+        for key in kv_pairs:
+            # An empty value is an object that was removed from the KVS.
+            if (key in self.fetching and kv_pairs[key] is not None and
+                    kv_pairs[key].reveal()):
+                self._fetched(key, kv_pairs[key].reveal(), now)
+                done.append(key)
+
+        return done
+
+    def retry(self, now=None):
+        '''
+        Reads the objects whose owners have not answered in time from the KVS,
+        and gives up on the objects we have been fetching for too long, whose
+        owners may have failed without writing them to the KVS. Returns the
+        keys of the objects we gave up on.
+        '''
+        if now is None:
+            now = time.time()
+
+        keys = []
+        done = []
+        for key, (_, deadline, retry, _) in self.fetching.items():
+            if deadline <= now:
+                done.append(key)
+            elif retry <= now:
+                keys.append(key)
+
+        for key in done:
+            logging.error('Object %s was not found in time.' % (key))
+            self._fetched(key, None, now)
+
+        if len(keys) > 0:
+            self.kvs.get_async(keys)
+            for key in keys:
+                self.fetching[key][2] = now + FETCH_RETRY
+
+        return done
+
+    def deadline(self):
+        '''
+        Returns the time at which retry() next has something to do, or None if
+        we are not fetching any objects.
+        '''
+        if len(self.fetching) == 0:
+            return None
+
+        return min(min(deadline, retry) for _, deadline, retry, _ in
+                   self.fetching.values())
+
+    def serve(self):
+        '''
+        Answers the requests for our objects that have arrived.
+        '''
+        while self.request_socket.poll(0):
+            request = ObjectRequest()
+            request.ParseFromString(self.request_socket.recv())
+
+            # A request to send an object does not release it; the consumer
+            # lets us know separately once it has read it.
+            if request.response_address:
+                response = ObjectResponse(key=request.key)
+                if request.key in self.objects:
+                    response.found = True
+                    response.body = self._read(request.key)
+
+                sckt = self.pusher_cache.get(request.response_address)
+                sckt.send(response.SerializeToString())
+            else:
+                self._release(request.key)
+
+    def expire(self, now=None):
+        '''
+        Writes the objects whose TTL has passed to the KVS.
+        '''
+        if now is None:
+            now = time.time()
+
+        while len(self.objects) > 0:
+            key = next(iter(self.objects))
+            if self.objects[key][3] > now:
+                break
+
+            self._spill(key, now)
+
+        # Objects in the KVS that not every consumer has read in time.
+        while len(self.spilled_objects) > 0:
+            key = next(iter(self.spilled_objects))
+            if self.spilled_objects[key][1] > now:
+                break
+
+            self._remove_spilled(key)
+
+        # Objects fetched for requests that were dropped before they ran.
+        for key in [key for key in self.fetched if self.fetched[key][2] <=
+                    now]:
+            del self.fetched[key]
+
+    def depart(self):
+        '''
+        Writes every object we hold to the KVS, and stops storing new ones,
+        because we are departing: results we produce from now on are passed
+        in triggers, so nothing is left behind when we exit.
+        '''
+        self.departing = True
+        self.spill_all()
+
+    def spill_all(self):
+        '''
+        Writes every object we hold to the KVS.
+        '''
+        for key in list(self.objects.keys()):
+            self._spill(key)
+
+    def _read(self, key):
+        return transport.read_contents(self.objects[key][0])
+
+    def _release(self, key):
+        # One consumer of one of our objects is done with it.
+        if key in self.objects:
+            self.objects[key][2] -= 1
+            if self.objects[key][2] <= 0:
+                self._free(key)
+        elif key in self.spilled_objects:
+            self.spilled_objects[key][0] -= 1
+            if self.spilled_objects[key][0] <= 0:
+                self._remove_spilled(key)
+
+    def _free(self, key):
+        segment, size, _, _ = self.objects.pop(key)
+        self.size -= size
+
+        segment.close()
+        segment.unlink()
+
+    def _spill(self, key, now=None):
+        if now is None:
+            now = time.time()
+
+        self._put(key, self._read(key))
+
+        self.spilled_objects[key] = [self.objects[key][2],
+                                     now + self.spill_ttl]
+        self._free(key)
+        self.spilled += 1
+
+    def _remove_spilled(self, key):
+        del self.spilled_objects[key]
+        self._put(key, b'')
+
+    def _put(self, key, body):
+        lattice = LWWPairLattice(sutils.generate_timestamp(0), body)
+        if self.writer:
+            self.writer.put(key, lattice)
+        else:
+            self.kvs.put(key, lattice)
+
+    def _notify(self, location, key):
+        # Lets the owner of an object know that one of our requests is done
+        # with it.
+        if location == self.address:
+            self._release(key)
+        else:
+            self._send_request(location, ObjectRequest(key=key))
+
+    def _send_request(self, location, request):
+        ip, tid = location.split(':')
+        address = 'tcp://' + ip + ':' + str(sutils.OBJECT_REQUEST_PORT +
+                                            int(tid))
+
+        sckt = self.pusher_cache.get(address)
+        sckt.send(request.SerializeToString())
+
+    def _fetched(self, key, body, now):
+        location, _, _, readers = self.fetching.pop(key)
+        self.fetched[key] = [body, readers, now + self.ttl]
+
+        if body is not None:
+            for _ in range(readers):
+                self._notify(location, key)
+
+
+def _segment_name(key):
+    # Shared memory segment names are limited in length on some platforms.
+    return 'cb-' + hashlib.sha1(key.encode()).hexdigest()[:24]
+
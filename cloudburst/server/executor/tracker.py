@@ -0,0 +1,294 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from cloudburst.shared.proto.cloudburst_pb2 import (
+    MULTIEXEC # Cloudburst's execution types
+)
+
+
+class PendingRequest():
+    '''
+    The state an executor keeps for one DAG request to one of its functions
+    until that request finishes: its schedule (once it arrives), the triggers
+    received so far, and when we first heard of the request.
+    '''
+    __slots__ = ['schedule', 'triggers', 'unrun', 'expected', 'multiexec',
+                 'queued', 'objects', 'requested', 'arrival']
+
+    def __init__(self, arrival):
+        self.schedule = None
+        self.triggers = {}
+
+        # The triggers received since the request last ran, in order. A
+        # MULTIEXEC function runs once for each of them.
+        self.unrun = []
+
+        # The number of distinct predecessors we need to hear from; this is
+        # only known once the schedule arrives.
+        self.expected = None
+        self.multiexec = False
+
+        # Whether we have already told the caller that this request is ready,
+        # so that duplicate messages do not queue it twice.
+        self.queued = False
+
+        # The objects held on other executors that the request is waiting for
+        # before it runs, and whether we have started fetching the objects its
+        # triggers refer to.
+        self.objects = set()
+        self.requested = False
+
+        self.arrival = arrival
+
+
+class RequestTracker():
+    '''
+    Tracks every outstanding DAG request on an executor, keyed by (schedule
+    ID, function name). Adding a schedule or a trigger tells the caller
+    whether the request just became ready (exactly once per readiness), by
+    comparing the number of distinct
+    predecessors heard from against the number the schedule expects, so the
+    cost per trigger does not depend on how many requests are outstanding. All
+    of a request's state is dropped once it is released.
+    '''
+
+    def __init__(self):
+        # A map from request key to its PendingRequest.
+        self.requests = {}
+
+        # The number of requests with a schedule for each function.
+        self.counts = {}
+
+        # Requests we have finished, mapped to when they finished. This is
+        # kept in order of completion, so pruning only looks at what expires.
+        self.finished = {}
+
+        # The keys of the objects that ready requests are waiting for, mapped
+        # to the keys of those requests.
+        self.waiting = {}
+
+    def __contains__(self, key):
+        return key in self.requests
+
+    def __len__(self):
+        return len(self.requests)
+
+    def keys(self):
+        return list(self.requests.keys())
+
+    def get(self, key):
+        return self.requests.get(key)
+
+    def add_schedule(self, schedule, now):
+        '''
+        Records the schedule for a request and returns True if this made the
+        request ready to run. Schedules for requests that already finished are
+        ignored.
+        '''
+        fname = schedule.target_function
+        key = (schedule.id, fname)
+        if key in self.finished:
+            return False
+
+        request = self._get_or_create(key, now)
+
+        if request.schedule is None:
+            self.counts[fname] = self.counts.get(fname, 0) + 1
+
+            # We only need to look at the DAG's functions once per request.
+            for ref in schedule.dag.functions:
+                if ref.name == fname:
+                    request.multiexec = (ref.type == MULTIEXEC)
+                    break
+
+        request.schedule = schedule
+        request.expected = len(schedule.triggers)
+
+        return self._became_ready(request)
+
+    def add_trigger(self, trigger, now):
+        '''
+        Records a trigger for a request and returns True if this made the
+        request ready to run. Triggers for requests that already finished are
+        ignored.
+        '''
+        key = (trigger.id, trigger.target_function)
+        if key in self.finished:
+            return False
+
+        request = self._get_or_create(key, now)
+        request.triggers[trigger.source] = trigger
+        request.unrun.append(trigger)
+
+        return self._became_ready(request)
+
+    def is_ready(self, key):
+        return key in self.requests and self._is_ready(self.requests[key])
+
+    def schedule(self, key):
+        return self.requests[key].schedule
+
+    def triggers(self, key):
+        request = self.requests[key]
+
+        # A MULTIEXEC function runs once for each trigger it receives, so it
+        # only sees the oldest one it has not run with yet.
+        if request.multiexec:
+            return [request.unrun[0]]
+
+        return list(request.triggers.values())
+
+    def clear_triggers(self, key):
+        '''
+        Drops the trigger a MULTIEXEC request just ran with, and returns True
+        if a trigger that arrived in the meantime makes it ready to run again.
+        '''
+        request = self.requests[key]
+        request.unrun.pop(0)
+        request.queued = False
+        request.requested = False
+
+        # The triggers we have not run with yet are all we still need.
+        request.triggers = {trigger.source: trigger for trigger in
+                            request.unrun}
+
+        return self._became_ready(request)
+
+    def wait_for_objects(self, key, objects):
+        '''
+        Records that we started fetching the objects a ready request reads,
+        and holds it until the ones with the given keys have been fetched.
+        '''
+        request = self.requests[key]
+        request.objects = set(objects)
+        request.requested = True
+
+        for obj in objects:
+            if obj not in self.waiting:
+                self.waiting[obj] = set()
+            self.waiting[obj].add(key)
+
+    def objects_arrived(self, objects):
+        '''
+        Records that the objects with the given keys have been fetched (or
+        given up on), and returns the keys of the requests that are no longer
+        waiting for any objects.
+        '''
+        keys = []
+        for obj in objects:
+            for key in self.waiting.pop(obj, set()):
+                request = self.requests[key]
+                request.objects.discard(obj)
+                if len(request.objects) == 0:
+                    keys.append(key)
+
+        return keys
+
+    def pending(self, fname):
+        return self.counts.get(fname, 0)
+
+    def release(self, key):
+        '''
+        Drops all state for a request and returns its PendingRequest.
+        '''
+        request = self.requests.pop(key)
+
+        for obj in request.objects:
+            self.waiting[obj].discard(key)
+            if len(self.waiting[obj]) == 0:
+                del self.waiting[obj]
+
+        if request.schedule is not None:
+            fname = key[1]
+            self.counts[fname] -= 1
+            if self.counts[fname] == 0:
+                del self.counts[fname]
+
+        return request
+
+    def finish(self, key, now):
+        self.release(key)
+        self.finished[key] = now
+
+    def cancel(self, key, now):
+        '''
+        Treats a request as finished, whether or not we have heard of it, so
+        that any later messages for it are ignored. Requests that already
+        finished are left alone.
+        '''
+        if key in self.finished:
+            return
+
+        if key in self.requests:
+            self.release(key)
+
+        self.finished[key] = now
+
+    def is_finished(self, key):
+        return key in self.finished
+
+    def expire(self, before, now):
+        '''
+        Releases every request that we first heard of before the given time
+        and that is still not ready to run, and returns their PendingRequests.
+        Expired requests are treated as finished, so that late messages for
+        them are ignored.
+        '''
+        # Requests are kept in the order in which we first heard of them, so
+        # we can stop at the first one that is recent enough. We only release
+        # them once we are done iterating.
+        keys = []
+        for key, request in self.requests.items():
+            if request.arrival >= before:
+                break
+
+            if not request.queued:
+                keys.append(key)
+
+        expired = []
+        for key in keys:
+            expired.append(self.requests[key])
+            self.finish(key, now)
+
+        return expired
+
+    def prune_finished(self, before):
+        while len(self.finished) > 0:
+            key = next(iter(self.finished))
+            if self.finished[key] >= before:
+                break
+
+            del self.finished[key]
+
+    def _get_or_create(self, key, now):
+        if key not in self.requests:
+            self.requests[key] = PendingRequest(now)
+
+        return self.requests[key]
+
+    def _became_ready(self, request):
+        if request.queued or not self._is_ready(request):
+            return False
+
+        request.queued = True
+        return True
+
+    def _is_ready(self, request):
+        if request.schedule is None or len(request.triggers) == 0:
+            return False
+
+        if request.multiexec:
+            return len(request.unrun) > 0
+
+        return len(request.triggers) == request.expected
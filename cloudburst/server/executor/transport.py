@@ -0,0 +1,201 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from multiprocessing import resource_tracker, shared_memory
+import uuid
+
+from cloudburst.server import utils as sutils
+
+# The IPC endpoint that each socket other executors send to is bound on, along
+# with its TCP port, by port number.
+IPC_ADDR_TEMPLATE = 'ipc:///tmp/cloudburst-executor-%d'
+
+# The ports, offset by thread ID, of the sockets that executors send to each
+# other on. Thread IDs are below MAX_THREADS, since each port is that far
+# apart from the next one.
+PEER_PORTS = [sutils.DAG_QUEUE_PORT, sutils.DAG_EXEC_PORT,
+              sutils.OBJECT_REQUEST_PORT, sutils.OBJECT_RESPONSE_PORT,
+              sutils.RECV_INBOX_PORT]
+MAX_THREADS = 10
+
+# Messages between executors on the same node that are larger than this many
+# bytes are passed through shared memory.
+SHARED_THRESHOLD = 64 * 1024
+
+# How long a message passed through shared memory is kept for its receiver,
+# in seconds, after which the sender removes it.
+SHARED_TTL = 60
+
+# The size of the header of each shared memory segment, which holds the size
+# of its contents, since segments may be rounded up to a whole number of
+# pages.
+HEADER_SIZE = 8
+
+
+class TransportCache():
+    '''
+    Wraps a socket cache, so that the sockets of the executors on our own node
+    are reached through IPC rather than TCP, which saves a trip through the
+    network stack. Every other address is used as is.
+    '''
+
+    def __init__(self, pusher_cache, ip):
+        self.pusher_cache = pusher_cache
+        self.ip = ip
+
+    def get(self, address):
+        return self.pusher_cache.get(self.select(address))
+
+    def select(self, address):
+        '''
+        Returns the address to use to reach the given TCP address.
+        '''
+        if not address.startswith('tcp://'):
+            return address
+
+        ip, port = address[len('tcp://'):].rsplit(':', 1)
+        port = int(port)
+        if ip == self.ip and _is_peer_port(port):
+            return IPC_ADDR_TEMPLATE % port
+
+        return address
+
+
+class SharedBuffer():
+    '''
+    A message passed to an executor on the same node through a shared memory
+    segment. The receiver removes the segment once it has read it; if it
+    never does, the sender removes it after SHARED_TTL.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+
+
+def bind_peer_socket(socket, port):
+    '''
+    Binds a socket that other executors send to, both on TCP and, for the
+    executors on our own node, on IPC.
+    '''
+    socket.bind(sutils.BIND_ADDR_TEMPLATE % port)
+    socket.bind(IPC_ADDR_TEMPLATE % port)
+
+
+def share(body):
+    '''
+    Copies a message into a new shared memory segment for another process, and
+    returns a SharedBuffer for it, or None if it could not be created.
+    '''
+    # The segment outlives us, so that the receiver can still read it.
+    name = 'cb-' + uuid.uuid4().hex[:24]
+    segment = create_segment(name, body, shared=True)
+    if segment is None:
+        return None
+
+    segment.close()
+
+    return SharedBuffer(name)
+
+
+def receive(buf):
+    '''
+    Returns the message in a SharedBuffer, and removes its segment, or returns
+    None if the sender already removed it.
+    '''
+    return read_segment(buf.name, unlink=True)
+
+
+def discard(buf):
+    '''
+    Removes the segment of a SharedBuffer, if its receiver has not yet.
+    '''
+    segment = attach_segment(buf.name)
+    if segment is not None:
+        segment.close()
+        remove_segment(segment)
+
+
+def create_segment(name, body, shared=False):
+    '''
+    Creates a shared memory segment with the given name that holds body, and
+    returns it, or None if we are out of shared memory. If shared is set, the
+    segment is left in place when we exit, for another process to remove.
+    '''
+    size = len(body)
+    try:
+        segment = shared_memory.SharedMemory(name=name, create=True,
+                                             size=HEADER_SIZE + size)
+    except OSError:
+        return None
+
+    if shared:
+        resource_tracker.unregister(segment._name, 'shared_memory')
+
+    segment.buf[:HEADER_SIZE] = size.to_bytes(HEADER_SIZE, 'big')
+    segment.buf[HEADER_SIZE:HEADER_SIZE + size] = body
+
+    return segment
+
+
+def read_segment(name, unlink=False):
+    '''
+    Returns the contents of the shared memory segment with the given name, or
+    None if there is no such segment. The segment is removed if unlink is set.
+    '''
+    segment = attach_segment(name)
+    if segment is None:
+        return None
+
+    body = read_contents(segment)
+    segment.close()
+
+    if unlink:
+        remove_segment(segment)
+
+    return body
+
+
+def attach_segment(name):
+    '''
+    Opens the existing shared memory segment with the given name, or returns
+    None if there is no such segment.
+    '''
+    try:
+        segment = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return None
+
+    # The segment belongs to someone else, so our resource tracker must not
+    # remove it when we exit.
+    resource_tracker.unregister(segment._name, 'shared_memory')
+    return segment
+
+
+def remove_segment(segment):
+    '''
+    Removes a shared memory segment that we attached to.
+    '''
+    # Removing the segment also unregisters it, so it has to be registered
+    # first.
+    resource_tracker.register(segment._name, 'shared_memory')
+    segment.unlink()
+
+
+def read_contents(segment):
+    size = int.from_bytes(segment.buf[:HEADER_SIZE], 'big')
+    return bytes(segment.buf[HEADER_SIZE:HEADER_SIZE + size])
+
+
+def _is_peer_port(port):
+    return any(0 <= port - base < MAX_THREADS for base in PEER_PORTS)
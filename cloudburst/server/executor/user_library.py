@@ -12,9 +12,14 @@
 #  See the License for the specific language governing permissions and
 #  limitations under the License.
 
+from collections import deque
+import logging
+import time
+
 import zmq
 
 import cloudburst.server.utils as sutils
+from cloudburst.server.executor import transport
 from cloudburst.shared.serializer import Serializer
 
 serializer = Serializer()
@@ -53,12 +58,19 @@ class CloudburstUserLibrary(AbstractCloudburstUserLibrary):
 
         self.pusher_cache = pusher_cache
 
+        # The messages we passed through shared memory, in the order we sent
+        # them, with when we remove them if they were never received.
+        self.shared = deque()
+        self.shared_ttl = transport.SHARED_TTL
+
         self.address = sutils.BIND_ADDR_TEMPLATE % (sutils.RECV_INBOX_PORT +
                                                     self.executor_tid)
 
-        # Socket on which inbound messages, if any, will be received.
+        # Socket on which inbound messages, if any, will be received. Senders
+        # on our own node reach it over IPC.
         self.recv_inbox_socket = context.socket(zmq.PULL)
-        self.recv_inbox_socket.bind(self.address)
+        transport.bind_peer_socket(self.recv_inbox_socket,
+                                   sutils.RECV_INBOX_PORT + self.executor_tid)
 
     def put(self, ref, value):
         return self.anna_client.put(ref, serializer.dump_lattice(value))
@@ -98,6 +110,15 @@ class CloudburstUserLibrary(AbstractCloudburstUserLibrary):
         dest_addr = sutils.get_user_msg_inbox_addr(ip, tid)
         sender = (self.executor_ip, self.executor_tid)
 
+        # Large messages to executors on our own node are passed through
+        # shared memory rather than copied through the socket.
+        if (ip == self.executor_ip and isinstance(bytestr, bytes) and
+                len(bytestr) > transport.SHARED_THRESHOLD):
+            buf = transport.share(bytestr)
+            if buf is not None:
+                self.shared.append((time.time() + self.shared_ttl, buf))
+                bytestr = buf
+
         socket = self.pusher_cache.get(dest_addr)
         socket.send_pyobj((sender, bytestr))
 
@@ -109,8 +130,15 @@ class CloudburstUserLibrary(AbstractCloudburstUserLibrary):
             try:
                 # We pass in zmq.NOBLOCK here so that we only check for
                 # messages that have already been received.
-                msg = self.recv_inbox_socket.recv_pyobj(zmq.NOBLOCK)
-                res.append(msg)
+                sender, msg = self.recv_inbox_socket.recv_pyobj(zmq.NOBLOCK)
+                if isinstance(msg, transport.SharedBuffer):
+                    msg = transport.receive(msg)
+                    if msg is None:
+                        logging.error('A message from %s expired before it '
+                                      'was received.' % (str(sender)))
+                        continue
+
+                res.append((sender, msg))
             except zmq.ZMQError as e:
                 # ZMQ will throw an EAGAIN error with a timeout if there are no
                 # pending messages. If that's the case, that means that there
@@ -126,3 +154,9 @@ class CloudburstUserLibrary(AbstractCloudburstUserLibrary):
         # Closes the context for this request by clearing any outstanding
         # messages.
         self.recv()
+
+        # Remove the messages we sent that were never received, since their
+        # receivers are gone or have moved on.
+        now = time.time()
+        while len(self.shared) > 0 and self.shared[0][0] <= now:
+            transport.discard(self.shared.popleft()[1])
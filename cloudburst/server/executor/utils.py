@@ -14,13 +14,23 @@
 #  Modifications copyright (C) 2021 Taras Lykhenko, Rafael Soares
 
 import random
+import zlib
 
 import cloudburst.server.utils as sutils
 from cloudburst.shared.proto.cloudburst_pb2 import (
     NORMAL,
     EXECUTION_ERROR
 )
+from cloudburst.shared.proto.internal_pb2 import ScheduleHandoff
 from cloudburst.shared.serializer import Serializer
+from cloudburst.shared.utils import (
+    DEADLINE_LOCATION,
+    DEFAULT_PRIORITY,
+    DEFAULT_WEIGHT,
+    PRIORITY_LOCATION,
+    TENANT_LOCATION,
+    WEIGHT_LOCATION
+)
 
 from anna.lattices import (
     WrenLattice,
@@ -33,9 +43,10 @@ EXECUTOR_DEPART_PORT = 7005
 CACHE_VERISON_GC_PORT = 7200
 
 
-def generate_error_response(schedule, client, fname):
+def generate_error_response(schedule, client, fname,
+                            reason='not in function cache'):
     sutils.error.error = EXECUTION_ERROR
-    result = ('ERROR: ' + fname + ' not in function cache', sutils.error.SerializeToString())
+    result = ('ERROR: ' + fname + ' ' + reason, sutils.error.SerializeToString())
     if schedule.consistency == NORMAL:
         result = serializer.dump_lattice(result)
 
@@ -60,7 +71,7 @@ def retrieve_function(name, kvs, user_library, consistency=NORMAL):
             return None
     else:
         # This means that the function is stored in an SingleKeyCausalLattice.
-        _, result = kvs.causal_get([kvs_name])
+        result = kvs.causal_get([kvs_name], 0, 2**64-1, consistency)
         lattice = result[kvs_name]
 
         if lattice:
@@ -86,6 +97,39 @@ def retrieve_function(name, kvs, user_library, consistency=NORMAL):
     return result
 
 
+def get_deadline(schedule):
+    '''
+    Returns the time by which the request has to finish, or None if it has no
+    deadline.
+    '''
+    if DEADLINE_LOCATION in schedule.locations:
+        return float(schedule.locations[DEADLINE_LOCATION])
+
+    return None
+
+
+def get_priority(schedule):
+    if PRIORITY_LOCATION in schedule.locations:
+        return int(schedule.locations[PRIORITY_LOCATION])
+
+    return DEFAULT_PRIORITY
+
+
+def get_tenant(schedule):
+    # Unless the call named a tenant, all calls to a DAG share one.
+    if TENANT_LOCATION in schedule.locations:
+        return schedule.locations[TENANT_LOCATION]
+
+    return schedule.dag.name
+
+
+def get_weight(schedule):
+    if WEIGHT_LOCATION in schedule.locations:
+        return float(schedule.locations[WEIGHT_LOCATION])
+
+    return DEFAULT_WEIGHT
+
+
 def push_status(schedulers, pusher_cache, status):
     msg = status.SerializeToString()
 
@@ -95,6 +139,19 @@ def push_status(schedulers, pusher_cache, status):
         sckt.send(msg)
 
 
+def handoff_request(schedulers, pusher_cache, status, schedule, triggers):
+    handoff = ScheduleHandoff()
+    handoff.status.CopyFrom(status)
+    if schedule is not None:
+        handoff.schedule = schedule.SerializeToString()
+
+    for trigger in triggers:
+        handoff.triggers.append(trigger.SerializeToString())
+
+    sckt = pusher_cache.get(get_handoff_address(schedulers, status))
+    sckt.send(handoff.SerializeToString())
+
+
 def get_status_address(ip):
     return 'tcp://' + ip + ':' + str(sutils.STATUS_PORT)
 
@@ -115,3 +172,14 @@ def get_continuation_address(schedulers):
     # we just use 127.0.0.1 as the scheduler address.
     addr = random.choice(schedulers)
     return  'tcp://' + addr + ':' +  str(sutils.CONTINUATION_PORT)
+
+
+def get_handoff_address(schedulers, status):
+    # Schedulers only know where the requests they re-routed went, so an
+    # executor hands off all of its requests, and forwards all of their later
+    # triggers, to the same scheduler.
+    address = status.ip + ':' + str(status.tid)
+    idx = zlib.crc32(address.encode()) % len(schedulers)
+
+    addr = sorted(schedulers)[idx]
+    return 'tcp://' + addr + ':' + str(sutils.HANDOFF_PORT)
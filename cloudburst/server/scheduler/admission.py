@@ -0,0 +1,209 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import time
+
+from cloudburst.shared.utils import DEFAULT_WEIGHT
+
+# The most requests an executor thread may have outstanding before we consider
+# it saturated.
+MAX_BACKLOG = 100
+
+# How long a client should wait before retrying a call that was rejected
+# because its executors are saturated, in seconds, when their backlog is just
+# at the limit. This grows with the backlog.
+BACKLOG_RETRY_AFTER = 0.1
+
+# The fraction of the backlog limit at which we consider a call's executors
+# contended, and start holding tenants to their fair share of the calls.
+CONTENTION_FRACTION = 0.5
+
+# How quickly we forget the calls admitted for each tenant, as a half-life in
+# seconds.
+SHARE_HALF_LIFE = 1.0
+
+# Tenants whose recent calls have decayed below this are forgotten.
+MIN_USAGE = 0.01
+
+
+class TokenBucket():
+    '''
+    Admits requests at a steady rate, with bursts of up to burst requests.
+    '''
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+
+        self.tokens = burst
+        self.last = now
+
+    def take(self, now):
+        '''
+        Takes a token and returns 0 if one is available, and otherwise returns
+        how long it will be until the next token is available, in seconds.
+        '''
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionController():
+    '''
+    Decides whether the scheduler accepts a call, so that calls are rejected
+    quickly with a hint of when to retry rather than queueing up behind
+    saturated executors. A call is rejected if its DAG (or function) has used
+    up its token bucket, if every executor that could run one of its functions
+    has reached the backlog limit, or if the backlog of the whole cluster has
+    reached the global limit. Backlogs come from the executors' status
+    updates.
+
+    Calls belong to tenants (by default, the DAG they call), which share the
+    executors in proportion to their weights. While a call's executors are
+    contended, calls from tenants that have recently been admitted more than
+    their weighted share of calls are rejected, so that a DAG that floods the
+    cluster does not starve the others.
+    '''
+
+    def __init__(self, policy, rate=None, burst=None, rates=None,
+                 max_backlog=MAX_BACKLOG, max_total_backlog=None,
+                 weights=None):
+        self.policy = policy
+
+        # The default number of calls per second admitted for each DAG, and
+        # the rates for particular DAGs. A rate of None means that calls are
+        # not rate limited.
+        self.rate = rate
+        self.burst = burst
+        self.rates = rates if rates is not None else {}
+
+        self.max_backlog = max_backlog
+        self.max_total_backlog = max_total_backlog
+
+        # The weights of particular tenants; every other tenant has the
+        # default weight.
+        self.weights = weights if weights is not None else {}
+
+        # The number of calls recently admitted for each tenant, decaying over
+        # time, and when it was last updated.
+        self.usage = {}
+
+        # The token bucket of each DAG, created on its first call.
+        self.buckets = {}
+
+        # The number of calls rejected since the last report.
+        self.rejected = 0
+
+    def admit(self, name, functions, now=None, tenant=None):
+        '''
+        Returns 0 if a call to the DAG (or function) with the given name should
+        be accepted, and otherwise how long the client should wait before
+        retrying it, in seconds. functions are the names of the pinned
+        functions the call runs, and tenant is who the call belongs to, if not
+        the DAG.
+        '''
+        if now is None:
+            now = time.time()
+
+        if tenant is None:
+            tenant = name
+
+        # We check the backlog first, so that calls rejected because of it do
+        # not use up the DAG's tokens.
+        retry_after = self._check_backlog(functions, tenant, now)
+        if retry_after == 0:
+            retry_after = self._take_token(name, now)
+
+        if retry_after > 0:
+            self.rejected += 1
+        else:
+            self.usage[tenant] = (self._decayed_usage(tenant, now) + 1, now)
+
+        return retry_after
+
+    def weight(self, tenant):
+        return self.weights.get(tenant, DEFAULT_WEIGHT)
+
+    def _take_token(self, name, now):
+        rate = self.rates.get(name, self.rate)
+        if rate is None:
+            return 0
+
+        if name not in self.buckets:
+            burst = self.burst if self.burst is not None else max(1, rate)
+            self.buckets[name] = TokenBucket(rate, burst, now)
+
+        return self.buckets[name].take(now)
+
+    def _check_backlog(self, functions, tenant, now):
+        backlogs = self.policy.backlogs
+
+        if self.max_total_backlog is not None:
+            total = sum(backlogs.values())
+            if total >= self.max_total_backlog:
+                return BACKLOG_RETRY_AFTER * total / self.max_total_backlog
+
+        if self.max_backlog is None:
+            return 0
+
+        # The call is limited by its most backlogged function. If any executor
+        # for a function has room, the policy can route the call there.
+        least = 0
+        for fname in functions:
+            locations = self.policy.function_locations.get(fname, [])
+            if len(locations) > 0:
+                least = max(least, min(backlogs.get(location, 0) for location
+                                       in locations))
+
+        if least >= self.max_backlog:
+            return BACKLOG_RETRY_AFTER * least / self.max_backlog
+
+        if (least >= self.max_backlog * CONTENTION_FRACTION and
+                self._over_share(tenant, now)):
+            return BACKLOG_RETRY_AFTER
+
+        return 0
+
+    def _over_share(self, tenant, now):
+        '''
+        Returns True if the tenant was recently admitted more calls, relative
+        to its weight, than the tenants that are currently active on average.
+        '''
+        total = 0.0
+        total_weight = self.weight(tenant)
+        for other in list(self.usage.keys()):
+            usage = self._decayed_usage(other, now)
+            if usage < MIN_USAGE:
+                del self.usage[other]
+                continue
+
+            total += usage
+            if other != tenant:
+                total_weight += self.weight(other)
+
+        usage = self._decayed_usage(tenant, now)
+        return usage / self.weight(tenant) > total / total_weight
+
+    def _decayed_usage(self, tenant, now):
+        if tenant not in self.usage:
+            return 0.0
+
+        usage, last = self.usage[tenant]
+        return usage * 0.5 ** ((now - last) / SHARE_HALF_LIFE)
@@ -13,29 +13,65 @@
 #  limitations under the License.
 #  Modifications copyright (C) 2021 Taras Lykhenko, Rafael Soares
 
+import logging
 import time
 import uuid
 
 from cloudburst.server.scheduler import utils
 import cloudburst.server.utils as sutils
 from cloudburst.shared.proto.cloudburst_pb2 import (
+    DagCall,
     DagSchedule,
     DagTrigger,
     FunctionCall,
     GenericResponse,
-    NO_RESOURCES  # Cloudburst's error types
+    MULTIEXEC,  # Cloudburst's execution types
+    NO_RESOURCES, NO_SUCH_DAG,  # Cloudburst's error types
+    NORMAL  # Cloudburst's consistency modes
 )
+from cloudburst.shared.proto.internal_pb2 import ScheduleHandoff
 from cloudburst.shared.reference import CloudburstReference
 from cloudburst.shared.serializer import Serializer
+from cloudburst.shared.utils import (
+    DEADLINE_LOCATION,
+    DEFAULT_PRIORITY,
+    DEFAULT_WEIGHT,
+    PRIORITY_LOCATION,
+    QOS_ARGS,
+    RETRY_AFTER_PREFIX,
+    TENANT_LOCATION,
+    WEIGHT_LOCATION
+)
 
 serializer = Serializer()
 
 
-def call_function(func_call_socket, pusher_cache, policy):
+def call_function(func_call_socket, pusher_cache, policy, admission=None,
+                  inflight=None):
     # Parse the received protobuf for this function call.
     call = FunctionCall()
     call.ParseFromString(func_call_socket.recv())
 
+    # If an identical call to this pure function is in flight, the caller
+    # reads its result instead. Callers that asked for their own response key
+    # have to be given that key, so they are not coalesced.
+    digest = None
+    if inflight is not None:
+        digest = inflight.function_digest(call)
+        if digest is not None and not call.response_key:
+            response_id = inflight.attach(digest)
+            if response_id is not None:
+                func_call_socket.send(_coalesced_response(response_id)
+                                      .SerializeToString())
+                return
+
+    if admission is not None:
+        retry_after = admission.admit(call.name, [])
+        if retry_after > 0:
+            func_call_socket.send(_overloaded_response(retry_after)
+                                  .SerializeToString())
+            return
+
     # If there is no response key set for this request, we generate a random
     # UUID.
     if not call.response_key:
@@ -60,15 +96,90 @@ def call_function(func_call_socket, pusher_cache, policy):
     sckt = pusher_cache.get(utils.get_exec_address(ip, tid))
     sckt.send(call.SerializeToString())
 
+    if digest is not None:
+        inflight.record(digest, call.response_key)
+
     # Send a success response to the user with the response key.
     response.success = True
     response.response_id = call.response_key
     func_call_socket.send(response.SerializeToString())
 
 
-def call_dag(call, pusher_cache, dags, policy, request_id=None):
+def receive_dag_call(dag_call_socket, pusher_cache, dags, policy,
+                     call_frequency, interarrivals, last_arrivals,
+                     admission=None, hedging=None, inflight=None,
+                     late_binding=None):
+    call = DagCall()
+    call.ParseFromString(dag_call_socket.recv())
+
+    name = call.name
+
+    t = time.time()
+    if name in last_arrivals:
+        if name not in interarrivals:
+            interarrivals[name] = []
+
+        interarrivals[name].append(t - last_arrivals[name])
+
+    last_arrivals[name] = t
+
+    if name not in dags:
+        resp = GenericResponse()
+        resp.success = False
+        resp.error = NO_SUCH_DAG
+
+        dag_call_socket.send(resp.SerializeToString())
+        return
+
+    dag = dags[name]
+    _, _, tenant = _get_qos(call)
+
+    # Coalesced calls do not run anything, so they are admitted regardless of
+    # the load.
+    digest = None
+    if inflight is not None:
+        digest = inflight.dag_digest(call, dag[0])
+        if digest is not None and not call.output_key:
+            response_id = inflight.attach(digest)
+            if response_id is not None:
+                dag_call_socket.send(_coalesced_response(response_id)
+                                     .SerializeToString())
+                return
+
+    # Reject the call right away if the system is overloaded, rather than
+    # queueing it behind the requests the executors already have.
+    weight = DEFAULT_WEIGHT
+    if admission is not None:
+        retry_after = admission.admit(name, [fref.name for fref in
+                                             dag[0].functions], tenant=tenant)
+        if retry_after > 0:
+            dag_call_socket.send(_overloaded_response(retry_after)
+                                 .SerializeToString())
+            return
+
+        weight = admission.weight(tenant)
+
+    for fname in dag[0].functions:
+        call_frequency[fname.name] += 1
+
+    hedged = hedging.get(name, []) if hedging is not None else []
+    late = late_binding is not None and name in late_binding
+    response = call_dag(call, pusher_cache, dags, policy, weight=weight,
+                        hedged=hedged, late=late)
+
+    if digest is not None and response.success:
+        inflight.record(digest, response.response_id)
+
+    dag_call_socket.send(response.SerializeToString())
+
+
+def call_dag(call, pusher_cache, dags, policy, request_id=None,
+             weight=DEFAULT_WEIGHT, hedged=None, late=False):
     dag, sources = dags[call.name]
 
+    if hedged is None:
+        hedged = []
+
     schedule = DagSchedule()
     schedule.dag.CopyFrom(dag)
     schedule.start_time = time.time()
@@ -93,9 +204,66 @@ def call_dag(call, pusher_cache, dags, policy, request_id=None):
     if call.client_id:
         schedule.client_id = call.client_id
 
+    # Pass the call's deadline, priority class, and tenant on to the
+    # executors, which order their ready requests by them. The tenant is only
+    # set if it is not the DAG itself, which executors assume by default.
+    deadline, priority, tenant = _get_qos(call)
+    if deadline > 0:
+        schedule.locations[DEADLINE_LOCATION] = \
+            repr(schedule.start_time + deadline)
+
+    if priority != DEFAULT_PRIORITY:
+        schedule.locations[PRIORITY_LOCATION] = str(priority)
+
+    if tenant != call.name:
+        schedule.locations[TENANT_LOCATION] = tenant
+
+    if weight != DEFAULT_WEIGHT:
+        schedule.locations[WEIGHT_LOCATION] = repr(weight)
+
+    # The functions that follow another one in a fused chain run wherever the
+    # first function of the chain does, as part of its request, so they get
+    # neither an executor nor a schedule of their own. Causal mode requests
+    # are not fused, and run each function as its own request.
+    fused = {}
+    if call.consistency == NORMAL:
+        fused = sutils.get_fused_chains(dag)
+
+    heads = {}
+    for head in fused:
+        for fname in fused[head]:
+            heads[fname] = head
+
+    # In late-binding mode, the executors of some functions are not picked
+    # here: whichever executor runs a function's predecessor picks one of its
+    # replicas when it sends the trigger, knowing where the predecessor's
+    # result is and with more recent load information, and sends it the
+    # schedule then.
+    late_bound = set()
+    if late and call.consistency == NORMAL:
+        late_bound = _get_late_bound(dag, hedged)
+
     for fref in dag.functions:
         args = call.function_args[fref.name].values
 
+        if fref.name in heads:
+            schedule.arguments[fref.name].values.extend(args)
+            continue
+
+        if fref.name in late_bound:
+            candidates = policy.pick_candidates(fref.name)
+            if len(candidates) == 0:
+                response = GenericResponse()
+                response.success = False
+                response.error = NO_RESOURCES
+                return response
+
+            sutils.set_candidates(schedule, fref.name,
+                                  [(ip + ':' + str(tid), backlog) for
+                                   (ip, tid), backlog in candidates])
+            schedule.arguments[fref.name].values.extend(args)
+            continue
+
         processed = list(map(lambda arg: serializer.load(arg), args))
         flattened = tuple()
         # Unnest arguments.
@@ -111,7 +279,7 @@ def call_dag(call, pusher_cache, dags, policy, request_id=None):
 
         colocated = []
         if fref.name in dag.colocated:
-            colocated = list(dag.colocated, colocated, schedule)
+            colocated = list(dag.colocated)
 
         result = policy.pick_executor(refs, fref.name, colocated, schedule)
         if result is None:
@@ -123,13 +291,25 @@ def call_dag(call, pusher_cache, dags, policy, request_id=None):
         ip, tid = result
         schedule.locations[fref.name] = ip + ':' + str(tid)
 
+        if (fref.name in hedged and fref.name not in fused and
+                _can_hedge(call, dag, fref)):
+            backup = policy.pick_hedge_executor(fref.name, result)
+            if backup is not None:
+                schedule.locations[sutils.HEDGE_LOCATION_PREFIX +
+                                   fref.name] = backup[0] + ':' + \
+                    str(backup[1])
+
         # copy over arguments into the dag schedule
         arg_list = schedule.arguments[fref.name]
         arg_list.values.extend(args)
 
+    for fname in heads:
+        schedule.locations[fname] = schedule.locations[heads[fname]]
+
     for fref in dag.functions:
-        loc = schedule.locations[fref.name].split(':')
-        ip = utils.get_queue_address(loc[0], loc[1])
+        if fref.name in heads or fref.name in late_bound:
+            continue
+
         schedule.target_function = fref.name
 
         triggers = sutils.get_dag_predecessors(dag, fref.name)
@@ -139,8 +319,12 @@ def call_dag(call, pusher_cache, dags, policy, request_id=None):
         schedule.ClearField('triggers')
         schedule.triggers.extend(triggers)
 
-        sckt = pusher_cache.get(ip)
-        sckt.send(schedule.SerializeToString())
+        for location in _get_replicas(schedule, fref.name):
+            loc = location.split(':')
+            ip = utils.get_queue_address(loc[0], loc[1])
+
+            sckt = pusher_cache.get(ip)
+            sckt.send(schedule.SerializeToString())
 
     for source in sources:
         trigger = DagTrigger()
@@ -148,9 +332,10 @@ def call_dag(call, pusher_cache, dags, policy, request_id=None):
         trigger.source = 'BEGIN'
         trigger.target_function = source
 
-        ip = sutils.get_dag_trigger_address(schedule.locations[source])
-        sckt = pusher_cache.get(ip)
-        sckt.send(trigger.SerializeToString())
+        for location in _get_replicas(schedule, source):
+            ip = sutils.get_dag_trigger_address(location)
+            sckt = pusher_cache.get(ip)
+            sckt.send(trigger.SerializeToString())
 
     response = GenericResponse()
     response.success = True
@@ -160,3 +345,159 @@ def call_dag(call, pusher_cache, dags, policy, request_id=None):
         response.response_id = schedule.id
 
     return response
+
+
+def reroute_request(handoff_socket, pusher_cache, policy, rerouted):
+    handoff = ScheduleHandoff()
+    handoff.ParseFromString(handoff_socket.recv())
+
+    # Make sure we have stopped routing requests to the departing executor
+    # before we pick a replacement, in case its status update has not reached
+    # us yet.
+    policy.process_status(handoff.status)
+
+    triggers = []
+    for serialized in handoff.triggers:
+        trigger = DagTrigger()
+        trigger.ParseFromString(serialized)
+        triggers.append(trigger)
+
+    if not handoff.schedule:
+        # The executor never received the schedule for these triggers, so we
+        # can only forward them if we already re-routed their request.
+        for trigger in triggers:
+            key = (trigger.id, trigger.target_function)
+            if key in rerouted:
+                _forward_trigger(pusher_cache, rerouted[key][0], trigger)
+            else:
+                logging.error('Dropping handed off trigger for unknown '
+                              'request %s, function %s.' % key)
+        return
+
+    schedule = DagSchedule()
+    schedule.ParseFromString(handoff.schedule)
+    fname = schedule.target_function
+    key = (schedule.id, fname)
+
+    # If we have already re-routed this request, the new executor has the
+    # schedule, and we only need to pass along the new triggers.
+    if key in rerouted:
+        for trigger in triggers:
+            _forward_trigger(pusher_cache, rerouted[key][0], trigger)
+        return
+
+    if len(policy.function_locations.get(fname, [])) == 0:
+        logging.error('No replicas left for function %s; dropping request '
+                      '%s.' % (fname, schedule.id))
+        return
+
+    refs = list(filter(lambda arg: type(arg) == CloudburstReference,
+                       map(lambda arg: serializer.load(arg),
+                           schedule.arguments[fname].values)))
+    result = policy.pick_executor(refs, fname)
+    if result is None:
+        logging.error('Unable to re-route request %s for function %s.' %
+                      (schedule.id, fname))
+        return
+
+    ip, tid = result
+    location = ip + ':' + str(tid)
+    schedule.locations[fname] = location
+    rerouted[key] = (location, time.time())
+
+    logging.info('Re-routing request %s for function %s to %s.' %
+                 (schedule.id, fname, location))
+
+    sckt = pusher_cache.get(utils.get_queue_address(ip, tid))
+    sckt.send(schedule.SerializeToString())
+
+    for trigger in triggers:
+        _forward_trigger(pusher_cache, location, trigger)
+
+
+def _get_late_bound(dag, hedged):
+    '''
+    Returns the functions of a DAG that are late-bound. Only functions with a
+    single predecessor that sends them a single trigger are, since whoever
+    sends a trigger picks the replica: a hedged predecessor may run twice, and
+    a MULTIEXEC one once for each of its own triggers. Colocated functions
+    (including fused ones) are placed with the rest of their group, and hedged
+    ones on two replicas, so they are bound when the DAG is called.
+    '''
+    refs = {fref.name: fref for fref in dag.functions}
+
+    late_bound = set()
+    for fref in dag.functions:
+        if fref.name in dag.colocated or fref.name in hedged:
+            continue
+
+        preds = sutils.get_dag_predecessors(dag, fref.name)
+        if (len(preds) == 1 and preds[0] not in hedged and
+                refs[preds[0]].type != MULTIEXEC):
+            late_bound.add(fref.name)
+
+    return late_bound
+
+
+def _can_hedge(call, dag, fref):
+    # Both replicas of a hedged request may finish it, so we only hedge
+    # functions whose duplicate results are harmless: the results of functions
+    # in the middle of a DAG are deduplicated by the next function, and the
+    # result of a DAG that is stored in the KVS is simply written twice.
+    # Causal mode requests and MULTIEXEC functions are never hedged.
+    if call.consistency != NORMAL or fref.type == MULTIEXEC:
+        return False
+
+    is_sink = not any(conn.source == fref.name for conn in dag.connections)
+    return not (is_sink and (call.response_address or
+                             call.continuation.name))
+
+
+def _get_replicas(schedule, fname):
+    locations = [schedule.locations[fname]]
+
+    hedge = sutils.get_hedge_location(schedule, fname)
+    if hedge is not None:
+        locations.append(hedge)
+
+    return locations
+
+
+def _get_qos(call):
+    '''
+    Returns a DAG call's deadline (0 if it has none), priority class, and
+    tenant.
+    '''
+    if QOS_ARGS not in call.function_args:
+        return 0, DEFAULT_PRIORITY, call.name
+
+    qos = [serializer.load(arg) for arg in call.function_args[QOS_ARGS].values]
+    deadline, priority = qos[:2]
+    tenant = qos[2] if len(qos) > 2 and qos[2] else call.name
+
+    return deadline, priority, tenant
+
+
+def _coalesced_response(response_id):
+    response = GenericResponse()
+    response.success = True
+    response.response_id = response_id
+
+    return response
+
+
+def _overloaded_response(retry_after):
+    response = GenericResponse()
+    response.success = False
+    response.error = NO_RESOURCES
+
+    # GenericResponse has no field for this, so the hint is carried in the
+    # response ID.
+    response.response_id = RETRY_AFTER_PREFIX + ('%.3f' % (retry_after))
+
+    return response
+
+
+def _forward_trigger(pusher_cache, location, trigger):
+    sckt = pusher_cache.get(sutils.get_dag_trigger_address(location))
+    sckt.send(trigger.SerializeToString())
@@ -14,6 +14,7 @@
 
 import logging
 import random
+import time
 
 from anna.lattices import (
     LWWPairLattice,
@@ -24,6 +25,7 @@ from anna.lattices import (
 from cloudburst.shared.proto.cloudburst_pb2 import (
     Dag,
     Function,
+    GenericResponse,
     NORMAL,  # Cloudburst's consistency modes
     DAG_ALREADY_EXISTS, NO_RESOURCES, NO_SUCH_DAG  # Cloudburst's error modes
 )
@@ -32,6 +34,31 @@ from cloudburst.server.scheduler import utils
 
 sys_random = random.SystemRandom()
 
+# How long we wait for an executor to accept or reject a pin request before we
+# try another executor, in seconds.
+PIN_TIMEOUT = 10
+
+
+class DagCreation():
+    '''
+    A DAG whose functions are being pinned. Pin requests for all of the DAG's
+    functions are sent at once, and their responses are processed as they
+    arrive, so the scheduler keeps serving requests in the meantime. Rejected
+    and timed out pin requests are retried on other executors. Once every pin
+    request has been accepted, the DAG is committed; if we run out of
+    executors to try, it is discarded.
+    '''
+
+    def __init__(self, dag):
+        self.dag = dag
+
+        # The fused chains of the DAG: each chain is pinned as a unit, through
+        # a pin request for its first function.
+        self.fused = sutils.get_fused_chains(dag)
+
+        # The number of pin requests that have not been accepted yet.
+        self.outstanding = 0
+
 
 def create_function(func_create_socket, kvs, consistency=NORMAL):
     func = Function()
@@ -57,6 +84,11 @@ def create_function(func_create_socket, kvs, consistency=NORMAL):
 
 def create_dag(dag_create_socket, pusher_cache, kvs, dags, policy,
                call_frequency, num_replicas=1):
+    '''
+    Starts creating the DAG received on the socket by sending pin requests for
+    all of its functions. Returns the DagCreation, or None if the request was
+    already answered because the DAG could not be created.
+    '''
     serialized = dag_create_socket.recv()
 
     dag = Dag()
@@ -67,7 +99,7 @@ def create_dag(dag_create_socket, pusher_cache, kvs, dags, policy,
     if dag.name in dags:
         sutils.error.error = DAG_ALREADY_EXISTS
         dag_create_socket.send(sutils.error.SerializeToString())
-        return
+        return None
 
     logging.info('Creating DAG %s.' % (dag.name))
 
@@ -76,27 +108,91 @@ def create_dag(dag_create_socket, pusher_cache, kvs, dags, policy,
     payload = LWWPairLattice(sutils.generate_timestamp(0), serialized)
     kvs.put(dag.name, payload)
 
+    creation = DagCreation(dag)
+    tails = set()
+    for chain in creation.fused.values():
+        tails.update(chain)
+
     for fref in dag.functions:
+        if fref.name in tails:
+            continue
+
         for _ in range(num_replicas):
-            colocated = []
+            if not _pin(creation, fref, policy):
+                _discard_dag(creation, dag_create_socket, policy)
+                return None
+
+            creation.outstanding += 1
+
+    return creation
+
+
+def receive_pin_response(pin_accept_socket, creation, dag_create_socket, dags,
+                         policy, call_frequency):
+    '''
+    Processes an executor's response to a pin request. A rejected request is
+    retried on another executor. Returns the DagCreation if it is still in
+    progress, or None if the DAG was committed or discarded (or no DAG is being
+    created).
+    '''
+    response = GenericResponse()
+    response.ParseFromString(pin_accept_socket.recv())
+
+    result = policy.process_pin_response(response)
+    if result is None or creation is None:
+        return creation
+
+    dag_name, fref, colocated, success = result
+    if dag_name != creation.dag.name:
+        return creation
 
-            if fref.name in dag.colocated:
-                colocated = list(dag.colocated)
+    if success:
+        creation.outstanding -= 1
+    elif not policy.pin_function(dag_name, fref, colocated,
+                                 creation.fused.get(fref.name, [])):
+        _discard_dag(creation, dag_create_socket, policy)
+        return None
 
-            success = policy.pin_function(dag.name, fref, colocated)
+    if creation.outstanding == 0:
+        _commit_dag(creation, dag_create_socket, dags, policy, call_frequency)
+        return None
 
-            # The policy engine will only return False if it ran out of
-            # resources on which to attempt to pin this function.
-            if not success:
-                logging.info(f'Creating DAG {dag.name} failed due to ' +
-                             'insufficient resources.')
-                sutils.error.error = NO_RESOURCES
-                dag_create_socket.send(sutils.error.SerializeToString())
+    return creation
 
-                # Unpin any previously pinned functions because the operation
-                # failed.
-                policy.discard_dag(dag, True)
-                return
+
+def expire_pin_requests(creation, dag_create_socket, policy, now=None):
+    '''
+    Retries the pin requests that executors have not answered in time on other
+    executors. Returns the DagCreation if it is still in progress, or None if
+    the DAG was discarded.
+    '''
+    if now is None:
+        now = time.time()
+
+    for dag_name, fref, colocated in policy.expire_pins(now - PIN_TIMEOUT):
+        if creation is None or dag_name != creation.dag.name:
+            continue
+
+        if not policy.pin_function(dag_name, fref, colocated,
+                                   creation.fused.get(fref.name, [])):
+            _discard_dag(creation, dag_create_socket, policy)
+            return None
+
+    return creation
+
+
+def _pin(creation, fref, policy):
+    colocated = []
+
+    if fref.name in creation.dag.colocated:
+        colocated = list(creation.dag.colocated)
+
+    return policy.pin_function(creation.dag.name, fref, colocated,
+                               creation.fused.get(fref.name, []))
+
+
+def _commit_dag(creation, dag_create_socket, dags, policy, call_frequency):
+    dag = creation.dag
 
     # Only create this metadata after all functions have been successfully
     # created.
@@ -104,10 +200,24 @@ def create_dag(dag_create_socket, pusher_cache, kvs, dags, policy,
         if fref.name not in call_frequency:
             call_frequency[fref.name] = 0
 
-    policy.commit_dag(dag.name)
+    policy.commit_dag(dag.name, creation.fused)
     dags[dag.name] = (dag, utils.find_dag_source(dag))
     dag_create_socket.send(sutils.ok_resp)
 
+    logging.info('DAG %s created.' % (dag.name))
+
+
+def _discard_dag(creation, dag_create_socket, policy):
+    # The policy engine will only fail to pin a function if it ran out of
+    # resources on which to attempt to pin it.
+    logging.info(f'Creating DAG {creation.dag.name} failed due to ' +
+                 'insufficient resources.')
+    sutils.error.error = NO_RESOURCES
+    dag_create_socket.send(sutils.error.SerializeToString())
+
+    # Unpin any previously pinned functions because the operation failed.
+    policy.discard_dag(creation.dag, True)
+
 
 def delete_dag(dag_delete_socket, dags, policy, call_frequency):
     dag_name = dag_delete_socket.recv_string()
@@ -0,0 +1,219 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from cloudburst.shared.proto.internal_pb2 import SchedulerStatus
+
+# How often schedulers exchange metadata updates (and re-send updates that
+# have not been acknowledged), in seconds. Updates are also sent as soon as a
+# DAG is created or deleted.
+GOSSIP_INTERVAL = 1
+
+
+class SchedulerGossip():
+    '''
+    Tracks the metadata a scheduler shares with the other schedulers -- its
+    DAGs and the function locations it knows of -- as a set of versioned
+    items. Every change gets a new version, and each peer is only sent the
+    items that changed after the last version it acknowledged, so schedulers
+    only exchange what changed. Deleted DAGs are kept as tombstones until
+    every peer has acknowledged the deletion.
+
+    Every scheduler sends its updates to every other one, so we only send the
+    DAG changes that were made here: a DAG we learned of from a peer is never
+    sent on, which would let a stale copy of it outlive its deletion.
+    '''
+
+    def __init__(self, scheduler_id, ip):
+        self.id = scheduler_id
+        self.ip = ip
+
+        # The version of our most recent change.
+        self.version = 0
+
+        # Our DAGs, mapped from name to the version at which they last changed
+        # and their serialized definition, which is None for a deleted DAG.
+        self.dags = {}
+
+        # The DAGs we learned of from peers, mapped to the ID of the scheduler
+        # they were registered with.
+        self.learned = {}
+
+        # The function locations we know of, mapped to the version at which we
+        # learned of them. Function locations are only ever added through
+        # gossip; executors tell each scheduler when they leave.
+        self.locations = {}
+
+        # The version each peer (by IP) last acknowledged.
+        self.peer_acked = {}
+
+        # The IDs of the schedulers we have heard from, by IP, the version of
+        # their updates we have applied, and the version we last acknowledged
+        # to them.
+        self.peer_ids = {}
+        self.applied = {}
+        self.acked = {}
+
+    def record(self, dags, function_locations):
+        '''
+        Compares our current DAGs and function locations against what we have
+        recorded, and records a new version for everything that changed.
+        '''
+        for name in dags:
+            if name in self.learned:
+                continue
+
+            if name not in self.dags or self.dags[name][1] is None:
+                self.version += 1
+                self.dags[name] = (self.version,
+                                   dags[name][0].SerializeToString())
+
+        for name in self.dags:
+            if name not in dags and self.dags[name][1] is not None:
+                self.version += 1
+                self.dags[name] = (self.version, None)
+
+        # A DAG we learned of that is gone was deleted here, since a deletion
+        # we learned of is no longer in learned.
+        for name in list(self.learned.keys()):
+            if name not in dags:
+                del self.learned[name]
+                self.version += 1
+                self.dags[name] = (self.version, None)
+
+        current = set()
+        for fname in function_locations:
+            for ip, tid in function_locations[fname]:
+                location = (fname, ip, tid)
+                current.add(location)
+
+                if location not in self.locations:
+                    self.version += 1
+                    self.locations[location] = self.version
+
+        # If a location comes back after it went away, it is sent again.
+        for location in list(self.locations.keys()):
+            if location not in current:
+                del self.locations[location]
+
+    def build(self, peer_ip):
+        '''
+        Returns the update for a peer, with every change it has not
+        acknowledged and our acknowledgement of its own updates, or None if
+        there is nothing to send.
+        '''
+        base = self.peer_acked.get(peer_ip, 0)
+        peer_id = self.peer_ids.get(peer_ip)
+
+        ack_due = (peer_id is not None and
+                   self.acked.get(peer_id, 0) != self.applied[peer_id])
+        if base == self.version and not ack_due:
+            return None
+
+        status = SchedulerStatus()
+        status.id = self.id
+        status.ip = self.ip
+        status.version = self.version
+        status.base_version = base
+
+        if peer_id is not None:
+            status.acked_id = peer_id
+            status.acked_version = self.applied[peer_id]
+            self.acked[peer_id] = self.applied[peer_id]
+
+        for name, (version, definition) in self.dags.items():
+            if version > base:
+                if definition is None:
+                    status.removed_dags.append(name)
+                else:
+                    status.dags.append(name)
+                    status.dag_definitions.append(definition)
+
+        for (fname, ip, tid), version in self.locations.items():
+            if version > base:
+                floc = status.function_locations.add()
+                floc.name = fname
+                floc.ip = ip
+                floc.tid = tid
+
+        return status
+
+    def receive(self, status):
+        '''
+        Processes an update from a peer, and returns whether its changes
+        should be applied. If we are missing earlier changes from that peer
+        (e.g., because we just started), we skip it and acknowledge what we
+        have, so that the peer sends us everything since then.
+        '''
+        if status.acked_id == self.id:
+            self.peer_acked[status.ip] = status.acked_version
+
+        # A peer that restarted has a new ID, so we start over with it.
+        if self.peer_ids.get(status.ip) != status.id:
+            self.peer_ids[status.ip] = status.id
+            self.applied[status.id] = 0
+
+        if status.base_version > self.applied[status.id]:
+            # Make sure that we acknowledge our version, even if the peer
+            # thinks we already have.
+            self.acked[status.id] = None
+            return False
+
+        if status.version <= self.applied[status.id]:
+            return False
+
+        self.applied[status.id] = status.version
+        return True
+
+    def learn(self, status):
+        '''
+        Records the DAG changes in a peer's update that we applied, so that we
+        do not send them on as our own.
+        '''
+        for name in status.dags:
+            # A DAG we registered ourselves stays ours.
+            if name in self.dags and self.dags[name][1] is not None:
+                continue
+
+            self.dags.pop(name, None)
+            self.learned[name] = status.id
+
+        # The peer sends its deletion to everyone, including for our DAGs.
+        for name in status.removed_dags:
+            self.learned.pop(name, None)
+            if name in self.dags and self.dags[name][1] is not None:
+                del self.dags[name]
+
+    def forget(self, peers):
+        '''
+        Drops the state we keep for schedulers that are no longer in the
+        system, and the tombstones that every remaining peer has seen.
+        '''
+        for ip in list(self.peer_acked.keys()):
+            if ip not in peers:
+                del self.peer_acked[ip]
+
+        for ip in list(self.peer_ids.keys()):
+            if ip not in peers:
+                peer_id = self.peer_ids.pop(ip)
+                self.applied.pop(peer_id, None)
+                self.acked.pop(peer_id, None)
+
+        if len(self.peer_acked) < len(peers):
+            return
+
+        acked = min(self.peer_acked.values(), default=self.version)
+        for name in list(self.dags.keys()):
+            version, definition = self.dags[name]
+            if definition is None and version <= acked:
+                del self.dags[name]
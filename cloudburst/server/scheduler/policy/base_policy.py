@@ -33,22 +33,64 @@ class BaseCloudburstSchedulerPolicy():
         '''
         raise NotImplementedError
 
-    def pin_function(self, dag_name, function_name):
+    def pick_hedge_executor(self, function_name, primary):
         '''
-        Pick an executor thread on which to pin a particular DAG function. None
-        of these updates are stored permanently until we receive a commit_dag
-        call; if we receive a discard_dag call, we unpin this metadata and
-        throw it away.
+        Pick a second executor thread to run a hedged request to a function on,
+        other than the primary one, in case the primary is slow.
 
-        Returns True if the function was successfully pinned and False if we
-        ran out of resources.
+        Returns the IP-thread ID pair of the executor chosen, or None if there
+        is no other replica to hedge on.
         '''
         raise NotImplementedError
 
-    def commit_dag(self, dag_name):
+    def pick_candidates(self, function_name):
+        '''
+        Pick the executor threads that a late-bound request to a function may
+        run on, for the executor that triggers it to choose from.
+
+        Returns a list of (IP-thread ID pair, backlog) pairs, which is empty if
+        the function has no replicas.
+        '''
+        raise NotImplementedError
+
+    def pin_function(self, dag_name, function_ref, colocated, fused=None):
+        '''
+        Pick an executor thread on which to pin a particular DAG function, and
+        send it a pin request. None of these updates are stored permanently
+        until we receive a commit_dag call; if we receive a discard_dag call,
+        we unpin this metadata and throw it away. fused are the functions that
+        follow this one in a fused chain, which are pinned along with it.
+
+        Returns True if a pin request was sent and False if we ran out of
+        resources. The executor's answer is passed to process_pin_response.
+        '''
+        raise NotImplementedError
+
+    def process_pin_response(self, response):
+        '''
+        Process an executor's response to a pin request.
+
+        Returns the DAG name, function reference, and colocated functions of
+        the pin request along with whether it was accepted, or None if the
+        response is not for a pin request that is still outstanding.
+        '''
+        raise NotImplementedError
+
+    def expire_pins(self, before):
+        '''
+        Give up on the pin requests sent before the given time that executors
+        have not answered.
+
+        Returns the DAG name, function reference, and colocated functions of
+        each pin request that was given up on.
+        '''
+        raise NotImplementedError
+
+    def commit_dag(self, dag_name, fused=None):
         '''
         Persist the function location metadata generated via a sequence of
-        pin_function calls.
+        pin_function calls. fused maps the first function of each fused chain
+        to the functions that follow it, which are located wherever it is.
         '''
 
     def discard_dag(self, dag, pending):
@@ -76,6 +118,14 @@ class BaseCloudburstSchedulerPolicy():
         '''
         raise NotImplementedError
 
+    def prune(self):
+        '''
+        Drop the load metadata that has become stale, without refreshing any
+        metadata from the KVS. This is called by update, and periodically by
+        scheduler worker processes, which receive the rest of their metadata
+        from the scheduler's main process.
+        '''
+
     def update_function_locations(self, function_locations):
         '''
         Update this policy's view of which functions are stored where, either
@@ -15,18 +15,18 @@
 import logging
 import random
 import time
+import uuid
 
-import zmq
-
-from cloudburst.shared.proto.cloudburst_pb2 import GenericResponse
 from cloudburst.shared.proto.internal_pb2 import (
     CPU, GPU, # Cloudburst's executor types
-    PinFunction
+    PinFunction,
+    ThreadStatus
 )
 from cloudburst.shared.proto.shared_pb2 import StringSet
 from cloudburst.server.scheduler.policy.base_policy import (
     BaseCloudburstSchedulerPolicy
 )
+from cloudburst.server.utils import get_node_cache_key
 from cloudburst.server.scheduler.utils import (
     get_cache_ip_key,
     get_pin_address,
@@ -37,11 +37,14 @@ sys_random = random.SystemRandom()
 
 NUM_EXECUTOR_THREADS = 3
 
+# How long we remember pin requests that we gave up on, in seconds.
+ABANDONED_PIN_TTL = 60
+
 
 class DefaultCloudburstSchedulerPolicy(BaseCloudburstSchedulerPolicy):
 
-    def __init__(self, pin_accept_socket, pusher_cache, kvs_client, ip,
-                 policy, random_threshold=0.20, local=False):
+    def __init__(self, pusher_cache, kvs_client, ip, policy,
+                 random_threshold=0.20, local=False):
         # This scheduler's IP address.
         self.ip = ip
 
@@ -49,9 +52,6 @@ class DefaultCloudburstSchedulerPolicy(BaseCloudburstSchedulerPolicy):
         # locality.
         self.policy = policy
 
-        # A socket to listen for confirmations of pin operations' successes.
-        self.pin_accept_socket = pin_accept_socket
-
         # A cache for zmq.PUSH sockets.
         self.pusher_cache = pusher_cache
 
@@ -69,6 +69,10 @@ class DefaultCloudburstSchedulerPolicy(BaseCloudburstSchedulerPolicy):
         # A map to track which caches are currently caching which keys.
         self.key_locations = {}
 
+        # The number of bytes held in each node's shared cache of deserialized
+        # values, and how many it may hold, by IP address.
+        self.node_cache_sizes = {}
+
         # Executors which currently have no functions pinned on them.
         self.unpinned_cpu_executors = set()
 
@@ -86,9 +90,24 @@ class DefaultCloudburstSchedulerPolicy(BaseCloudburstSchedulerPolicy):
         # in a DAG have accepted their pin operations.
         self.pending_dags = {}
 
+        # Pin requests that executors have not answered yet, mapped from their
+        # IDs to the DAG, the function reference, the functions it is to be
+        # colocated with, the executor thread, and when the request was sent.
+        self.pending_pins = {}
+
+        # Pin requests that we gave up on, because they timed out or their DAG
+        # was discarded, mapped from their IDs to the function, the executor
+        # thread, and when we gave up. If the executor accepts one of these
+        # requests after all, we unpin the function right away.
+        self.abandoned_pins = {}
+
         # The most recently reported statuses of each executor thread.
         self.thread_statuses = {}
 
+        # The number of requests each executor thread reported having
+        # outstanding, for the threads that have any.
+        self.backlogs = {}
+
         # This quantifies how many requests should be routed stochastically
         # rather than by policy.
         self.random_threshold = random_threshold
@@ -169,10 +188,15 @@ class DefaultCloudburstSchedulerPolicy(BaseCloudburstSchedulerPolicy):
                         arg_map[ip] += 1
 
         # Get the IP address that has the maximum value in the arg_map, if
-        # there are any values.
+        # there are any values. Among nodes that have as many references
+        # cached, we prefer the one with the most room left in its shared
+        # cache, where the rest of the request's data is least likely to
+        # evict anything.
         max_ip = None
         if arg_map:
-            max_ip = max(arg_map, key=arg_map.get)
+            most = max(arg_map.values())
+            max_ip = max([ip for ip in arg_map if arg_map[ip] == most],
+                         key=self._node_cache_room)
 
         # Pick a random thead from our potential executors that is on that IP
         # address with the most keys cached.
@@ -201,7 +225,34 @@ class DefaultCloudburstSchedulerPolicy(BaseCloudburstSchedulerPolicy):
 
         return max_ip
 
-    def pin_function(self, dag_name, function_ref, colocated):
+    def pick_hedge_executor(self, function_name, primary):
+        # We hedge on the least backlogged of the function's other replicas
+        # that are not backed off.
+        candidates = [location for location in
+                      self.function_locations.get(function_name, []) if
+                      location != primary and location not in self.backoff]
+        if len(candidates) == 0:
+            return None
+
+        least = min(self.backlogs.get(location, 0) for location in candidates)
+        return sys_random.choice([location for location in candidates if
+                                  self.backlogs.get(location, 0) == least])
+
+    def pick_candidates(self, function_name):
+        # Replicas that are backed off are left out, unless there are no others.
+        locations = self.function_locations.get(function_name, [])
+        candidates = [location for location in locations if location not in
+                      self.backoff]
+        if len(candidates) == 0:
+            candidates = locations
+
+        return [(location, self.backlogs.get(location, 0)) for location in
+                candidates]
+
+    def pin_function(self, dag_name, function_ref, colocated, fused=None):
+        if fused is None:
+            fused = []
+
         # If there are no functions left to choose from, then we return None,
         # indicating that we ran out of resources to use.
         if function_ref.gpu and len(self.unpinned_gpu_executors) == 0:
@@ -223,16 +274,14 @@ class DefaultCloudburstSchedulerPolicy(BaseCloudburstSchedulerPolicy):
         else:
             candidates = set()
 
-            already_pinned = set()
-            for fn, thread in self.pending_dags[dag_name]:
-                if fn in colocated:
-                    already_pinned.add((fn, thread))
+            # Colocated functions whose pin requests are still outstanding
+            # count as pinned, since we pin all of a DAG's functions at once.
             candidate_nodes = set()
-
-            if len(already_pinned) > 0:
-                for fn, thread in already_pinned:
+            for fn, thread in self._dag_locations(dag_name):
+                if fn in colocated:
                     candidate_nodes.add(thread[0]) # The node's IP
 
+            if len(candidate_nodes) > 0:
                 for node, tid in self.unpinned_cpu_executors:
                     if node in candidate_nodes:
                         candidates.add((node, tid))
@@ -251,72 +300,90 @@ class DefaultCloudburstSchedulerPolicy(BaseCloudburstSchedulerPolicy):
                             candidates.add((node, i))
 
         if len(candidates) == 0: # There no valid executors to colocate on.
-            return self.pin_function(dag_name, function_ref, [])
+            return self.pin_function(dag_name, function_ref, [], fused)
+
+        # Pick a random executor from the set of candidates and attempt to pin
+        # this function there.
+        node, tid = sys_random.choice(list(candidates))
+
+        # Do not use this executor for anything else: If it rejects, it has
+        # something else pinned, and if it accepts, it has pinned what we are
+        # asking it to pin. In local mode, however we allow executors to have
+        # multiple functions pinned.
+        if not self.local:
+            if function_ref.gpu:
+                self.unpinned_gpu_executors.discard((node, tid))
+            else:
+                self.unpinned_cpu_executors.discard((node, tid))
 
         # Construct a PinFunction message to be sent to executors.
         pin_msg = PinFunction()
         pin_msg.name = function_ref.name
         pin_msg.batching = function_ref.batching
+        pin_msg.fused.extend(fused)
         pin_msg.response_address = self.ip
+        pin_msg.id = str(uuid.uuid4())
 
-        serialized = pin_msg.SerializeToString()
+        sckt = self.pusher_cache.get(get_pin_address(node, tid))
+        sckt.send(pin_msg.SerializeToString())
 
-        while True:
-            # Pick a random executor from the set of candidates and attempt to
-            # pin this function there.
-            node, tid = sys_random.sample(candidates, 1)[0]
+        self.pending_pins[pin_msg.id] = (dag_name, function_ref, colocated,
+                                         (node, tid), time.time())
+        return True
 
-            for other_node, _ in self.pending_dags[dag_name]:
-                if len(candidates) > 1 and node == other_node:
-                    continue
+    def process_pin_response(self, response):
+        pin_id = response.response_id
 
-            sckt = self.pusher_cache.get(get_pin_address(node, tid))
-            sckt.send(serialized)
+        if pin_id in self.abandoned_pins:
+            fname, location, _ = self.abandoned_pins.pop(pin_id)
+            if response.success:
+                logging.info('Unpinning %s from %s:%d, which accepted it late.'
+                             % (fname, location[0], location[1]))
+                self._unpin(fname, location)
 
-            response = GenericResponse()
-            try:
-                response.ParseFromString(self.pin_accept_socket.recv())
-            except zmq.ZMQError:
-                logging.error('Pin operation to %s:%d timed out. Retrying.' %
-                              (node, tid))
-                continue
+            return None
 
-            # Do not use this executor either way: If it rejected, it has
-            # something else pinned, and if it accepted, it has pinned what we
-            # just asked it to pin. In local mode, however we allow executors
-            # to have multiple functions pinned.
-            if not self.local:
-                if function_ref.gpu:
-                    self.unpinned_gpu_executors.discard((node, tid))
-                    candidates.discard((node, tid))
-                else:
-                    self.unpinned_cpu_executors.discard((node, tid))
-                    candidates.discard((node, tid))
+        if pin_id not in self.pending_pins:
+            logging.error('Received a response to unknown pin request %s.' %
+                          (pin_id))
+            return None
 
-            if response.success:
-                # The pin operation succeeded, so we return the node and thread
-                # ID to the caller.
-                self.pending_dags[dag_name].append((function_ref.name, (node,
-                                                                        tid)))
-                return True
-            else:
-                # The pin operation was rejected, remove node and try again.
-                logging.error('Node %s:%d rejected pin for %s. Retrying.'
-                              % (node, tid, function_ref.name))
+        dag_name, function_ref, colocated, location, _ = \
+            self.pending_pins.pop(pin_id)
 
-                continue
+        if response.success:
+            self.pending_dags[dag_name].append((function_ref.name, location))
+        else:
+            logging.error('Node %s:%d rejected pin for %s.' %
+                          (location[0], location[1], function_ref.name))
+
+        return dag_name, function_ref, colocated, response.success
 
-            if len(candidates) == 0 and len(colocated) > 0:
-                # Try again without colocation.
-                return self.pin_function(self, dag_name, function_ref, [])
+    def expire_pins(self, before):
+        expired = []
 
+        for pin_id in list(self.pending_pins.keys()):
+            dag_name, function_ref, colocated, location, sent = \
+                self.pending_pins[pin_id]
+
+            if sent < before:
+                logging.error('Pin operation to %s:%d timed out.' %
+                              (location[0], location[1]))
+                self._abandon_pin(pin_id)
+                expired.append((dag_name, function_ref, colocated))
+
+        return expired
+
+    def commit_dag(self, dag_name, fused=None):
+        if fused is None:
+            fused = {}
 
-    def commit_dag(self, dag_name):
         for function_name, location in self.pending_dags[dag_name]:
-            if function_name not in self.function_locations:
-                self.function_locations[function_name] = []
+            for fname in [function_name] + fused.get(function_name, []):
+                if fname not in self.function_locations:
+                    self.function_locations[fname] = []
 
-            self.function_locations[function_name].append(location)
+                self.function_locations[fname].append(location)
 
         del self.pending_dags[dag_name]
 
@@ -328,6 +395,12 @@ class DefaultCloudburstSchedulerPolicy(BaseCloudburstSchedulerPolicy):
                 # pending metadata.
                 pinned_locations = list(self.pending_dags[dag.name])
                 del self.pending_dags[dag.name]
+
+            # Any functions that are accepted from now on are unpinned as
+            # their acceptances arrive.
+            for pin_id in list(self.pending_pins.keys()):
+                if self.pending_pins[pin_id][0] == dag.name:
+                    self._abandon_pin(pin_id)
         else:
             # If the DAG was not pinned, we construct a set of all the
             # locations where functions were pinned for this DAG.
@@ -337,16 +410,37 @@ class DefaultCloudburstSchedulerPolicy(BaseCloudburstSchedulerPolicy):
 
         # For each location, we fire-and-forget an unpin message.
         for function_name, location in pinned_locations:
-            ip, tid = location
+            self._unpin(function_name, location)
+
+    def _dag_locations(self, dag_name):
+        locations = list(self.pending_dags.get(dag_name, []))
+        for name, function_ref, _, location, _ in self.pending_pins.values():
+            if name == dag_name:
+                locations.append((function_ref.name, location))
 
-            sckt = self.pusher_cache.get(get_unpin_address(ip, tid))
-            sckt.send_string(function_name)
+        return locations
+
+    def _abandon_pin(self, pin_id):
+        _, function_ref, _, location, _ = self.pending_pins.pop(pin_id)
+        self.abandoned_pins[pin_id] = (function_ref.name, location,
+                                       time.time())
+
+    def _unpin(self, function_name, location):
+        ip, tid = location
+
+        sckt = self.pusher_cache.get(get_unpin_address(ip, tid))
+        sckt.send_string(function_name)
 
     def process_status(self, status):
         key = (status.ip, status.tid)
         logging.info('Received status update from executor %s:%d.' %
                      (key[0], int(key[1])))
 
+        # A delta only tells us which functions changed, so we apply it to the
+        # last status we have for this executor.
+        if status.delta:
+            status = self._apply_status_delta(key, status)
+
         # This means that this node is currently departing, so we remove it
         # from all of our metadata tracking.
         if not status.running:
@@ -358,6 +452,8 @@ class DefaultCloudburstSchedulerPolicy(BaseCloudburstSchedulerPolicy):
 
                 del self.thread_statuses[key]
 
+            self.backlogs.pop(key, None)
+
             if status.type == CPU:
                 self.unpinned_cpu_executors.discard(key)
             else:
@@ -365,26 +461,43 @@ class DefaultCloudburstSchedulerPolicy(BaseCloudburstSchedulerPolicy):
 
             return
 
+        if status.backlog > 0:
+            self.backlogs[key] = status.backlog
+        else:
+            self.backlogs.pop(key, None)
+
+        if status.node_cache_capacity > 0:
+            self.node_cache_sizes[status.ip] = (status.node_cache_size,
+                                                status.node_cache_capacity)
+
         if len(status.functions) == 0:
             if status.type == CPU:
                 self.unpinned_cpu_executors.add(key)
             else:
                 self.unpinned_gpu_executors.add(key)
 
-        # Remove all the old function locations, and all the new ones -- there
-        # will probably be a large overlap, but this shouldn't be much
-        # different than calculating two different set differences anyway.
-        if key in self.thread_statuses and self.thread_statuses[key] != status:
-            for function_name in self.thread_statuses[key].functions:
-                if function_name in self.function_locations:
-                    self.function_locations[function_name].remove(key)
+        # We only touch the function locations of functions that were pinned
+        # or unpinned since the last status, so that status updates that do
+        # not change anything are cheap.
+        if key in self.thread_statuses:
+            old_functions = set(self.thread_statuses[key].functions)
+        else:
+            old_functions = set()
+        new_functions = set(status.functions)
+
+        for function_name in old_functions - new_functions:
+            if (function_name in self.function_locations and key in
+                    self.function_locations[function_name]):
+                self.function_locations[function_name].remove(key)
 
         self.thread_statuses[key] = status
-        for function_name in status.functions:
+        for function_name in new_functions:
             if function_name not in self.function_locations:
                 self.function_locations[function_name] = list()
 
-            if key not in self.function_locations[function_name]:
+            # A full status also restores any location we might have lost.
+            if ((function_name not in old_functions or not status.delta) and
+                    key not in self.function_locations[function_name]):
                 self.function_locations[function_name].insert(0, key)
 
         # If the executor thread is overutilized, we add it to the backoff set
@@ -403,7 +516,33 @@ class DefaultCloudburstSchedulerPolicy(BaseCloudburstSchedulerPolicy):
                              (key[0], int(key[1])))
                 self.backoff[key] = time.time()
 
-    def update(self):
+    def _apply_status_delta(self, key, delta):
+        status = ThreadStatus()
+        if key in self.thread_statuses:
+            status.CopyFrom(self.thread_statuses[key])
+
+        removed = set(delta.removed_functions)
+        functions = [fname for fname in status.functions if fname not in
+                     removed]
+        for fname in delta.added_functions:
+            if fname not in functions:
+                functions.append(fname)
+
+        status.ip = delta.ip
+        status.tid = delta.tid
+        status.running = delta.running
+        status.type = delta.type
+        status.backlog = delta.backlog
+
+        # We keep this marked as a delta, so that process_status does not
+        # re-check the locations of the functions that did not change.
+        status.delta = True
+        status.ClearField('functions')
+        status.functions.extend(functions)
+
+        return status
+
+    def prune(self):
         # Periodically clean up the running counts map to drop any times older
         # than 5 seconds.
         for executor in self.running_counts:
@@ -424,6 +563,17 @@ class DefaultCloudburstSchedulerPolicy(BaseCloudburstSchedulerPolicy):
         for executor in remove_set:
             del self.backoff[executor]
 
+        # Forget about pin requests we gave up on long ago; an executor that
+        # accepts one of these now reports the function as pinned, so we
+        # simply treat it as another replica.
+        for pin_id in list(self.abandoned_pins.keys()):
+            abandoned = self.abandoned_pins[pin_id][2]
+            if time.time() - abandoned > ABANDONED_PIN_TTL:
+                del self.abandoned_pins[pin_id]
+
+    def update(self):
+        self.prune()
+
         executors = set(map(lambda status: status.ip,
                             self.thread_statuses.values()))
 
@@ -443,12 +593,29 @@ class DefaultCloudburstSchedulerPolicy(BaseCloudburstSchedulerPolicy):
             st = StringSet()
             st.ParseFromString(lattice.reveal())
 
+            # The keys in the node's shared cache have already been read by
+            # one of its executors, so the others do not even need to
+            # deserialize them.
+            key = get_node_cache_key(ip)
+            lattice = self.kvs_client.get(key)[key]
+            if lattice is not None:
+                node_keys = StringSet()
+                node_keys.ParseFromString(lattice.reveal())
+                st.keys.extend(set(node_keys.keys) - set(st.keys))
+
             for key in st.keys:
                 if key not in self.key_locations:
                     self.key_locations[key] = []
 
                 self.key_locations[key].append(ip)
 
+    def _node_cache_room(self, ip):
+        if ip not in self.node_cache_sizes:
+            return 0
+
+        size, capacity = self.node_cache_sizes[ip]
+        return capacity - size
+
     def update_function_locations(self, new_locations):
         for location in new_locations:
             function_name = location.name
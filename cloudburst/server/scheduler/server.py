@@ -15,6 +15,7 @@
 
 import json
 import logging
+import multiprocessing
 import sys
 import time
 import uuid
@@ -24,23 +25,46 @@ from anna.client import AnnaTcpClient
 from anna.zmq_util import SocketCache
 import requests
 
-from cloudburst.server.scheduler.call import call_dag, call_function
+from cloudburst.server.scheduler.admission import AdmissionController
+from cloudburst.server.scheduler.call import (
+    call_dag,
+    call_function,
+    receive_dag_call,
+    reroute_request
+)
 from cloudburst.server.scheduler.create import (
     create_dag,
     create_function,
-    delete_dag
+    delete_dag,
+    expire_pin_requests,
+    receive_pin_response
+)
+from cloudburst.server.scheduler.gossip import (
+    GOSSIP_INTERVAL,
+    SchedulerGossip
 )
 from cloudburst.server.scheduler.policy.default_policy import (
     DefaultCloudburstSchedulerPolicy
 )
+from cloudburst.server.scheduler.singleflight import InflightCalls
+from cloudburst.server.scheduler.view import (
+    build_view,
+    VIEW_INTERVAL,
+    VIEW_REFRESH_INTERVAL
+)
+from cloudburst.server.scheduler.worker import (
+    get_worker_address,
+    merge_worker_statistics,
+    scheduler_worker,
+    start_frontend,
+    STATISTICS_SOCKET,
+    VIEW_SOCKET
+)
 import cloudburst.server.scheduler.utils as sched_utils
 import cloudburst.server.utils as sutils
 from cloudburst.shared.proto.cloudburst_pb2 import (
     Continuation,
     Dag,
-    DagCall,
-    GenericResponse,
-    NO_SUCH_DAG,  # Cloudburst's error types
     Value
 )
 from cloudburst.shared.proto.internal_pb2 import (
@@ -62,18 +86,60 @@ from cloudburst.shared.utils import (
 METADATA_THRESHOLD = 5
 REPORT_THRESHOLD = 5
 
+# How long we remember where a handed off request was re-routed to, so that
+# late triggers for it end up at the same executor.
+REROUTE_TTL = 60
+
 logging.basicConfig(filename='log_scheduler.txt', level=logging.INFO,
                     format='%(asctime)s %(message)s')
 
 
-def scheduler(ip, mgmt_ip, route_addr, policy_type):
+def scheduler(ip, mgmt_ip, route_addr, policy_type, workers=1,
+              admission_conf=None, hedging=None, coalescing_conf=None,
+              late_binding=None):
 
     # If the management IP is not set, we are running in local mode.
     local = (mgmt_ip is None)
-    kvs = AnnaTcpClient(route_addr, ip, local=local)
 
     scheduler_id = str(uuid.uuid4())
 
+    # The settings of the admission controller: the DAGs' rate limits and how
+    # large the executors' backlogs may grow before calls are rejected.
+    if admission_conf is None:
+        admission_conf = {}
+
+    # The functions of each DAG whose requests are hedged on a second replica.
+    if hedging is None:
+        hedging = {}
+
+    # The settings of the coalescing of identical calls to pure functions.
+    if coalescing_conf is None:
+        coalescing_conf = {}
+
+    # The DAGs whose functions are bound to executors as their triggers are
+    # sent, rather than when they are called.
+    if late_binding is None:
+        late_binding = []
+
+    # With more than one worker, function and DAG calls are served by worker
+    # processes, while this process handles everything else and owns the
+    # metadata. The workers are started before we create any ZMQ contexts,
+    # which do not survive a fork.
+    if workers > 1:
+        for _ in range(workers):
+            worker = multiprocessing.Process(target=scheduler_worker,
+                                             args=(scheduler_id, ip,
+                                                   policy_type, local,
+                                                   FUNC_CALL_PORT,
+                                                   DAG_CALL_PORT,
+                                                   admission_conf, hedging,
+                                                   coalescing_conf,
+                                                   late_binding),
+                                             daemon=True)
+            worker.start()
+
+    kvs = AnnaTcpClient(route_addr, ip, local=local)
+
     context = zmq.Context(1)
 
     # A mapping from a DAG's name to its protobuf representation.
@@ -94,20 +160,55 @@ def scheduler(ip, mgmt_ip, route_addr, policy_type):
     # propagate metadata to them.
     schedulers = set()
 
+    # Tracks the requests that departing executors handed off to us, and where
+    # we re-routed them.
+    rerouted = {}
+
+    # Tracks the metadata we share with other schedulers, and what each of
+    # them has acknowledged, so that we only send them what changed.
+    gossip = SchedulerGossip(scheduler_id, ip)
+    gossip_due = False
+    last_gossip = 0
+
+    # The DAG whose functions are currently being pinned, if any. We only take
+    # the next DAG creation request once this one is committed or discarded.
+    creation = None
+
     connect_socket = context.socket(zmq.REP)
     connect_socket.bind(sutils.BIND_ADDR_TEMPLATE % (CONNECT_PORT))
 
     func_create_socket = context.socket(zmq.REP)
     func_create_socket.bind(sutils.BIND_ADDR_TEMPLATE % (FUNC_CREATE_PORT))
 
-    func_call_socket = context.socket(zmq.REP)
-    func_call_socket.bind(sutils.BIND_ADDR_TEMPLATE % (FUNC_CALL_PORT))
-
     dag_create_socket = context.socket(zmq.REP)
     dag_create_socket.bind(sutils.BIND_ADDR_TEMPLATE % (DAG_CREATE_PORT))
 
-    dag_call_socket = context.socket(zmq.REP)
-    dag_call_socket.bind(sutils.BIND_ADDR_TEMPLATE % (DAG_CALL_PORT))
+    if workers > 1:
+        start_frontend(context, scheduler_id, FUNC_CALL_PORT)
+        start_frontend(context, scheduler_id, DAG_CALL_PORT)
+
+        func_call_socket = None
+        dag_call_socket = None
+
+        view_socket = context.socket(zmq.PUB)
+        view_socket.bind(get_worker_address(scheduler_id, VIEW_SOCKET))
+
+        worker_stats_socket = context.socket(zmq.PULL)
+        worker_stats_socket.bind(get_worker_address(scheduler_id,
+                                                    STATISTICS_SOCKET))
+    else:
+        func_call_socket = context.socket(zmq.REP)
+        func_call_socket.bind(sutils.BIND_ADDR_TEMPLATE % (FUNC_CALL_PORT))
+
+        dag_call_socket = context.socket(zmq.REP)
+        dag_call_socket.bind(sutils.BIND_ADDR_TEMPLATE % (DAG_CALL_PORT))
+
+        view_socket = None
+        worker_stats_socket = None
+
+    # Whether our metadata changed since we last sent a view to the workers.
+    view_due = False
+    last_view = 0
 
     dag_delete_socket = context.socket(zmq.REP)
     dag_delete_socket.bind(sutils.BIND_ADDR_TEMPLATE % (DAG_DELETE_PORT))
@@ -123,7 +224,6 @@ def scheduler(ip, mgmt_ip, route_addr, policy_type):
                              (sutils.SCHED_UPDATE_PORT))
 
     pin_accept_socket = context.socket(zmq.PULL)
-    pin_accept_socket.setsockopt(zmq.RCVTIMEO, 10000) # 10 seconds.
     pin_accept_socket.bind(sutils.BIND_ADDR_TEMPLATE %
                            (sutils.PIN_ACCEPT_PORT))
 
@@ -131,6 +231,9 @@ def scheduler(ip, mgmt_ip, route_addr, policy_type):
     continuation_socket.bind(sutils.BIND_ADDR_TEMPLATE %
                              (sutils.CONTINUATION_PORT))
 
+    handoff_socket = context.socket(zmq.PULL)
+    handoff_socket.bind(sutils.BIND_ADDR_TEMPLATE % (sutils.HANDOFF_PORT))
+
     if not local:
         management_request_socket = context.socket(zmq.REQ)
         management_request_socket.setsockopt(zmq.RCVTIMEO, 500)
@@ -146,24 +249,41 @@ def scheduler(ip, mgmt_ip, route_addr, policy_type):
     poller = zmq.Poller()
     poller.register(connect_socket, zmq.POLLIN)
     poller.register(func_create_socket, zmq.POLLIN)
-    poller.register(func_call_socket, zmq.POLLIN)
     poller.register(dag_create_socket, zmq.POLLIN)
-    poller.register(dag_call_socket, zmq.POLLIN)
     poller.register(dag_delete_socket, zmq.POLLIN)
     poller.register(list_socket, zmq.POLLIN)
     poller.register(exec_status_socket, zmq.POLLIN)
     poller.register(sched_update_socket, zmq.POLLIN)
     poller.register(continuation_socket, zmq.POLLIN)
+    poller.register(handoff_socket, zmq.POLLIN)
+    poller.register(pin_accept_socket, zmq.POLLIN)
+
+    if workers > 1:
+        poller.register(worker_stats_socket, zmq.POLLIN)
+    else:
+        poller.register(func_call_socket, zmq.POLLIN)
+        poller.register(dag_call_socket, zmq.POLLIN)
 
     # Start the policy engine.
-    policy = DefaultCloudburstSchedulerPolicy(pin_accept_socket, pusher_cache,
-                                           kvs, ip, policy_type, local=local)
+    policy = DefaultCloudburstSchedulerPolicy(pusher_cache, kvs, ip,
+                                              policy_type, local=local)
     policy.update()
 
+    admission = AdmissionController(policy, **admission_conf)
+
+    inflight = InflightCalls(**coalescing_conf)
+    inflight.pure = sched_utils.get_pure_func_set(kvs)
+
     start = time.time()
 
     while True:
-        socks = dict(poller.poll(timeout=1000))
+        # If the workers are waiting for a view, we only wait until it is due.
+        timeout = 1000
+        if view_socket is not None and view_due:
+            remaining = last_view + VIEW_INTERVAL - time.time()
+            timeout = max(0, min(timeout, int(remaining * 1000)))
+
+        socks = dict(poller.poll(timeout=timeout))
 
         if connect_socket in socks and socks[connect_socket] == zmq.POLLIN:
             msg = connect_socket.recv_string()
@@ -173,47 +293,58 @@ def scheduler(ip, mgmt_ip, route_addr, policy_type):
                 socks[func_create_socket] == zmq.POLLIN):
             create_function(func_create_socket, kvs)
 
+            # The client marks a pure function before registering it.
+            inflight.pure = sched_utils.get_pure_func_set(kvs)
+            view_due = True
+
         if func_call_socket in socks and socks[func_call_socket] == zmq.POLLIN:
-            call_function(func_call_socket, pusher_cache, policy)
+            call_function(func_call_socket, pusher_cache, policy, admission,
+                          inflight)
 
         if (dag_create_socket in socks and socks[dag_create_socket]
                 == zmq.POLLIN):
-            create_dag(dag_create_socket, pusher_cache, kvs, dags, policy,
-                       call_frequency)
+            creation = create_dag(dag_create_socket, pusher_cache, kvs, dags,
+                                  policy, call_frequency)
 
-        if dag_call_socket in socks and socks[dag_call_socket] == zmq.POLLIN:
-            call = DagCall()
-            call.ParseFromString(dag_call_socket.recv())
+            # We cannot receive another request on the socket until we have
+            # responded to this one, so we stop polling it until the DAG is
+            # committed or discarded.
+            if creation is not None:
+                poller.unregister(dag_create_socket)
 
-            name = call.name
+            view_due = True
 
-            t = time.time()
-            if name in last_arrivals:
-                if name not in interarrivals:
-                    interarrivals[name] = []
-
-                interarrivals[name].append(t - last_arrivals[name])
+        if (pin_accept_socket in socks and socks[pin_accept_socket] ==
+                zmq.POLLIN):
+            pending = creation is not None
+            creation = receive_pin_response(pin_accept_socket, creation,
+                                            dag_create_socket, dags, policy,
+                                            call_frequency)
 
-            last_arrivals[name] = t
+            if pending and creation is None:
+                poller.register(dag_create_socket, zmq.POLLIN)
+                gossip_due = True
 
-            if name not in dags:
-                resp = GenericResponse()
-                resp.success = False
-                resp.error = NO_SUCH_DAG
+            view_due = True
 
-                dag_call_socket.send(resp.SerializeToString())
-                continue
+        if creation is not None:
+            creation = expire_pin_requests(creation, dag_create_socket,
+                                           policy)
 
-            dag = dags[name]
-            for fname in dag[0].functions:
-                call_frequency[fname.name] += 1
+            if creation is None:
+                poller.register(dag_create_socket, zmq.POLLIN)
+                view_due = True
 
-            response = call_dag(call, pusher_cache, dags, policy)
-            dag_call_socket.send(response.SerializeToString())
+        if dag_call_socket in socks and socks[dag_call_socket] == zmq.POLLIN:
+            receive_dag_call(dag_call_socket, pusher_cache, dags, policy,
+                             call_frequency, interarrivals, last_arrivals,
+                             admission, hedging, inflight, late_binding)
 
         if (dag_delete_socket in socks and socks[dag_delete_socket] ==
                 zmq.POLLIN):
             delete_dag(dag_delete_socket, dags, policy, call_frequency)
+            gossip_due = True
+            view_due = True
 
         if list_socket in socks and socks[list_socket] == zmq.POLLIN:
             msg = list_socket.recv_string()
@@ -230,29 +361,40 @@ def scheduler(ip, mgmt_ip, route_addr, policy_type):
             status.ParseFromString(exec_status_socket.recv())
 
             policy.process_status(status)
+            view_due = True
 
         if sched_update_socket in socks and socks[sched_update_socket] == \
                 zmq.POLLIN:
             status = SchedulerStatus()
             status.ParseFromString(sched_update_socket.recv())
 
-            # Retrieve any DAGs that some other scheduler knows about that we
-            # do not yet know about.
-            for dname in status.dags:
-                if dname not in dags:
-                    payload = kvs.get(dname)
-                    while None in payload:
-                        payload = kvs.get(dname)
+            if gossip.receive(status):
+                gossip.learn(status)
 
+                # Other schedulers send the definitions of the DAGs they
+                # register along with their names, so we do not have to
+                # retrieve them from the KVS.
+                for definition in status.dag_definitions:
                     dag = Dag()
-                    dag.ParseFromString(payload[dname].reveal())
-                    dags[dag.name] = (dag, sched_utils.find_dag_source(dag))
+                    dag.ParseFromString(definition)
+
+                    if dag.name not in dags:
+                        dags[dag.name] = (dag,
+                                          sched_utils.find_dag_source(dag))
 
                     for fname in dag.functions:
                         if fname.name not in call_frequency:
                             call_frequency[fname.name] = 0
 
-            policy.update_function_locations(status.function_locations)
+                for dname in status.removed_dags:
+                    if dname in dags:
+                        del dags[dname]
+
+                policy.update_function_locations(status.function_locations)
+                view_due = True
+
+            # Acknowledge the update right away.
+            gossip_due = True
 
         if continuation_socket in socks and socks[continuation_socket] == \
                 zmq.POLLIN:
@@ -269,16 +411,36 @@ def scheduler(ip, mgmt_ip, route_addr, policy_type):
             for source in sources:
                 call.function_args[source].values.extend([result])
 
-            call_dag(call, pusher_cache, dags, policy, continuation.id)
+            call_dag(call, pusher_cache, dags, policy, continuation.id,
+                     hedged=hedging.get(call.name, []),
+                     late=call.name in late_binding)
 
             for fname in dag.functions:
                 call_frequency[fname.name] += 1
 
+        if handoff_socket in socks and socks[handoff_socket] == zmq.POLLIN:
+            reroute_request(handoff_socket, pusher_cache, policy, rerouted)
+
+        if (worker_stats_socket in socks and socks[worker_stats_socket] ==
+                zmq.POLLIN):
+            stats = ExecutorStatistics()
+            stats.ParseFromString(worker_stats_socket.recv())
+
+            merge_worker_statistics(stats, call_frequency, interarrivals)
+
         end = time.time()
 
         if end - start > METADATA_THRESHOLD:
             # Update the scheduler policy-related metadata.
             policy.update()
+            view_due = True
+
+            # Other schedulers' clients may have registered pure functions.
+            inflight.pure = sched_utils.get_pure_func_set(kvs)
+
+            for key in list(rerouted.keys()):
+                if end - rerouted[key][1] > REROUTE_TTL:
+                    del rerouted[key]
 
             # If the management IP is None, that means we arre running in
             # local mode, so there is no need to deal with caches and other
@@ -288,28 +450,52 @@ def scheduler(ip, mgmt_ip, route_addr, policy_type):
                 if latest_schedulers:
                     schedulers = latest_schedulers
 
-        if end - start > REPORT_THRESHOLD:
-            status = SchedulerStatus()
-            for name in dags.keys():
-                status.dags.append(name)
+        # Send the other schedulers whatever changed since they last
+        # acknowledged an update from us. We do this right away when our DAGs
+        # change, so that all schedulers quickly know about new DAGs.
+        if gossip_due or end - last_gossip > GOSSIP_INTERVAL:
+            gossip.record(dags, policy.function_locations)
+
+            peers = set(schedulers)
+            peers.discard(ip)
+            for sched_ip in peers:
+                status = gossip.build(sched_ip)
+                if status is not None:
+                    sckt = pusher_cache.get(
+                        sched_utils.get_scheduler_update_address
+                        (sched_ip))
+                    sckt.send(status.SerializeToString())
+
+            gossip.forget(peers)
+
+            gossip_due = False
+            last_gossip = end
 
+        # Send our worker processes the metadata they route calls with, soon
+        # after it changes and periodically in case a worker missed a view.
+        if view_socket is not None and ((view_due and end - last_view >
+                                         VIEW_INTERVAL) or end - last_view >
+                                        VIEW_REFRESH_INTERVAL):
+            view_socket.send(build_view(dags, policy, inflight.pure)
+                             .SerializeToString())
+
+            view_due = False
+            last_view = end
+
+        if end - start > REPORT_THRESHOLD:
             for fname in policy.function_locations:
                 logging.info('[REPLICA_NUMBER] %d replicas for function %s.' %
                              (len(policy.function_locations[fname]), fname))
-                for loc in policy.function_locations[fname]:
-                    floc = status.function_locations.add()
-                    floc.name = fname
-                    floc.ip = loc[0]
-                    floc.tid = loc[1]
 
-            msg = status.SerializeToString()
+            if admission.rejected > 0:
+                logging.info('Rejected %d calls because of overload.' %
+                             (admission.rejected))
+                admission.rejected = 0
 
-            for sched_ip in schedulers:
-                if sched_ip != ip:
-                    sckt = pusher_cache.get(
-                        sched_utils.get_scheduler_update_address
-                        (sched_ip))
-                    sckt.send(msg)
+            if inflight.coalesced > 0:
+                logging.info('Coalesced %d calls to pure functions.' %
+                             (inflight.coalesced))
+                inflight.coalesced = 0
 
             stats = ExecutorStatistics()
             for fname in call_frequency:
@@ -350,4 +536,6 @@ if __name__ == '__main__':
     sched_conf = conf['scheduler']
 
     scheduler(conf['ip'], conf['mgmt_ip'], sched_conf['routing_address'],
-              sched_conf['policy'])
+              sched_conf['policy'], sched_conf.get('workers', 1),
+              sched_conf.get('admission'), sched_conf.get('hedging'),
+              sched_conf.get('coalescing'), sched_conf.get('late_binding'))
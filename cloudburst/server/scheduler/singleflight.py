@@ -0,0 +1,158 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+from collections import OrderedDict
+import hashlib
+import time
+
+from cloudburst.shared.proto.cloudburst_pb2 import NORMAL
+from cloudburst.shared.reference import CloudburstReference
+from cloudburst.shared.serializer import Serializer
+from cloudburst.shared.utils import QOS_ARGS
+
+serializer = Serializer()
+
+# How long after a call to a pure function we attach identical calls to its
+# result, in seconds.
+COALESCE_WINDOW = 1.0
+
+
+class InflightCalls():
+    '''
+    Tracks the recent calls to pure functions (and DAGs made up only of pure
+    functions), so that a call identical to one that is still in flight is not
+    run again: the caller is given the response ID of the first call instead,
+    and reads its result from the same KVS key. Calls are identical if they
+    have the same name and the same serialized arguments.
+
+    Since the scheduler does not hear when a call finishes, a call is
+    considered in flight for a fixed window after it was scheduled. Its result
+    stays in the KVS after it finishes, so attaching a caller to a call that
+    has already finished is still correct.
+
+    Only normal mode calls whose result is stored in the KVS are coalesced:
+    calls with a direct response or a continuation are delivered to a single
+    caller. Calls with CloudburstReference arguments are never coalesced,
+    because the referenced keys may change between calls.
+    '''
+
+    def __init__(self, window=COALESCE_WINDOW):
+        self.window = window
+
+        # The names of the functions that were registered as pure.
+        self.pure = set()
+
+        # The response ID of each recent call, by the digest of its name and
+        # arguments, along with when it expires. Every call has the same
+        # window, so calls expire in the order they were recorded.
+        self.calls = OrderedDict()
+
+        # The number of calls coalesced since the last report.
+        self.coalesced = 0
+
+    def function_digest(self, call):
+        '''
+        Returns the digest of a function call, or None if it is not eligible
+        for coalescing.
+        '''
+        if call.name not in self.pure or call.consistency != NORMAL:
+            return None
+
+        if _has_references(call.arguments.values):
+            return None
+
+        digest = hashlib.sha256(call.name.encode())
+        _update_digest(digest, call.arguments.values)
+
+        return digest.hexdigest()
+
+    def dag_digest(self, call, dag):
+        '''
+        Returns the digest of a DAG call, or None if it is not eligible for
+        coalescing.
+        '''
+        if any(fref.name not in self.pure for fref in dag.functions):
+            return None
+
+        if (call.consistency != NORMAL or call.response_address or
+                call.continuation.name):
+            return None
+
+        digest = hashlib.sha256(call.name.encode())
+        for fname in sorted(call.function_args.keys()):
+            # A call's deadline, priority class, and tenant do not change its
+            # result.
+            if fname == QOS_ARGS:
+                continue
+
+            args = call.function_args[fname].values
+            if _has_references(args):
+                return None
+
+            digest.update(b'\0' + fname.encode())
+            _update_digest(digest, args)
+
+        return digest.hexdigest()
+
+    def attach(self, digest, now=None):
+        '''
+        Returns the response ID of the in-flight call with the given digest, or
+        None if there is no such call.
+        '''
+        if now is None:
+            now = time.time()
+
+        self._expire(now)
+
+        if digest not in self.calls:
+            return None
+
+        self.coalesced += 1
+        return self.calls[digest][0]
+
+    def record(self, digest, response_id, now=None):
+        if now is None:
+            now = time.time()
+
+        self.calls[digest] = (response_id, now + self.window)
+
+        # Move the call to the end, so that the calls stay in order of expiry.
+        self.calls.move_to_end(digest)
+
+    def _expire(self, now):
+        while len(self.calls) > 0:
+            digest = next(iter(self.calls))
+            if self.calls[digest][1] > now:
+                break
+
+            self.calls.popitem(last=False)
+
+
+def _update_digest(digest, args):
+    for arg in args:
+        serialized = arg.SerializeToString()
+        digest.update(len(serialized).to_bytes(8, 'big'))
+        digest.update(serialized)
+
+
+def _has_references(args):
+    for arg in args:
+        arg = serializer.load(arg)
+        if type(arg) != tuple:
+            arg = (arg,)
+
+        if any(type(a) == CloudburstReference for a in arg):
+            return True
+
+    return False
@@ -18,6 +18,7 @@ from anna.lattices import SetLattice
 
 import cloudburst.server.utils as sutils
 from cloudburst.shared.proto.shared_pb2 import StringSet
+from cloudburst.shared.utils import PURE_FUNCS_KEY
 
 FUNCOBJ = 'funcs/index-allfuncs'
 
@@ -52,6 +53,14 @@ def put_func_list(client, funclist):
     client.put(FUNCOBJ, lattice)
 
 
+def get_pure_func_set(client):
+    funcs = client.get(PURE_FUNCS_KEY)[PURE_FUNCS_KEY]
+    if not funcs:
+        return set()
+
+    return set(map(lambda v: str(v, 'utf-8'), funcs.reveal()))
+
+
 def get_cache_ip_key(ip):
     return 'ANNA_METADATA|cache_ip|' + ip
 
@@ -0,0 +1,139 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import time
+
+from cloudburst.server.scheduler import utils
+from cloudburst.shared.proto.cloudburst_pb2 import Dag
+from cloudburst.shared.proto.internal_pb2 import CPU, GPU, SchedulerView
+
+# The shortest interval between two views sent to the worker processes after
+# the scheduler's metadata changed, in seconds.
+VIEW_INTERVAL = 0.1
+
+# How often the view is sent even if nothing changed, so that workers that
+# just started (or missed a view) catch up, in seconds.
+VIEW_REFRESH_INTERVAL = 1
+
+
+def build_view(dags, policy, pure_functions=None):
+    '''
+    Builds a snapshot of the DAGs, the routing metadata of a scheduler's
+    policy engine, and the functions that were registered as pure.
+    '''
+    view = SchedulerView()
+
+    for name, (dag, _) in dags.items():
+        view.dag_names.append(name)
+        view.dag_definitions.append(dag.SerializeToString())
+
+    for fname, locations in policy.function_locations.items():
+        for ip, tid in locations:
+            floc = view.function_locations.add()
+            floc.name = fname
+            floc.ip = ip
+            floc.tid = tid
+
+    _add_executors(view.unpinned_executors, policy.unpinned_cpu_executors,
+                   CPU)
+    _add_executors(view.unpinned_executors, policy.unpinned_gpu_executors,
+                   GPU)
+    _add_executors(view.backoff, policy.backoff, CPU)
+
+    for (ip, tid), backlog in policy.backlogs.items():
+        executor = view.backlogs.add()
+        executor.ip = ip
+        executor.tid = tid
+        executor.backlog = backlog
+
+    for key, ips in policy.key_locations.items():
+        kloc = view.key_locations.add()
+        kloc.key = key
+        kloc.ips.extend(ips)
+
+    for ip, (size, capacity) in policy.node_cache_sizes.items():
+        cache = view.node_cache_sizes.add()
+        cache.ip = ip
+        cache.size = size
+        cache.capacity = capacity
+
+    if pure_functions is not None:
+        view.pure_functions.extend(pure_functions)
+
+    return view
+
+
+def apply_view(view, dags, policy, call_frequency, inflight=None):
+    '''
+    Replaces a worker's DAGs, routing metadata, and pure functions with the
+    ones in the view. Only DAGs the worker has not seen yet are parsed.
+    '''
+    names = set(view.dag_names)
+    for name in list(dags.keys()):
+        if name not in names:
+            del dags[name]
+
+    for name, definition in zip(view.dag_names, view.dag_definitions):
+        if name in dags:
+            continue
+
+        dag = Dag()
+        dag.ParseFromString(definition)
+        dags[name] = (dag, utils.find_dag_source(dag))
+
+        for fref in dag.functions:
+            if fref.name not in call_frequency:
+                call_frequency[fref.name] = 0
+
+    function_locations = {}
+    for floc in view.function_locations:
+        if floc.name not in function_locations:
+            function_locations[floc.name] = []
+
+        function_locations[floc.name].append((floc.ip, floc.tid))
+    policy.function_locations = function_locations
+
+    policy.unpinned_cpu_executors = set()
+    policy.unpinned_gpu_executors = set()
+    for executor in view.unpinned_executors:
+        if executor.type == GPU:
+            policy.unpinned_gpu_executors.add((executor.ip, executor.tid))
+        else:
+            policy.unpinned_cpu_executors.add((executor.ip, executor.tid))
+
+    # The main process decides how long executors stay backed off, so we just
+    # keep the ones it still has.
+    now = time.time()
+    policy.backoff = {(executor.ip, executor.tid): now for executor in
+                      view.backoff}
+
+    policy.backlogs = {(executor.ip, executor.tid): executor.backlog for
+                       executor in view.backlogs}
+
+    policy.key_locations = {kloc.key: list(kloc.ips) for kloc in
+                            view.key_locations}
+
+    policy.node_cache_sizes = {cache.ip: (cache.size, cache.capacity) for
+                               cache in view.node_cache_sizes}
+
+    if inflight is not None:
+        inflight.pure = set(view.pure_functions)
+
+
+def _add_executors(field, executors, typ):
+    for ip, tid in executors:
+        executor = field.add()
+        executor.ip = ip
+        executor.tid = tid
+        executor.type = typ
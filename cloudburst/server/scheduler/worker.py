@@ -0,0 +1,184 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import logging
+import threading
+import time
+
+import zmq
+
+from anna.zmq_util import SocketCache
+
+from cloudburst.server.scheduler.admission import AdmissionController
+from cloudburst.server.scheduler.call import call_function, receive_dag_call
+from cloudburst.server.scheduler.policy.default_policy import (
+    DefaultCloudburstSchedulerPolicy
+)
+from cloudburst.server.scheduler.singleflight import InflightCalls
+from cloudburst.server.scheduler.view import apply_view
+import cloudburst.server.utils as sutils
+from cloudburst.shared.proto.internal_pb2 import (
+    ExecutorStatistics,
+    SchedulerView
+)
+
+# How often workers report their call statistics to the main process and prune
+# their load metadata, in seconds.
+WORKER_REPORT_INTERVAL = 1
+
+# The socket names a scheduler's worker processes connect to.
+VIEW_SOCKET = 'view'
+STATISTICS_SOCKET = 'statistics'
+
+
+def get_worker_address(scheduler_id, name):
+    return 'ipc:///tmp/cloudburst-scheduler-%s-%s' % (scheduler_id, name)
+
+
+def start_frontend(context, scheduler_id, port):
+    '''
+    Accepts client requests on the given port with a ROUTER socket and passes
+    them on to the scheduler's worker processes through a DEALER socket, which
+    spreads them across the workers and routes their replies back to the
+    clients. The proxy runs on a background thread.
+    '''
+    def proxy():
+        frontend = context.socket(zmq.ROUTER)
+        frontend.bind(sutils.BIND_ADDR_TEMPLATE % (port))
+
+        backend = context.socket(zmq.DEALER)
+        backend.bind(get_worker_address(scheduler_id, port))
+
+        zmq.proxy(frontend, backend)
+
+    thread = threading.Thread(target=proxy, daemon=True)
+    thread.start()
+
+
+def merge_worker_statistics(stats, call_frequency, interarrivals):
+    '''
+    Adds the call statistics a worker reported to the main process's.
+    '''
+    for fstats in stats.functions:
+        if fstats.name in call_frequency:
+            call_frequency[fstats.name] += fstats.call_count
+
+    for dstats in stats.dags:
+        if dstats.name not in interarrivals:
+            interarrivals[dstats.name] = []
+
+        interarrivals[dstats.name].extend(dstats.interarrival)
+
+
+def scheduler_worker(scheduler_id, ip, policy_type, local, func_call_port,
+                     dag_call_port, admission_conf, hedging,
+                     coalescing_conf, late_binding):
+    '''
+    A scheduler worker process, which serves function and DAG calls. The
+    scheduler's main process owns all of the metadata: It sends the workers a
+    view of its DAGs and policy metadata whenever they change, and the workers
+    report how often each function and DAG was called back to it. Each worker
+    admits and coalesces calls on its own, so the DAGs' rate limits apply per
+    worker, and only identical calls served by the same worker are coalesced.
+    '''
+    context = zmq.Context(1)
+
+    func_call_socket = context.socket(zmq.REP)
+    func_call_socket.connect(get_worker_address(scheduler_id, func_call_port))
+
+    dag_call_socket = context.socket(zmq.REP)
+    dag_call_socket.connect(get_worker_address(scheduler_id, dag_call_port))
+
+    # We only care about the most recent view.
+    view_socket = context.socket(zmq.SUB)
+    view_socket.setsockopt(zmq.CONFLATE, 1)
+    view_socket.setsockopt_string(zmq.SUBSCRIBE, '')
+    view_socket.connect(get_worker_address(scheduler_id, VIEW_SOCKET))
+
+    statistics_socket = context.socket(zmq.PUSH)
+    statistics_socket.connect(get_worker_address(scheduler_id,
+                                                 STATISTICS_SOCKET))
+
+    pusher_cache = SocketCache(context, zmq.PUSH)
+
+    poller = zmq.Poller()
+    poller.register(func_call_socket, zmq.POLLIN)
+    poller.register(dag_call_socket, zmq.POLLIN)
+    poller.register(view_socket, zmq.POLLIN)
+
+    # Workers never read metadata from the KVS, so the policy engine does not
+    # need a KVS client.
+    policy = DefaultCloudburstSchedulerPolicy(pusher_cache, None, ip,
+                                              policy_type, local=local)
+    admission = AdmissionController(policy, **admission_conf)
+    inflight = InflightCalls(**coalescing_conf)
+
+    dags = {}
+    call_frequency = {}
+    interarrivals = {}
+    last_arrivals = {}
+
+    last_report = time.time()
+
+    while True:
+        socks = dict(poller.poll(timeout=1000))
+
+        if view_socket in socks and socks[view_socket] == zmq.POLLIN:
+            view = SchedulerView()
+            view.ParseFromString(view_socket.recv())
+
+            apply_view(view, dags, policy, call_frequency, inflight)
+
+        if func_call_socket in socks and socks[func_call_socket] == zmq.POLLIN:
+            call_function(func_call_socket, pusher_cache, policy, admission,
+                          inflight)
+
+        if dag_call_socket in socks and socks[dag_call_socket] == zmq.POLLIN:
+            receive_dag_call(dag_call_socket, pusher_cache, dags, policy,
+                             call_frequency, interarrivals, last_arrivals,
+                             admission, hedging, inflight, late_binding)
+
+        end = time.time()
+        if end - last_report > WORKER_REPORT_INTERVAL:
+            policy.prune()
+
+            if admission.rejected > 0:
+                logging.info('Rejected %d calls because of overload.' %
+                             (admission.rejected))
+                admission.rejected = 0
+
+            if inflight.coalesced > 0:
+                logging.info('Coalesced %d calls to pure functions.' %
+                             (inflight.coalesced))
+                inflight.coalesced = 0
+
+            stats = ExecutorStatistics()
+            for fname in call_frequency:
+                if call_frequency[fname] > 0:
+                    fstats = stats.functions.add()
+                    fstats.name = fname
+                    fstats.call_count = call_frequency[fname]
+
+                    call_frequency[fname] = 0
+
+            for dname in interarrivals:
+                if len(interarrivals[dname]) > 0:
+                    dstats = stats.dags.add()
+                    dstats.name = dname
+                    dstats.interarrival.extend(interarrivals[dname])
+
+                    interarrivals[dname].clear()
+
+            statistics_socket.send(stats.SerializeToString())
+            last_report = end
@@ -17,7 +17,10 @@ import time
 from anna.lattices import VectorClock, MaxIntLattice
 import yaml
 
-from cloudburst.shared.proto.cloudburst_pb2 import GenericResponse
+from cloudburst.shared.proto.cloudburst_pb2 import (
+    GenericResponse,
+    MULTIEXEC  # Cloudburst's execution types
+)
 
 FUNC_PREFIX = 'funcs/'
 BIND_ADDR_TEMPLATE = 'tcp://*:%d'
@@ -28,12 +31,34 @@ FUNC_EXEC_PORT = 4020
 DAG_QUEUE_PORT = 4030
 DAG_EXEC_PORT = 4040
 SELF_DEPART_PORT = 4050
+OBJECT_REQUEST_PORT = 4060
+OBJECT_RESPONSE_PORT = 4070
 
 STATUS_PORT = 5007
 SCHED_UPDATE_PORT = 5008
 BACKOFF_PORT = 5009
 PIN_ACCEPT_PORT = 5010
 CONTINUATION_PORT = 5011
+HANDOFF_PORT = 5012
+
+# A hedged request's schedule is also sent to a second replica of its function,
+# whose location is stored in the schedule's locations under this prefix
+# followed by the function's name. Its triggers are sent to both replicas, and
+# whichever finishes first tells the other with a trigger from HEDGE_CANCEL.
+HEDGE_LOCATION_PREFIX = '__hedge__/'
+HEDGE_CANCEL = 'HEDGE_CANCEL'
+
+# A late-bound function's executor is not picked when its DAG is called, but by
+# the executor that sends it its trigger. The replicas it may pick from are
+# stored in the schedule's locations under this prefix followed by the
+# function's name, as a comma-separated list of 'ip:tid=backlog' entries, where
+# backlog is the replica's backlog when the DAG was called.
+CANDIDATES_LOCATION_PREFIX = '__candidates__/'
+
+# The keys held in each node's shared cache of deserialized values are written
+# to the KVS under this prefix followed by the node's IP address, as a
+# StringSet, so that schedulers can send requests to where their data is.
+NODE_CACHE_PREFIX = 'CLOUDBURST_METADATA|node_cache|'
 
 # For message sending via the user library.
 RECV_INBOX_PORT = 5500
@@ -62,6 +87,11 @@ def get_dag_trigger_address(address):
     return 'tcp://' + ip + ':' + str(int(tid) + DAG_EXEC_PORT)
 
 
+def get_dag_queue_address(address):
+    ip, tid = address.split(':')
+    return 'tcp://' + ip + ':' + str(int(tid) + DAG_QUEUE_PORT)
+
+
 def get_statistics_report_address(mgmt_ip):
     return 'tcp://' + mgmt_ip + ':' + str(STATISTICS_REPORT_PORT)
 
@@ -84,6 +114,108 @@ def get_dag_predecessors(dag, fname):
     return result
 
 
+def get_fused_chains(dag):
+    '''
+    Returns the linear chains of colocated functions in a DAG that are pinned
+    and run as one unit, as a map from the first function of each chain to the
+    functions that follow it, in order. Two functions are fused if the first
+    one's only successor is the second one, the second one's only predecessor
+    is the first one, and both are colocated. Batching-enabled and MULTIEXEC
+    functions are never fused, nor are CPU and GPU functions.
+    '''
+    refs = {fref.name: fref for fref in dag.functions}
+
+    successors = {}
+    predecessors = {}
+    for conn in dag.connections:
+        if conn.source not in successors:
+            successors[conn.source] = []
+        successors[conn.source].append(conn.sink)
+
+        if conn.sink not in predecessors:
+            predecessors[conn.sink] = []
+        predecessors[conn.sink].append(conn.source)
+
+    def fusible(fname):
+        fref = refs[fname]
+        return (fname in dag.colocated and not fref.batching and
+                fref.type != MULTIEXEC)
+
+    def next_stage(fname):
+        if len(successors.get(fname, [])) != 1:
+            return None
+
+        sink = successors[fname][0]
+        if (len(predecessors[sink]) == 1 and fusible(sink) and
+                refs[sink].gpu == refs[fname].gpu):
+            return sink
+
+        return None
+
+    chains = {}
+    for fref in dag.functions:
+        fname = fref.name
+        if not fusible(fname):
+            continue
+
+        # A chain starts at a function that does not follow another one in a
+        # chain.
+        preds = predecessors.get(fname, [])
+        if len(preds) == 1 and next_stage(preds[0]) == fname and \
+                fusible(preds[0]):
+            continue
+
+        chain = []
+        stage = next_stage(fname)
+        while stage is not None:
+            chain.append(stage)
+            stage = next_stage(stage)
+
+        if len(chain) > 0:
+            chains[fname] = chain
+
+    return chains
+
+
+def get_hedge_location(schedule, fname):
+    '''
+    Returns the location of the second replica a request to the function is
+    hedged on, or None if it is not hedged.
+    '''
+    key = HEDGE_LOCATION_PREFIX + fname
+    if key in schedule.locations:
+        return schedule.locations[key]
+
+    return None
+
+
+def get_candidates(schedule, fname):
+    '''
+    Returns the replicas a late-bound function may run on, as (location,
+    backlog) pairs, or None if the function is not late-bound.
+    '''
+    key = CANDIDATES_LOCATION_PREFIX + fname
+    if key not in schedule.locations:
+        return None
+
+    candidates = []
+    for entry in schedule.locations[key].split(','):
+        location, backlog = entry.split('=')
+        candidates.append((location, int(backlog)))
+
+    return candidates
+
+
+def set_candidates(schedule, fname, candidates):
+    entries = [location + '=' + str(backlog) for location, backlog in
+               candidates]
+    schedule.locations[CANDIDATES_LOCATION_PREFIX + fname] = ','.join(entries)
+
+
+def get_node_cache_key(ip):
+    return NODE_CACHE_PREFIX + ip
+
+
 def get_user_msg_inbox_addr(ip, tid):
     return 'tcp://' + ip + ':' + str(int(tid) + RECV_INBOX_PORT)
 
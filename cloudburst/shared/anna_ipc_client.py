@@ -36,6 +36,9 @@ PUT_REQUEST_ADDR = "ipc:///requests/put"
 
 GET_RESPONSE_ADDR_TEMPLATE = "ipc:///requests/get_%d"
 PUT_RESPONSE_ADDR_TEMPLATE = "ipc:///requests/put_%d"
+PREFETCH_RESPONSE_ADDR_TEMPLATE = "ipc:///requests/prefetch_%d"
+PUT_ACK_ADDR_TEMPLATE = "ipc:///requests/put_ack_%d"
+CAUSAL_PUT_ACK_ADDR_TEMPLATE = "ipc:///requests/causal_put_ack_%d"
 
 
 class AnnaIpcClient(BaseAnnaClient):
@@ -47,6 +50,10 @@ class AnnaIpcClient(BaseAnnaClient):
 
         self.get_response_address = GET_RESPONSE_ADDR_TEMPLATE % thread_id
         self.put_response_address = PUT_RESPONSE_ADDR_TEMPLATE % thread_id
+        self.prefetch_response_address = \
+            PREFETCH_RESPONSE_ADDR_TEMPLATE % thread_id
+        self.put_ack_address = PUT_ACK_ADDR_TEMPLATE % thread_id
+        self.causal_put_ack_address = CAUSAL_PUT_ACK_ADDR_TEMPLATE % thread_id
 
         self.get_request_socket = self.context.socket(zmq.PUSH)
         self.get_request_socket.connect(GET_REQUEST_ADDR)
@@ -62,6 +69,20 @@ class AnnaIpcClient(BaseAnnaClient):
         self.put_response_socket.setsockopt(zmq.RCVTIMEO, 100)
         self.put_response_socket.bind(self.put_response_address)
 
+        # Responses to asynchronous gets arrive on their own socket, so that
+        # they never get confused with the response to a blocking get. The
+        # caller is expected to poll this socket and call receive_async.
+        self.prefetch_response_socket = self.context.socket(zmq.PULL)
+        self.prefetch_response_socket.bind(self.prefetch_response_address)
+
+        # Likewise, the acks for asynchronous puts arrive on their own
+        # sockets, and are read with receive_put_acks.
+        self.put_ack_socket = self.context.socket(zmq.PULL)
+        self.put_ack_socket.bind(self.put_ack_address)
+
+        self.causal_put_ack_socket = self.context.socket(zmq.PULL)
+        self.causal_put_ack_socket.bind(self.causal_put_ack_address)
+
         self.rid = 0
 
         # Set this to None because we do not use the address cache, but the
@@ -92,15 +113,60 @@ class AnnaIpcClient(BaseAnnaClient):
             resp.ParseFromString(msg)
 
             for tp in resp.tuples:
-                if tp.error == KEY_DNE:
+                # We ignore keys we did not ask for (e.g., from a response to
+                # an earlier request that timed out), so that the caller only
+                # sees values for its own keys.
+                if tp.error == KEY_DNE or tp.key not in kv_pairs:
                     continue
 
                 kv_pairs[tp.key] = self._deserialize(tp)
 
             return kv_pairs
 
+    def get_async(self, keys):
+        '''
+        Requests a set of keys without waiting for the response, which is
+        retrieved with receive_async once prefetch_response_socket is readable.
+        '''
+        if type(keys) != list:
+            keys = [keys]
+
+        request, _ = self._prepare_data_request(keys)
+        request.response_address = self.prefetch_response_address
+        self.get_request_socket.send(request.SerializeToString())
+
+    def receive_async(self):
+        '''
+        Returns the key-value pairs in the next response to get_async, omitting
+        keys that do not exist, or an empty dict if no response is waiting.
+        '''
+        kv_pairs = {}
+
+        try:
+            msg = self.prefetch_response_socket.recv(zmq.DONTWAIT)
+        except zmq.ZMQError as e:
+            if e.errno != zmq.EAGAIN:
+                logging.error("Unexpected error while receiving prefetched "
+                              "keys: %s." % (str(e)))
+
+            return kv_pairs
+
+        resp = CausalResponse()
+        resp.ParseFromString(msg)
+
+        for tp in resp.tuples:
+            if tp.error == KEY_DNE:
+                continue
+
+            kv_pairs[tp.key] = self._deserialize(tp)
+
+        return kv_pairs
+
     def causal_get(self, keys, t_low, t_high,
-                   consistency=SINGLE, client_id=0):
+                   consistency=SINGLE, client_id=0, future_read_set=None):
+        if future_read_set is None:
+            future_read_set = set()
+
         if type(keys) != list:
             keys = list(keys)
 
@@ -108,6 +174,10 @@ class AnnaIpcClient(BaseAnnaClient):
         request, _ = self._prepare_causal_data_request(client_id, keys,
                                                        consistency, t_low, t_high)
 
+        # The keys that the rest of the DAG will read, so that the cache can
+        # pick a snapshot in which they are also readable and stage them.
+        request.future_read_set.extend(future_read_set)
+
         request.response_address = self.get_response_address
 
         self.get_request_socket.send(request.SerializeToString())
@@ -126,33 +196,26 @@ class AnnaIpcClient(BaseAnnaClient):
 
             return kv_pairs
         else:
-            kv_pairs = {}
             resp = CausalResponse()
             resp.ParseFromString(msg)
 
+            # Each key is resolved independently: a key that does not exist or
+            # is missing from the response stays None, so that the caller can
+            # re-request only that key while keeping the others.
             for tp in resp.tuples:
                 if tp.error == KEY_DNE:
                     logging.error("Error: Key %s does not exist" % (str(tp.key)))
-                    return kv_pairs
-                if tp.key not in keys:
+                    continue
+                if tp.key not in kv_pairs:
                     logging.error("Error: Key %s does not belong" % (str(tp.key)))
                     continue
-                    #kv_pairs = {}
-                    #for key in keys:
-                    #    kv_pairs[key] = None
-                    #return kv_pairs
+
                 val = self._deserialize(tp)
 
                 # We resolve multiple concurrent versions by randomly picking
                 # the first listed value.
                 kv_pairs[tp.key] = val
 
-            if len(kv_pairs) != len(keys):
-                logging.error("Error: I dont have enough right answers")
-
-                for key in keys:
-                    kv_pairs[key] = None
-
             return kv_pairs
 
     def put(self, keys, values):
@@ -218,6 +281,64 @@ class AnnaIpcClient(BaseAnnaClient):
         else:
             return True
 
+    def put_async(self, keys, values):
+        '''
+        Writes a set of keys in a single request without waiting for the acks,
+        which are retrieved with receive_put_acks.
+        '''
+        if type(keys) != list:
+            keys = [keys]
+        if type(values) != list:
+            values = [values]
+
+        request, tuples = self._prepare_data_request(keys)
+
+        for tup, value in zip(tuples, values):
+            tup.payload, tup.lattice_type = self._serialize(value)
+
+        request.response_address = self.put_ack_address
+        self.put_request_socket.send(request.SerializeToString())
+
+    def causal_put_async(self, key, mk_causal_value, client_id):
+        '''
+        The asynchronous version of causal_put; see put_async.
+        '''
+        request, tuples = self._prepare_causal_data_request(client_id, (key,),
+                                                            MULTI)
+        tuples[0].payload, _ = self._serialize(mk_causal_value)
+
+        request.response_address = self.causal_put_ack_address
+        self.put_request_socket.send(request.SerializeToString())
+
+    def receive_put_acks(self):
+        '''
+        Returns a map from each key acked since the last call to whether the
+        write succeeded, without blocking.
+        '''
+        acks = {}
+
+        for sckt, resp_type in ((self.put_ack_socket, KeyResponse),
+                                (self.causal_put_ack_socket, CausalResponse)):
+            while True:
+                try:
+                    msg = sckt.recv(zmq.DONTWAIT)
+                except zmq.ZMQError as e:
+                    if e.errno != zmq.EAGAIN:
+                        logging.error("Unexpected error while receiving put "
+                                      "acks: %s." % (str(e)))
+                    break
+
+                resp = resp_type()
+                resp.ParseFromString(msg)
+
+                # As in causal_put, any response to a causal put means that
+                # it was applied.
+                for tup in resp.tuples:
+                    acks[tup.key] = (resp_type == CausalResponse or
+                                     tup.error == NO_ERROR)
+
+        return acks
+
     def _prepare_causal_data_request(self, client_id, keys, consistency,  t_low = 0, t_high = 0):
         request = CausalRequest()
         request.consistency = consistency
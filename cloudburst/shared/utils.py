@@ -32,3 +32,31 @@ DAG_CALL_PORT = 5005
 
 # The port on which DAG deletion requests are made.
 DAG_DELETE_PORT = 5006
+
+# The KVS key of the set of functions that were registered as pure, whose
+# identical in-flight calls the schedulers coalesce.
+PURE_FUNCS_KEY = 'funcs/index-purefuncs'
+
+# When the scheduler rejects a call because the system is overloaded, the
+# response has the NO_RESOURCES error, and its response_id is this prefix
+# followed by how long the client should wait before retrying, in seconds.
+RETRY_AFTER_PREFIX = 'retry-after:'
+
+# DagCall and DagSchedule are defined in the common protobufs, so a DAG call's
+# deadline, priority class, and tenant travel under reserved keys. The client
+# puts them in the call's function_args, as three arguments: the number of
+# seconds the call has to finish in (0 for no deadline), its priority class,
+# and its tenant ('' to share with the other calls to the DAG). The scheduler
+# copies them into the locations of the call's schedules, with the deadline as
+# an absolute time, along with the tenant's weight.
+QOS_ARGS = '__qos__'
+DEADLINE_LOCATION = '__deadline__'
+PRIORITY_LOCATION = '__priority__'
+TENANT_LOCATION = '__tenant__'
+WEIGHT_LOCATION = '__weight__'
+
+# Executors run ready requests with a higher priority class first.
+DEFAULT_PRIORITY = 0
+
+# Tenants share executors in proportion to their weights.
+DEFAULT_WEIGHT = 1.0
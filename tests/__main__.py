@@ -16,13 +16,28 @@ import sys
 import unittest
 
 from tests.server.executor import (
+    test_batching,
+    test_binding,
     test_call as test_executor_call,
+    test_coalescer,
+    test_hedging,
+    test_memo,
+    test_node_cache,
     test_pin,
+    test_ready,
+    test_status,
+    test_store,
+    test_tracker,
+    test_transport,
     test_user_library
 )
 from tests.server.scheduler import (
+    test_admission,
     test_call as test_scheduler_call,
-    test_create
+    test_create,
+    test_gossip,
+    test_singleflight,
+    test_view
 )
 from tests.server.scheduler.policy import test_default_policy
 from tests.shared import test_serializer
@@ -33,18 +48,48 @@ def cloudburst_test_suite():
     loader = unittest.TestLoader()
 
     # Load Cloudburst Executor tests
+    cloudburst_tests.append(
+        loader.loadTestsFromTestCase(test_batching.TestAdaptiveBatcher))
+    cloudburst_tests.append(
+        loader.loadTestsFromTestCase(test_binding.TestLateBinder))
     cloudburst_tests.append(
         loader.loadTestsFromTestCase(test_executor_call.TestExecutorCall))
+    cloudburst_tests.append(
+        loader.loadTestsFromTestCase(test_coalescer.TestWriteCoalescer))
+    cloudburst_tests.append(
+        loader.loadTestsFromTestCase(test_hedging.TestHedgeTracker))
+    cloudburst_tests.append(
+        loader.loadTestsFromTestCase(test_memo.TestResultCache))
+    cloudburst_tests.append(
+        loader.loadTestsFromTestCase(test_node_cache.TestNodeCache))
     cloudburst_tests.append(
         loader.loadTestsFromTestCase(test_pin.TestExecutorPin))
+    cloudburst_tests.append(
+        loader.loadTestsFromTestCase(test_ready.TestReadyQueue))
+    cloudburst_tests.append(
+        loader.loadTestsFromTestCase(test_status.TestStatusReporter))
+    cloudburst_tests.append(
+        loader.loadTestsFromTestCase(test_store.TestObjectStore))
+    cloudburst_tests.append(
+        loader.loadTestsFromTestCase(test_tracker.TestRequestTracker))
+    cloudburst_tests.append(
+        loader.loadTestsFromTestCase(test_transport.TestTransportCache))
     cloudburst_tests.append(
         loader.loadTestsFromTestCase(test_user_library.TestUserLibrary))
 
     # Load Cloudburst Scheduler tests
+    cloudburst_tests.append(
+        loader.loadTestsFromTestCase(test_admission.TestAdmissionController))
     cloudburst_tests.append(
         loader.loadTestsFromTestCase(test_scheduler_call.TestSchedulerCall))
     cloudburst_tests.append(
         loader.loadTestsFromTestCase(test_create.TestSchedulerCreate))
+    cloudburst_tests.append(
+        loader.loadTestsFromTestCase(test_gossip.TestSchedulerGossip))
+    cloudburst_tests.append(
+        loader.loadTestsFromTestCase(test_singleflight.TestInflightCalls))
+    cloudburst_tests.append(
+        loader.loadTestsFromTestCase(test_view.TestSchedulerView))
     cloudburst_tests.append(
         loader.loadTestsFromTestCase(
             test_default_policy.TestDefaultSchedulerPolicy))
@@ -14,8 +14,6 @@
 
 from anna.base_client import BaseAnnaClient
 
-from cloudburst.server.utils import DEFAULT_VC
-from cloudburst.shared.proto.shared_pb2 import KeyVersion
 from cloudburst.shared.proto.cloudburst_pb2 import NORMAL
 
 
@@ -32,6 +30,18 @@ class MockAnnaClient(BaseAnnaClient):
         self.kvs = {}
         self.serialize = serialize
 
+        # The keys requested by each outstanding get_async call.
+        self.async_requests = []
+
+        # The keys written by each put_async or causal_put_async call, and the
+        # acks that have not been received yet.
+        self.async_puts = []
+        self.put_acks = {}
+
+        # The keys, snapshot interval, and downstream read set of each
+        # causal_get call.
+        self.causal_requests = []
+
     def get(self, keys):
         if type(keys) is not list:
             keys = [keys]
@@ -49,6 +59,34 @@ class MockAnnaClient(BaseAnnaClient):
 
         return result
 
+    def get_async(self, keys):
+        if type(keys) is not list:
+            keys = [keys]
+
+        self.async_requests.append(keys)
+
+    def receive_async(self):
+        if len(self.async_requests) == 0:
+            return {}
+
+        result = self.get(self.async_requests.pop(0))
+        return {key: result[key] for key in result if result[key] is not None}
+
+    def put_async(self, keys, lattices):
+        self.async_puts.append(keys)
+        self.put(keys, lattices)
+
+        for key in keys:
+            self.put_acks[key] = True
+
+    def causal_put_async(self, key, lattice, client_id=0):
+        self.put_async([key], [lattice])
+
+    def receive_put_acks(self):
+        acks = self.put_acks
+        self.put_acks = {}
+        return acks
+
     def put(self, keys, lattices):
         if type(keys) != list:
             keys = [keys]
@@ -61,17 +99,14 @@ class MockAnnaClient(BaseAnnaClient):
             self.kvs[key] = lattice
         return True
 
-    def causal_get(self, keys, future_read_set=set(), key_version_locations={},
-                   consistency=NORMAL, client_id=0):
-        address = '127.0.0.1'
-        versions = []
-        for key in keys:
-            kv = KeyVersion()
-            kv.key = key
-            DEFAULT_VC.serialize(kv.vector_clock)
-            versions.append(kv)
+    def causal_get(self, keys, t_low, t_high, consistency=NORMAL, client_id=0,
+                   future_read_set=None):
+        if future_read_set is None:
+            future_read_set = set()
 
-        return (address, versions), self.get(keys)
+        self.causal_requests.append((keys, t_low, t_high,
+                                     set(future_read_set)))
+        return self.get(keys)
 
     def causal_put(self, key, lattice, client_id=0):
         # TODO(vikram): Do we need to populate causal metadata here?
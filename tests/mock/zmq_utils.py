@@ -51,6 +51,11 @@ class MockZmqSocket():
     def bind(self, addr):
         self.address = addr
 
+    # Like zmq's poll, this returns a truthy value if a message is waiting.
+    # Since nothing arrives while we wait, the timeout is ignored.
+    def poll(self, timeout=None, flags=None):
+        return len(self.inbox)
+
 
 class MockZmqContext():
     def __init__(self):
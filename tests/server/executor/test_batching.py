@@ -0,0 +1,92 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import unittest
+
+from cloudburst.server.executor.batching import AdaptiveBatcher
+
+
+class TestAdaptiveBatcher(unittest.TestCase):
+    '''
+    Tests for the executor's adaptive batcher, ensuring that batches are only
+    held back while more requests are expected, and that the batch size and
+    linger time follow the measured runtime of previous batches.
+    '''
+
+    def test_no_linger_at_low_load(self):
+        '''
+        A single request that arrives while nothing else is arriving should be
+        run immediately.
+        '''
+        batcher = AdaptiveBatcher(max_batch_size=10, max_linger=1.0)
+        batcher.record(1, 0.5)
+
+        batcher.add('a', now=0.0)
+        self.assertEqual(batcher.take(now=0.0), ['a'])
+        self.assertEqual(len(batcher), 0)
+
+    def test_linger_while_requests_arrive(self):
+        '''
+        When requests arrive quickly, the batcher should wait for more of them
+        until the batch fills up or the oldest request's deadline passes.
+        '''
+        batcher = AdaptiveBatcher(max_batch_size=10, max_linger=1.0)
+        batcher.record(1, 0.5)
+
+        batcher.add('a', now=0.0)
+        batcher.add('b', now=0.01)
+        self.assertEqual(batcher.take(now=0.01), [])
+        self.assertEqual(batcher.deadline(), batcher.linger)
+
+        self.assertEqual(batcher.take(now=batcher.deadline()), ['a', 'b'])
+
+    def test_batch_size_follows_runtime_model(self):
+        '''
+        Batches should grow while the fixed per-batch overhead dominates, and
+        should be capped by the latency target.
+        '''
+        batcher = AdaptiveBatcher(max_batch_size=100, max_linger=1.0)
+
+        # A fixed overhead of 1 second and 0.01 seconds per request.
+        batcher.record(1, 1.01)
+        batcher.record(10, 1.1)
+        self.assertEqual(batcher.batch_size, 100)
+        self.assertAlmostEqual(batcher.linger, 1.0)
+
+        batcher = AdaptiveBatcher(max_batch_size=100, max_linger=1.0,
+                                  target_latency=1.205)
+        batcher.record(1, 1.01)
+        batcher.record(10, 1.1)
+        self.assertEqual(batcher.batch_size, 20)
+
+        # If the runtime is entirely per request, there is nothing to amortize.
+        batcher = AdaptiveBatcher(max_batch_size=100, max_linger=1.0)
+        batcher.record(1, 0.1)
+        batcher.record(10, 1.0)
+        self.assertEqual(batcher.batch_size, 1)
+        self.assertAlmostEqual(batcher.linger, 0.0)
+
+    def test_full_batch_runs_immediately(self):
+        '''
+        A full batch should never wait, and requests beyond the batch size
+        should be left for the next batch.
+        '''
+        batcher = AdaptiveBatcher(max_batch_size=2, max_linger=1.0)
+        batcher.record(1, 0.5)
+
+        for idx, item in enumerate(['a', 'b', 'c']):
+            batcher.add(item, now=idx * 0.001)
+
+        self.assertEqual(batcher.take(now=0.002), ['a', 'b'])
+        self.assertTrue('c' in batcher)
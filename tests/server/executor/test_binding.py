@@ -0,0 +1,88 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import unittest
+
+from cloudburst.server.executor.binding import LateBinder, LOCALITY_SLACK
+from cloudburst.server.utils import set_candidates
+from cloudburst.shared.proto.cloudburst_pb2 import DagSchedule
+from cloudburst.shared.proto.internal_pb2 import ThreadStatus
+
+
+class TestLateBinder(unittest.TestCase):
+    '''
+    Tests for the executor's late binder, ensuring that it prefers replicas on
+    its own node unless they are much more backlogged, and that it accounts
+    for the requests it binds and for newer backlog reports.
+    '''
+
+    def setUp(self):
+        self.status = ThreadStatus(ip='127.0.0.1', tid=0)
+        self.binder = LateBinder(self.status)
+
+        self.remote = '10.0.0.1:0'
+        self.local = '127.0.0.1:1'
+
+    def test_prefers_own_node(self):
+        '''
+        A replica on our node should be picked over a less backlogged remote
+        one, as long as it is within the slack.
+        '''
+        schedule = self._create_schedule({self.remote: 0,
+                                          self.local: LOCALITY_SLACK}, 1)
+        self.assertEqual(self.binder.bind(schedule, 'fn'), self.local)
+        self.assertEqual(self.binder.local, 1)
+
+        schedule = self._create_schedule({self.remote: 0,
+                                          self.local: LOCALITY_SLACK + 1}, 2)
+        self.assertEqual(self.binder.bind(schedule, 'fn'), self.remote)
+        self.assertEqual(self.binder.local, 1)
+        self.assertEqual(self.binder.late_bound, 2)
+
+    def test_own_backlog(self):
+        '''
+        Our own backlog should be used for ourselves, rather than the one the
+        scheduler reported.
+        '''
+        own = '127.0.0.1:0'
+        schedule = self._create_schedule({own: 0, self.local: 0}, 1)
+
+        self.status.backlog = 1
+        self.assertEqual(self.binder.bind(schedule, 'fn'), self.local)
+
+    def test_counts_bound_requests(self):
+        '''
+        The requests we bind to a replica should count towards its backlog
+        until a newer backlog is reported for it.
+        '''
+        schedule = self._create_schedule({self.remote: 0, self.local: 0}, 1)
+
+        for _ in range(LOCALITY_SLACK + 1):
+            self.assertEqual(self.binder.bind(schedule, 'fn'), self.local)
+        self.assertEqual(self.binder.bind(schedule, 'fn'), self.remote)
+
+        # A newer report replaces the estimate, but an older one does not.
+        self.binder.observe(self._create_schedule({self.remote: 0,
+                                                   self.local: 0}, 2))
+        self.binder.observe(self._create_schedule({self.remote: 0,
+                                                   self.local: 9}, 0))
+        self.assertEqual(self.binder.bind(schedule, 'fn'), self.local)
+
+    def _create_schedule(self, backlogs, start_time):
+        schedule = DagSchedule()
+        schedule.id = 'id'
+        schedule.start_time = start_time
+        set_candidates(schedule, 'fn', list(backlogs.items()))
+
+        return schedule
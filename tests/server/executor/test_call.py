@@ -22,9 +22,23 @@ from anna.lattices import (
     SingleKeyCausalLattice,
     VectorClock
 )
-
-from cloudburst.server.executor.call import exec_function, exec_dag_function
+import numpy as np
+
+from cloudburst.server.executor.binding import LateBinder
+from cloudburst.server.executor.call import (
+    _group_by_snapshot,
+    _resolve_ref_causal,
+    exec_function,
+    exec_dag_function,
+    object_references,
+    prefetch_references,
+    receive_prefetched
+)
+from cloudburst.server.executor.memo import ResultCache
+from cloudburst.server.executor.node_cache import NodeCache
+from cloudburst.server.executor.store import ObjectReference, ObjectStore
 from cloudburst.server.executor.user_library import CloudburstUserLibrary
+from cloudburst.server import utils as sutils
 from cloudburst.server.utils import DEFAULT_VC
 from cloudburst.shared.proto.cloudburst_pb2 import (
     DagSchedule,
@@ -35,6 +49,7 @@ from cloudburst.shared.proto.cloudburst_pb2 import (
     EXECUTION_ERROR, FUNC_NOT_FOUND,  # Cloudburst's error types
     MULTIEXEC # Cloudburst's execution types
 )
+from cloudburst.shared.proto.internal_pb2 import ThreadStatus
 from cloudburst.shared.reference import CloudburstReference
 from cloudburst.shared.serializer import Serializer
 from tests.mock import kvs_client, zmq_utils
@@ -233,6 +248,82 @@ class TestExecutorCall(unittest.TestCase):
         # Check that the output is equal to a local function execution.
         self.assertEqual(result, func('', arg_value))
 
+    def test_exec_func_with_node_cached_ref(self):
+        '''
+        Tests that an array one executor read from the KVS is found by another
+        executor on the same node in their shared cache.
+        '''
+        def func(_, x): return x.sum()
+        fname = 'sum'
+        create_function(func, self.kvs_client, fname)
+
+        arg_value = np.arange(10)
+        arg_name = 'key'
+        self.kvs_client.put(arg_name, serializer.dump_lattice(arg_value))
+
+        node_cache = NodeCache(self.ip, 1024 * 1024, slots=4,
+                               name='cb-test-exec-cache')
+        other = NodeCache(self.ip, 1024 * 1024, slots=4,
+                          name='cb-test-exec-cache')
+
+        try:
+            call = self._create_function_call(
+                fname, [CloudburstReference(arg_name, True)], NORMAL)
+            self.socket.inbox.append(call.SerializeToString())
+            exec_function(self.socket, self.kvs_client, self.user_library, {},
+                          {}, node_cache=node_cache)
+            self.assertEqual(node_cache.inserts, 1)
+
+            # The other executor does not need the KVS to read the array.
+            del self.kvs_client.kvs[arg_name]
+            self.socket.inbox.append(call.SerializeToString())
+            exec_function(self.socket, self.kvs_client, self.user_library, {},
+                          {}, node_cache=other)
+            self.assertEqual(other.hits, 1)
+
+            result = self.kvs_client.get(self.response_key)[self.response_key]
+            self.assertEqual(serializer.load_lattice(result), arg_value.sum())
+        finally:
+            other.close()
+            node_cache.close(unlink=True)
+
+    def test_exec_func_with_partially_resolved_refs(self):
+        '''
+        Tests that when only some of a function's references can be read from
+        the KVS, only the missing ones are requested again.
+        '''
+        def func(_, x, y): return x + y
+        fname = 'add'
+
+        self.kvs_client.put('x', serializer.dump_lattice(1))
+        self.kvs_client.put('y', serializer.dump_lattice(2))
+
+        # The first time it is requested, y is not available yet.
+        requested = []
+        get = self.kvs_client.get
+
+        def delayed_get(keys):
+            requested.append(keys)
+            result = get(keys)
+            if len(requested) == 1:
+                result['y'] = None
+            return result
+
+        self.kvs_client.get = delayed_get
+
+        call = self._create_function_call(
+            fname, [CloudburstReference('x', True),
+                    CloudburstReference('y', True)], NORMAL)
+        self.socket.inbox.append(call.SerializeToString())
+        exec_function(self.socket, self.kvs_client, self.user_library, {},
+                      {fname: func})
+
+        self.assertEqual(sorted(requested[0]), ['x', 'y'])
+        self.assertEqual(requested[1], ['y'])
+
+        result = get(self.response_key)[self.response_key]
+        self.assertEqual(serializer.load_lattice(result), func('', 1, 2))
+
     def test_exec_func_with_causal_ref(self):
         '''
         Tests a function execution where the argument is a reference to the
@@ -406,6 +497,281 @@ class TestExecutorCall(unittest.TestCase):
         # Check that the output is equal to a local function execution.
         self.assertEqual(result, func('', arg))
 
+    def test_exec_dag_memoized(self):
+        '''
+        Tests that a pure function is only run once for two requests with the
+        same arguments, and that both requests get its result.
+        '''
+        calls = []
+
+        def func(_, x):
+            calls.append(x)
+            return x * x
+
+        fname = 'square'
+        arg = 2
+        dag = create_linear_dag([func], [fname], self.kvs_client, 'dag')
+
+        memo = ResultCache(self.kvs_client)
+        memo.pure.add(fname)
+
+        for sid in ['id1', 'id2']:
+            schedule, triggers = self._create_fn_schedule(dag, arg, fname,
+                                                          [fname])
+            schedule.id = sid
+            triggers[0].id = sid
+
+            exec_dag_function(self.pusher_cache, self.kvs_client, [triggers],
+                              func, [schedule], self.user_library, {}, {}, [],
+                              False, memo=memo)
+
+            result = self.kvs_client.get(sid)[sid]
+            self.assertEqual(serializer.load_lattice(result), arg * arg)
+
+        self.assertEqual(calls, [arg])
+        self.assertEqual(memo.hits, 1)
+        self.assertEqual(memo.misses, 1)
+
+    def test_exec_dag_fused(self):
+        '''
+        Tests that the functions fused after a function are run right after it,
+        that each one gets the previous one's result along with its own
+        arguments, and that their runtimes are reported separately.
+        '''
+        def incr(_, x): return x + 1
+
+        def add(_, y, x): return x + y
+
+        fnames = ['incr', 'add']
+        dag = create_linear_dag([incr, add], fnames, self.kvs_client, 'dag')
+        dag.colocated.extend(fnames)
+
+        schedule, triggers = self._create_fn_schedule(dag, 1, 'incr', fnames)
+        serializer.dump(10, schedule.arguments['add'].values.add(), False)
+
+        stage_runtimes = {}
+        exec_dag_function(self.pusher_cache, self.kvs_client, [triggers], incr,
+                          [schedule], self.user_library, {}, {}, [], False,
+                          function_cache={'incr': incr, 'add': add},
+                          stage_runtimes=stage_runtimes)
+
+        # Nothing is sent to the fused function; the result is in the KVS.
+        self.assertEqual(len(self.pusher_cache.socket.outbox), 0)
+        result = self.kvs_client.get(schedule.id)[schedule.id]
+        self.assertEqual(serializer.load_lattice(result), 12)
+
+        self.assertEqual(set(stage_runtimes.keys()), set(fnames))
+        self.assertEqual(len(stage_runtimes['add']), 1)
+
+    def test_exec_dag_late_bound(self):
+        '''
+        Tests that the executor of a late-bound function is picked when its
+        trigger is sent, and that it is sent the function's schedule first.
+        '''
+        def incr(_, x): return x + 1
+
+        def square(_, x): return x * x
+
+        fnames = ['incr', 'square']
+        dag = create_linear_dag([incr, square], fnames, self.kvs_client,
+                                'dag')
+
+        schedule, triggers = self._create_fn_schedule(dag, 1, 'incr',
+                                                      ['incr'])
+        location = '10.0.0.1:2'
+        sutils.set_candidates(schedule, 'square', [(location, 0)])
+
+        binder = LateBinder(ThreadStatus(ip=self.ip, tid=0))
+        exec_dag_function(self.pusher_cache, self.kvs_client, [triggers],
+                          incr, [schedule], self.user_library, {}, {}, [],
+                          False, binder=binder)
+
+        self.assertEqual(self.pusher_cache.addresses,
+                         [sutils.get_dag_queue_address(location),
+                          sutils.get_dag_trigger_address(location)])
+
+        bound = DagSchedule()
+        bound.ParseFromString(self.pusher_cache.socket.outbox[0])
+        self.assertEqual(bound.id, schedule.id)
+        self.assertEqual(bound.target_function, 'square')
+        self.assertEqual(list(bound.triggers), ['incr'])
+        self.assertEqual(bound.locations['square'], location)
+        self.assertEqual(sutils.get_candidates(bound, 'square'), None)
+
+        trigger = DagTrigger()
+        trigger.ParseFromString(self.pusher_cache.socket.outbox[1])
+        self.assertEqual(trigger.target_function, 'square')
+        self.assertEqual(serializer.load(trigger.arguments.values[0]), 2)
+
+        self.assertEqual(binder.late_bound, 1)
+
+    def test_exec_dag_large_result(self):
+        '''
+        Tests that a result above the object store's threshold is kept in the
+        store and passed along as a reference, and that the next function reads
+        it from the store.
+        '''
+        def incr(_, x): return x + 1
+
+        def square(_, x): return x * x
+
+        fnames = ['incr', 'square']
+        dag = create_linear_dag([incr, square], fnames, self.kvs_client,
+                                'dag')
+
+        store = ObjectStore(self.ip, 0, zmq_utils.MockZmqContext(),
+                            self.pusher_cache, self.kvs_client, threshold=0)
+
+        schedule, triggers = self._create_fn_schedule(dag, 1, 'incr', fnames)
+        exec_dag_function(self.pusher_cache, self.kvs_client, [triggers], incr,
+                          [schedule], self.user_library, {}, {}, [], False,
+                          store=store)
+
+        trigger = DagTrigger()
+        trigger.ParseFromString(self.pusher_cache.socket.outbox[0])
+        ref = serializer.load(trigger.arguments.values[0])
+        self.assertEqual(type(ref), ObjectReference)
+        self.assertEqual(ref.location, self.ip + ':0')
+        self.assertEqual(len(store.objects), 1)
+
+        schedule, _ = self._create_fn_schedule(dag, None, 'square', fnames)
+        schedule.ClearField('arguments')
+        exec_dag_function(self.pusher_cache, self.kvs_client, [[trigger]],
+                          square, [schedule], self.user_library, {}, {}, [],
+                          False, store=store)
+
+        result = self.kvs_client.get(schedule.id)[schedule.id]
+        self.assertEqual(serializer.load_lattice(result), 4)
+        self.assertEqual(len(store.objects), 0)
+
+    def test_exec_dag_missing_object(self):
+        '''
+        Tests that a request whose argument is an object that cannot be found
+        fails with an error result instead of waiting for it forever.
+        '''
+        def square(_, x): return x * x
+
+        fnames = ['incr', 'square']
+        dag = create_linear_dag([square, square], fnames, self.kvs_client,
+                                'dag')
+
+        store = ObjectStore(self.ip, 0, zmq_utils.MockZmqContext(),
+                            self.pusher_cache, self.kvs_client, timeout=0)
+
+        schedule, _ = self._create_fn_schedule(dag, None, 'square', fnames)
+        schedule.ClearField('arguments')
+
+        trigger = DagTrigger()
+        trigger.id = schedule.id
+        trigger.source = 'incr'
+        trigger.arguments.values.extend([serializer.dump(
+            ObjectReference('objects/missing', '10.0.0.1:0'), None, False)])
+
+        successes = exec_dag_function(self.pusher_cache, self.kvs_client,
+                                      [[trigger]], square, [schedule],
+                                      self.user_library, {}, {}, [], False,
+                                      store=store)
+        self.assertEqual(successes, [True])
+
+        result = serializer.load_lattice(
+            self.kvs_client.get(schedule.id)[schedule.id])
+        self.assertTrue(result[0].startswith('ERROR'))
+
+    def test_exec_dag_with_prefetched_ref(self):
+        '''
+        Tests that a DAG function's reference arguments are fetched into the
+        cache when its schedule arrives, and that the function then runs
+        against the cached value.
+        '''
+        def func(_, x): return x * x
+        fname = 'square'
+        arg_value = 2
+        arg_name = 'key'
+        self.kvs_client.put(arg_name, serializer.dump_lattice(arg_value))
+
+        dag = create_linear_dag([func], [fname], self.kvs_client, 'dag')
+        schedule, triggers = self._create_fn_schedule(
+            dag, CloudburstReference(arg_name, True), fname, [fname])
+
+        cache = {}
+        prefetching = {}
+        prefetch_references(self.kvs_client, schedule, cache, prefetching)
+        self.assertEqual(self.kvs_client.async_requests, [[arg_name]])
+
+        # A second schedule for the same key does not fetch it again.
+        prefetch_references(self.kvs_client, schedule, cache, prefetching)
+        self.assertEqual(len(self.kvs_client.async_requests), 1)
+
+        receive_prefetched(self.kvs_client, cache, prefetching)
+        self.assertEqual(cache, {arg_name: arg_value})
+        self.assertEqual(len(prefetching), 0)
+
+        # Change the value in the KVS to make sure that the cached value is
+        # the one that is used.
+        self.kvs_client.put(arg_name, serializer.dump_lattice(3))
+        exec_dag_function(self.pusher_cache, self.kvs_client, [triggers], func,
+                          [schedule], self.user_library, {}, cache, [], False)
+
+        result = self.kvs_client.get(schedule.id)[schedule.id]
+        result = serializer.load_lattice(result)
+        self.assertEqual(result, func('', arg_value))
+
+    def test_object_references(self):
+        '''
+        Tests that the references to objects in other executors' stores are
+        found among a request's trigger arguments.
+        '''
+        ref = ObjectReference('objects/key', '10.0.0.1:0')
+
+        trigger = DagTrigger()
+        trigger.arguments.values.extend([serializer.dump(1, None, False),
+                                         serializer.dump('a', None, False),
+                                         serializer.dump(ref, None, False)])
+
+        refs = object_references([trigger])
+        self.assertEqual(len(refs), 1)
+        self.assertEqual(refs[0].key, ref.key)
+        self.assertEqual(refs[0].location, ref.location)
+
+    def test_prefetch_children_refs(self):
+        '''
+        Tests that the references of downstream functions are only prefetched
+        if those functions run on this node, and that each is loaded as its
+        reference asks.
+        '''
+        def incr(_, x): return x + 1
+        iname = 'incr'
+
+        def square(_, x, y): return x * y
+        sname = 'square'
+
+        def double(_, x): return x * 2
+        dname = 'double'
+
+        for key in ['raw', 'value', 'remote']:
+            self.kvs_client.put(key, serializer.dump_lattice(2))
+
+        dag = create_linear_dag([incr, square, double], [iname, sname, dname],
+                                self.kvs_client, 'dag')
+        schedule, _ = self._create_fn_schedule(dag, 1, iname,
+                                               [iname, sname, dname])
+        schedule.locations[dname] = '10.0.0.1:0'
+        schedule.arguments[sname].values.extend([
+            serializer.dump(CloudburstReference('raw', False), None, False),
+            serializer.dump(CloudburstReference('value', True), None, False)])
+        schedule.arguments[dname].values.extend([
+            serializer.dump(CloudburstReference('remote', True), None, False)])
+
+        cache = {}
+        prefetching = {}
+        prefetch_references(self.kvs_client, schedule, cache, prefetching,
+                            children=True)
+        self.assertEqual(prefetching, {'raw': False, 'value': True})
+
+        receive_prefetched(self.kvs_client, cache, prefetching)
+        self.assertEqual(cache['value'], 2)
+        self.assertEqual(cache['raw'], serializer.dump(2))
+
     def test_exec_causal_dag_sink(self):
         '''
         Tests that the last function in a causal DAG executes correctly and
@@ -490,6 +856,114 @@ class TestExecutorCall(unittest.TestCase):
         val = serializer.load(trigger.arguments.values[0])
         self.assertEqual(val, incr('', arg))
 
+    def test_group_causal_batch_by_snapshot(self):
+        '''
+        Tests that the requests in a causal batch are grouped so that each
+        group's snapshot intervals overlap, and that requests from different
+        clients are never grouped together.
+        '''
+        schedules = []
+        for client_id in ['a', 'a', 'a', 'b']:
+            schedule = DagSchedule()
+            schedule.client_id = client_id
+            schedule.consistency = MULTI
+            schedules.append(schedule)
+
+        windows = [(0, 10), (5, 20), (15, 30), (0, 2**64 - 1)]
+        groups = _group_by_snapshot(schedules, windows)
+
+        self.assertEqual(len(groups), 3)
+        self.assertTrue(([0, 1], 5, 10) in groups)
+        self.assertTrue(([2], 15, 30) in groups)
+        self.assertTrue(([3], 0, 2**64 - 1) in groups)
+
+    def test_causal_read_sends_children_read_set(self):
+        '''
+        Tests that a causal read tells the KVS which keys the downstream
+        functions are going to read, leaving out the keys read now.
+        '''
+        def incr(_, x): return x + 1
+        iname = 'incr'
+
+        def square(_, x, y): return x * y
+        sname = 'square'
+
+        for key in ['arg', 'child']:
+            self.kvs_client.put(key, serializer.dump_lattice(2))
+
+        dag = create_linear_dag([incr, square], [iname, sname],
+                                self.kvs_client, 'dag', MultiKeyCausalLattice)
+        ref = CloudburstReference('arg', False)
+        schedule, _ = self._create_fn_schedule(dag, ref, iname,
+                                               [iname, sname], MULTI)
+        schedule.arguments[sname].values.extend([
+            serializer.dump(CloudburstReference('child', True), None, False),
+            serializer.dump(CloudburstReference('arg', True), None, False)])
+
+        kv_pairs, _, _ = _resolve_ref_causal([ref], self.kvs_client, schedule,
+                                             5, 10)
+        self.assertEqual(kv_pairs['arg'], serializer.dump(2))
+        self.assertEqual(self.kvs_client.causal_requests,
+                         [(['arg'], 5, 10, {'child'})])
+
+    def test_exec_causal_dag_batch_snapshots(self):
+        '''
+        Executes a batch of two causal requests that are read from the same
+        snapshot: one whose predecessors picked an interval and that reads a
+        KVS key, and one that can read from any snapshot and reads nothing.
+        Each request should pass its own interval downstream.
+        '''
+        def incr(_, xs): return [x + 1 for x in xs]
+        iname = 'incr'
+
+        def square(_, x): return x * x
+        sname = 'square'
+
+        arg_name = 'arg'
+        arg = serializer.dump_lattice(1)
+        arg.ts, arg.promise = 6, 8
+        self.kvs_client.put(arg_name, arg)
+
+        dag = create_linear_dag([incr, square], [iname, sname],
+                                self.kvs_client, 'dag', MultiKeyCausalLattice)
+
+        schedules = []
+        trigger_sets = []
+        for fn_arg, window in [(CloudburstReference(arg_name, True), (5, 10)),
+                               (2, (0, 0))]:
+            schedule, triggers = self._create_fn_schedule(
+                dag, fn_arg, iname, [iname, sname], MULTI)
+            schedule.id = 'id%d' % len(schedules)
+            schedule.client_id = 'client'
+            triggers[0].id = schedule.id
+            triggers[0].t_low, triggers[0].t_high = window
+
+            schedules.append(schedule)
+            trigger_sets.append(triggers)
+
+        exec_dag_function(self.pusher_cache, self.kvs_client, trigger_sets,
+                          incr, schedules, self.user_library, {}, {}, [], True)
+
+        # Both requests' references are read with a single request.
+        self.assertEqual(self.kvs_client.causal_requests,
+                         [([arg_name], 5, 10, set())])
+
+        self.assertEqual(len(self.pusher_cache.socket.outbox), 2)
+        triggers = {}
+        for msg in self.pusher_cache.socket.outbox:
+            trigger = DagTrigger()
+            trigger.ParseFromString(msg)
+            triggers[trigger.id] = trigger
+
+        # The first request passes on the interval it was given.
+        self.assertEqual(triggers['id0'].t_low, 5)
+        self.assertEqual(triggers['id0'].t_high, 10)
+
+        # The second request read nothing, so its successors can still read
+        # from any snapshot.
+        self.assertEqual(triggers['id1'].t_low, 2**64 - 1)
+        self.assertEqual(triggers['id1'].t_high, 2**64 - 1)
+
     def test_exec_causal_dag_non_sink(self):
         '''
         Creates and executes a non-sink function in a causal-mode DAG. This
@@ -0,0 +1,81 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import logging
+import unittest
+
+from cloudburst.server.executor.coalescer import ACK_TIMEOUT, WriteCoalescer
+from tests.mock import kvs_client
+
+logging.disable(logging.CRITICAL)
+
+
+class TestWriteCoalescer(unittest.TestCase):
+    '''
+    Tests for the executor's write coalescer, ensuring that writes are sent
+    together once their window passes, and that they are sent again until
+    they are acked.
+    '''
+
+    def setUp(self):
+        self.kvs_client = kvs_client.MockAnnaClient()
+        self.writer = WriteCoalescer(self.kvs_client, window=1.0, limit=3)
+
+    def test_coalesce_writes(self):
+        '''
+        Writes made within one window should be sent in a single put once the
+        window passes, and forgotten once they are acked.
+        '''
+        self.writer.put('a', 1)
+        self.writer.put('b', 2)
+
+        self.writer.flush(now=self.writer.first_buffered)
+        self.assertEqual(len(self.kvs_client.async_puts), 0)
+
+        self.writer.flush(now=self.writer.deadline())
+        self.assertEqual(self.kvs_client.async_puts, [['a', 'b']])
+        self.assertEqual(self.kvs_client.get(['a', 'b']), {'a': 1, 'b': 2})
+
+        self.assertEqual(len(self.writer), 2)
+        self.writer.receive_acks()
+        self.assertEqual(len(self.writer), 0)
+        self.assertEqual(self.writer.deadline(), None)
+
+    def test_full_buffer_is_sent(self):
+        '''
+        A full buffer should be sent without waiting for the window to pass.
+        '''
+        for key in ['a', 'b', 'c']:
+            self.writer.put(key, 1)
+
+        self.writer.flush(now=self.writer.first_buffered)
+        self.assertEqual(self.kvs_client.async_puts, [['a', 'b', 'c']])
+
+    def test_retry_unacked_write(self):
+        '''
+        A write that is not acked in time should be sent again.
+        '''
+        self.writer.put('a', 1)
+        self.writer.flush(force=True, now=0)
+
+        # Drop the ack.
+        self.kvs_client.receive_put_acks()
+        self.writer.receive_acks()
+        self.assertEqual(len(self.writer), 1)
+
+        self.writer.flush(now=ACK_TIMEOUT + 1)
+        self.assertEqual(self.kvs_client.async_puts, [['a'], ['a']])
+
+        self.writer.receive_acks()
+        self.assertEqual(len(self.writer), 0)
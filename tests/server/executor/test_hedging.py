@@ -0,0 +1,99 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import unittest
+
+from cloudburst.server.executor.hedging import (
+    HedgeTracker,
+    MAX_HEDGE_DELAY,
+    MIN_HEDGE_DELAY
+)
+from cloudburst.server.utils import HEDGE_LOCATION_PREFIX
+from cloudburst.shared.proto.cloudburst_pb2 import DagSchedule
+
+
+class TestHedgeTracker(unittest.TestCase):
+    '''
+    Tests for the executor's hedge tracker, ensuring that the second replica
+    of a hedged request holds it for a percentile of the function's runtimes,
+    and that cancelled requests are never run.
+    '''
+
+    def setUp(self):
+        self.primary = '127.0.0.1:0'
+        self.backup = '127.0.0.1:1'
+
+        self.hedges = HedgeTracker(self.backup)
+
+    def test_only_backup_holds(self):
+        '''
+        Only the second replica of a hedged request should hold it.
+        '''
+        schedule = self._create_schedule('id')
+        self.assertTrue(self.hedges.hold(('id', 'fn'), schedule, 0))
+        self.assertEqual(self.hedges.get_other(schedule), self.primary)
+
+        primary = HedgeTracker(self.primary)
+        self.assertFalse(primary.hold(('id', 'fn'), schedule, 0))
+        self.assertEqual(primary.get_other(schedule), self.backup)
+
+        unhedged = self._create_schedule('other', hedged=False)
+        self.assertFalse(self.hedges.hold(('other', 'fn'), unhedged, 0))
+        self.assertEqual(self.hedges.get_other(unhedged), None)
+
+    def test_delay_percentile(self):
+        '''
+        The delay should be the 95th percentile of the function's recent
+        runtimes, within bounds.
+        '''
+        self.assertEqual(self.hedges.delay('fn'), MAX_HEDGE_DELAY)
+
+        for i in range(100):
+            self.hedges.record('fn', 0.001 * (i + 1))
+        self.assertAlmostEqual(self.hedges.delay('fn'), 0.096)
+
+        self.hedges.record('fast', 0)
+        self.assertEqual(self.hedges.delay('fast'), MIN_HEDGE_DELAY)
+
+    def test_take_due(self):
+        '''
+        Held requests should be released once their delay passes, unless they
+        were cancelled.
+        '''
+        self.hedges.record('fn', 0.1)
+
+        self.hedges.hold(('a', 'fn'), self._create_schedule('a'), 0)
+        self.hedges.hold(('b', 'fn'), self._create_schedule('b'), 0.05)
+        self.hedges.hold(('c', 'fn'), self._create_schedule('c'), 0.05)
+        self.hedges.cancel(('b', 'fn'))
+
+        self.assertAlmostEqual(self.hedges.deadline(), 0.1)
+        self.assertEqual(self.hedges.take_due(0.09), [])
+        self.assertEqual(self.hedges.take_due(0.1), [('a', 'fn')])
+        self.assertAlmostEqual(self.hedges.deadline(), 0.15)
+        self.assertEqual(self.hedges.take_due(1), [('c', 'fn')])
+
+        self.assertEqual(self.hedges.deadline(), None)
+        self.assertEqual(self.hedges.hedged, 2)
+
+    def _create_schedule(self, rid, hedged=True):
+        schedule = DagSchedule()
+        schedule.id = rid
+        schedule.target_function = 'fn'
+        schedule.locations['fn'] = self.primary
+
+        if hedged:
+            schedule.locations[HEDGE_LOCATION_PREFIX + 'fn'] = self.backup
+
+        return schedule
@@ -0,0 +1,146 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import unittest
+
+from anna.lattices import SetLattice
+
+from cloudburst.server.executor.memo import ResultCache
+from cloudburst.shared.proto.cloudburst_pb2 import Value
+from cloudburst.shared.reference import CloudburstReference
+from cloudburst.shared.serializer import Serializer
+from cloudburst.shared.utils import PURE_FUNCS_KEY
+from tests.mock import kvs_client
+from tests.server.utils import create_function
+
+serializer = Serializer()
+
+
+class TestResultCache(unittest.TestCase):
+    '''
+    Tests for the executor's memo cache, ensuring that only calls to pure
+    functions are memoized, that results are keyed by the function's version
+    and arguments, and that the cache respects its size and the KVS tier's
+    TTL.
+    '''
+
+    def setUp(self):
+        self.kvs_client = kvs_client.MockAnnaClient()
+
+        def square(_, x): return x * x
+        create_function(square, self.kvs_client, 'square')
+        create_function(square, self.kvs_client, 'impure')
+
+        self.memo = ResultCache(self.kvs_client)
+        self.memo.pure.add('square')
+
+    def test_refresh(self):
+        '''
+        The set of pure functions should be read from the KVS.
+        '''
+        self.kvs_client.put(PURE_FUNCS_KEY, SetLattice({b'square', b'f'}))
+
+        memo = ResultCache(self.kvs_client)
+        memo.refresh()
+        self.assertEqual(memo.pure, {'square', 'f'})
+
+    def test_key(self):
+        '''
+        Calls to the same pure function with the same arguments should have
+        the same key, while impure functions and calls with references should
+        have none.
+        '''
+        key = self._key('square', [2])
+        self.assertIsNotNone(key)
+        self.assertEqual(key, self._key('square', [2]))
+        self.assertNotEqual(key, self._key('square', [3]))
+
+        self.assertIsNone(self._key('impure', [2]))
+        self.assertIsNone(self._key('square',
+                                    [CloudburstReference('k', True)]))
+
+        # A function that is registered again with new code has a new version.
+        def cube(_, x): return x * x * x
+        create_function(cube, self.kvs_client, 'square')
+
+        memo = ResultCache(self.kvs_client)
+        memo.pure.add('square')
+        values = [serializer.dump(2, serialize=False)]
+        self.assertNotEqual(key, memo.key('square', values, [2]))
+
+    def test_get_and_put(self):
+        '''
+        A memoized result should be returned as a copy, and the lookups should
+        be counted.
+        '''
+        key = self._key('square', [[1, 2]])
+        self.assertEqual(self.memo.get(key), (False, None))
+
+        self.memo.put(key, [1, 4])
+        hit, result = self.memo.get(key)
+        self.assertTrue(hit)
+        self.assertEqual(result, [1, 4])
+
+        result.append(9)
+        self.assertEqual(self.memo.get(key), (True, [1, 4]))
+
+        self.assertEqual(self.memo.hits, 2)
+        self.assertEqual(self.memo.misses, 1)
+
+    def test_capacity(self):
+        '''
+        The least recently used results should be evicted once the cache is
+        full, and results that do not fit on their own should not be kept.
+        '''
+        size = len(serializer.dump('a' * 10))
+        memo = ResultCache(self.kvs_client, capacity=2 * size)
+
+        memo.put('a', 'a' * 10)
+        memo.put('b', 'b' * 10)
+        memo.get('a')
+        memo.put('c', 'c' * 10)
+
+        self.assertEqual(list(memo.results.keys()), ['a', 'c'])
+        self.assertEqual(memo.size, 2 * size)
+
+        memo.put('d', 'd' * 100)
+        self.assertNotIn('d', memo.results)
+
+    def test_kvs_tier(self):
+        '''
+        Results should be shared with other executors through the KVS until
+        their TTL runs out.
+        '''
+        memo = ResultCache(self.kvs_client, kvs_ttl=10)
+        other = ResultCache(self.kvs_client, kvs_ttl=10)
+
+        memo.put('key', 4, now=0)
+        self.assertEqual(other.get('key', now=5), (True, 4))
+        self.assertEqual(other.kvs_hits, 1)
+
+        # The result is now in the other executor's own cache as well.
+        self.assertEqual(other.get('key', now=20), (True, 4))
+        self.assertEqual(other.hits, 1)
+
+        third = ResultCache(self.kvs_client, kvs_ttl=10)
+        self.assertEqual(third.get('key', now=20), (False, None))
+
+    def _key(self, fname, args):
+        values = []
+        for arg in args:
+            val = Value()
+            serializer.dump(arg, val, False)
+            values.append(val)
+
+        return self.memo.key(fname, values, args)
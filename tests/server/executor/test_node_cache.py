@@ -0,0 +1,206 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import fcntl
+import unittest
+
+import numpy as np
+
+from cloudburst.server.executor import transport
+from cloudburst.server.executor.node_cache import NodeCache
+from cloudburst.server.utils import get_node_cache_key
+from cloudburst.shared.proto.shared_pb2 import StringSet
+from cloudburst.shared.serializer import Serializer
+from tests.mock.kvs_client import MockAnnaClient
+
+serializer = Serializer()
+
+CACHE_NAME = 'cb-test-node-cache'
+
+
+class TestNodeCache(unittest.TestCase):
+    '''
+    Tests for the cache of deserialized values shared by the executors on a
+    node, ensuring that arrays one executor reads are found by the others,
+    that only arrays are cached, that old values are evicted when the cache
+    is full, that the keys it holds are written to the KVS, and that it
+    recovers from executors that die or leave.
+    '''
+
+    def setUp(self):
+        self.ip = '127.0.0.1'
+        self.array = np.arange(10)
+
+        self.caches = []
+        self.cache = self._create_cache()
+
+    def tearDown(self):
+        if len(self.caches) == 0:
+            return
+
+        for cache in self.caches[1:]:
+            cache.close()
+
+        self.caches[0].close(unlink=True)
+
+    def test_shared_between_executors(self):
+        '''
+        An array that one executor cached should be found by another one on
+        the same node.
+        '''
+        other = self._create_cache()
+        self.assertIsNone(other.get('key'))
+        self.assertEqual(other.misses, 1)
+
+        value = self.cache.insert('key', serializer.dump(self.array))
+        self.assertTrue(np.array_equal(value, self.array))
+        self.assertEqual(self.cache.inserts, 1)
+
+        value = other.get('key')
+        self.assertTrue(np.array_equal(value, self.array))
+        self.assertEqual(other.hits, 1)
+
+        # Inserting a key that is already cached does not add it again.
+        other.insert('key', serializer.dump(self.array))
+        self.assertEqual(other.inserts, 0)
+        self.assertEqual(len(other.keys()), 1)
+
+    def test_uncached_values(self):
+        '''
+        Values other than arrays should not be cached.
+        '''
+        self.assertIsNone(self.cache.insert('key', serializer.dump(2)))
+        self.assertIsNone(self.cache.get('key'))
+        self.assertEqual(self.cache.size(), 0)
+
+    def test_eviction(self):
+        '''
+        The oldest values should be evicted when the cache is full, and the
+        others should still be found.
+        '''
+        keys = ['key%d' % idx for idx in range(4)]
+        for key in keys:
+            self.cache.insert(key, serializer.dump(self.array))
+
+        # The cache only has room for three values.
+        self.assertIsNone(self.cache.get(keys[0]))
+        for key in keys[1:]:
+            self.assertTrue(np.array_equal(self.cache.get(key), self.array))
+
+        self.assertEqual(sorted(self.cache.keys()), keys[1:])
+
+    def test_sampled_eviction(self):
+        '''
+        When the index has more values than are sampled for eviction, evicting
+        one should still leave every other value where it is found.
+        '''
+        self.caches.remove(self.cache)
+        self.cache.close(unlink=True)
+        self.cache = self._create_cache(slots=32)
+
+        keys = ['key%d' % idx for idx in range(40)]
+        for key in keys:
+            self.cache.insert(key, serializer.dump(self.array))
+
+        # The cache holds at most 24 values, and the newest is one of them.
+        cached = self.cache.keys()
+        self.assertEqual(len(cached), 24)
+        self.assertTrue(keys[-1] in cached)
+        for key in cached:
+            self.assertTrue(np.array_equal(self.cache.get(key), self.array))
+
+    def test_publish(self):
+        '''
+        The keys in the cache should be written to the KVS when they change.
+        '''
+        kvs = MockAnnaClient()
+        self.cache.insert('key', serializer.dump(self.array))
+        self.cache.publish(kvs)
+
+        key = get_node_cache_key(self.ip)
+        keys = StringSet()
+        keys.ParseFromString(kvs.get(key)[key].reveal())
+        self.assertEqual(list(keys.keys), ['key'])
+
+        # Nothing is written if the keys did not change.
+        del kvs.kvs[key]
+        self.cache.publish(kvs)
+        self.assertIsNone(kvs.get(key)[key])
+
+    def test_dead_writer(self):
+        '''
+        If an executor dies while it changes the index, the others should
+        clear the index instead of waiting for it forever.
+        '''
+        other = self._create_cache()
+        self.cache.insert('key', serializer.dump(self.array))
+
+        # The writer died after it made the sequence number odd.
+        sequence = other._sequence()
+        other._write_sequence(sequence + 1)
+
+        self.assertIsNone(self.cache.get('key'))
+        self.assertEqual(self.cache._sequence() % 2, 0)
+        self.assertEqual(self.cache.keys(), [])
+        self.assertEqual(self.cache.size(), 0)
+
+        # The cache works as before.
+        other.insert('key', serializer.dump(self.array))
+        self.assertTrue(np.array_equal(self.cache.get('key'), self.array))
+
+    def test_capacity_on_attach(self):
+        '''
+        An executor that attaches to the cache with a different capacity
+        should resize it, evicting the values that no longer fit.
+        '''
+        for key in ['key0', 'key1']:
+            self.cache.insert(key, serializer.dump(self.array))
+
+        size = self.cache.size()
+        other = self._create_cache(size // 2)
+
+        self.assertEqual(self.cache.capacity(), size // 2)
+        self.assertEqual(other.keys(), ['key1'])
+
+    def test_last_executor_removes(self):
+        '''
+        The cache should be removed when the last executor that uses it
+        leaves, and an executor that finds a cache no one uses should clear
+        it.
+        '''
+        other = self._create_cache()
+        self.cache.insert('key', serializer.dump(self.array))
+
+        self.caches.remove(other)
+        other.close()
+        self.assertTrue(np.array_equal(self.cache.get('key'), self.array))
+
+        self.caches.remove(self.cache)
+        self.cache.close()
+        self.assertIsNone(transport.attach_segment(CACHE_NAME))
+
+        # A cache left behind by executors that died is cleared by the first
+        # executor that starts.
+        dead = self._create_cache()
+        dead.insert('key', serializer.dump(self.array))
+        fcntl.flock(dead.users_file, fcntl.LOCK_UN)
+
+        self.cache = self._create_cache()
+        self.assertEqual(self.cache.keys(), [])
+        self.assertEqual(self.cache.size(), 0)
+
+    def _create_cache(self, capacity=1024 * 1024, slots=4):
+        cache = NodeCache(self.ip, capacity, slots=slots, name=CACHE_NAME)
+        self.caches.append(cache)
+        return cache
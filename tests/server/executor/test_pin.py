@@ -49,6 +49,33 @@ class TestExecutorPin(unittest.TestCase):
                                                   self.pusher_cache, self.ip, 0,
                                                   self.kvs_client)
 
+    def test_fused_pin(self):
+        '''
+        Tests that the functions fused after a pinned function are pinned
+        along with it.
+        '''
+        def func(_, x): return x + 1
+        for fname in ['first', 'second', 'third']:
+            create_function(func, self.kvs_client, fname)
+
+        msg = PinFunction(name='first', response_address=self.ip, id='pin')
+        msg.fused.extend(['second', 'third'])
+        self.socket.inbox.append(msg.SerializeToString())
+
+        pin(self.socket, self.pusher_cache, self.kvs_client, self.status,
+            self.pinned_functions, self.runtimes, self.exec_counts,
+            self.user_library, False, False)
+
+        response = GenericResponse()
+        response.ParseFromString(self.pusher_cache.socket.outbox[0])
+        self.assertTrue(response.success)
+
+        fnames = ['first', 'second', 'third']
+        self.assertEqual(list(self.status.functions), fnames)
+        self.assertEqual(set(self.pinned_functions.keys()), set(fnames))
+        self.assertEqual(set(self.runtimes.keys()), set(fnames))
+        self.assertEqual(set(self.exec_counts.keys()), set(fnames))
+
     def test_succesful_pin(self):
         '''
         This test executes a pin operation that is supposed to be successful,
@@ -62,7 +89,7 @@ class TestExecutorPin(unittest.TestCase):
         create_function(func, self.kvs_client, fname)
 
         # Create a pin message and put it into the socket.
-        msg = PinFunction(name=fname, response_address=self.ip)
+        msg = PinFunction(name=fname, response_address=self.ip, id='pin')
         self.socket.inbox.append(msg.SerializeToString())
 
         # Execute the pin operation.
@@ -76,6 +103,7 @@ class TestExecutorPin(unittest.TestCase):
         response = GenericResponse()
         response.ParseFromString(self.pusher_cache.socket.outbox[0])
         self.assertTrue(response.success)
+        self.assertEqual(response.response_id, msg.id)
 
         self.assertEqual(func('', 1), self.pinned_functions[fname]('', 1))
         self.assertTrue(fname in self.pinned_functions)
@@ -0,0 +1,156 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import unittest
+
+from cloudburst.server.executor.ready import ReadyQueue
+from cloudburst.shared.proto.cloudburst_pb2 import DagSchedule
+from cloudburst.shared.utils import (
+    DEADLINE_LOCATION,
+    PRIORITY_LOCATION,
+    TENANT_LOCATION,
+    WEIGHT_LOCATION
+)
+
+
+class TestReadyQueue(unittest.TestCase):
+    '''
+    Tests for the executor's ready queue, ensuring that ready requests are
+    run in order of priority class and deadline, that tenants share the
+    executor in proportion to their weights, and that requests are run in
+    arrival order otherwise.
+    '''
+
+    def setUp(self):
+        self.ready = ReadyQueue()
+
+    def test_arrival_order(self):
+        '''
+        Requests without a deadline or priority should be taken in the order
+        in which they became ready.
+        '''
+        for rid in ['a', 'b', 'c']:
+            self._push(rid)
+
+        self.assertEqual(self._drain(), ['a', 'b', 'c'])
+
+    def test_earliest_deadline_first(self):
+        '''
+        Requests with earlier deadlines should be taken first, and requests
+        without a deadline should be taken after all requests with one.
+        '''
+        self._push('none')
+        self._push('late', deadline=20)
+        self._push('early', deadline=10)
+
+        self.assertEqual(self._drain(), ['early', 'late', 'none'])
+
+    def test_priority_before_deadline(self):
+        '''
+        A request in a higher priority class should be taken before any
+        request in a lower one, regardless of their deadlines.
+        '''
+        self._push('urgent', deadline=1)
+        self._push('bulk', priority=-1)
+        self._push('critical', deadline=100, priority=1)
+
+        self.assertEqual(self._drain(), ['critical', 'urgent', 'bulk'])
+
+    def test_fair_share(self):
+        '''
+        A tenant that floods the executor should not hold up another tenant's
+        requests, which should be interleaved with its own.
+        '''
+        for i in range(4):
+            self._push('a%d' % (i), tenant='a')
+        for i in range(2):
+            self._push('b%d' % (i), tenant='b')
+
+        self.assertEqual(self._drain(), ['a0', 'b0', 'a1', 'b1', 'a2', 'a3'])
+
+    def test_weighted_share(self):
+        '''
+        A tenant with twice the weight should get twice the share.
+        '''
+        for i in range(4):
+            self._push('a%d' % (i), tenant='a', weight=2)
+        for i in range(2):
+            self._push('b%d' % (i), tenant='b')
+
+        self.assertEqual(self._drain(), ['a0', 'a1', 'b0', 'a2', 'a3', 'b1'])
+
+    def test_idle_tenant_not_owed(self):
+        '''
+        A tenant that starts sending requests after another tenant has been
+        running should not be owed the time it was idle, and so should not get
+        to run all of its requests first.
+        '''
+        for i in range(4):
+            self._push('a%d' % (i), tenant='a')
+
+        self.ready.pop()
+        self.ready.pop()
+
+        for i in range(2):
+            self._push('b%d' % (i), tenant='b')
+
+        self.assertEqual(self._drain(), ['a2', 'b0', 'a3', 'b1'])
+
+    def test_batch_urgency(self):
+        '''
+        A batch should be as urgent as its most urgent request.
+        '''
+        self._push('single', deadline=10)
+
+        batch = [self._create_schedule('b1'),
+                 self._create_schedule('b2', deadline=5)]
+        self.ready.push('fn', [(s.id, 'fn') for s in batch], batch)
+
+        fname, keys = self.ready.pop()
+        self.assertEqual(keys, [('b1', 'fn'), ('b2', 'fn')])
+        self.assertEqual(self._drain(), ['single'])
+
+    def _push(self, rid, deadline=None, priority=None, tenant=None,
+              weight=None):
+        schedule = self._create_schedule(rid, deadline, priority, tenant,
+                                         weight)
+        self.ready.push('fn', [(rid, 'fn')], [schedule])
+
+    def _drain(self):
+        result = []
+        while len(self.ready) > 0:
+            _, keys = self.ready.pop()
+            result.extend([rid for rid, _ in keys])
+
+        return result
+
+    def _create_schedule(self, rid, deadline=None, priority=None, tenant=None,
+                         weight=None):
+        schedule = DagSchedule()
+        schedule.id = rid
+        schedule.target_function = 'fn'
+
+        if deadline is not None:
+            schedule.locations[DEADLINE_LOCATION] = repr(float(deadline))
+
+        if priority is not None:
+            schedule.locations[PRIORITY_LOCATION] = str(priority)
+
+        if tenant is not None:
+            schedule.locations[TENANT_LOCATION] = tenant
+
+        if weight is not None:
+            schedule.locations[WEIGHT_LOCATION] = repr(float(weight))
+
+        return schedule
@@ -0,0 +1,123 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import unittest
+
+from cloudburst.server.executor import utils
+from cloudburst.server.executor.status import BACKLOG_STEP, StatusReporter
+from cloudburst.shared.proto.internal_pb2 import ThreadStatus
+from tests.mock import zmq_utils
+
+
+class TestStatusReporter(unittest.TestCase):
+    '''
+    Tests for the executor's status reporter, ensuring that status changes
+    are sent as rate-limited deltas and that unchanged statuses are not sent.
+    '''
+
+    def setUp(self):
+        self.pusher_cache = zmq_utils.MockPusherCache()
+        self.socket = self.pusher_cache.socket
+
+        self.status = ThreadStatus()
+        self.status.ip = '127.0.0.1'
+        self.status.tid = 0
+        self.status.running = True
+
+        self.reporter = StatusReporter(['127.0.0.1'], self.pusher_cache,
+                                       self.status, interval=1.0)
+        self.reporter.push_full(now=0)
+        self.socket.outbox.clear()
+
+    def test_unchanged_status_not_sent(self):
+        '''
+        An update that does not change the status should not be sent.
+        '''
+        self.reporter.update(now=2)
+        self.assertEqual(len(self.socket.outbox), 0)
+        self.assertEqual(self.reporter.deadline(), None)
+
+    def test_delta_is_rate_limited(self):
+        '''
+        A change within the interval should be held back until the interval
+        passes, and then sent as a delta with only the changed functions.
+        '''
+        self.status.functions.append('square')
+        self.reporter.update(now=0.5)
+        self.assertEqual(len(self.socket.outbox), 0)
+        self.assertEqual(self.reporter.deadline(), 1.0)
+
+        self.reporter.flush(now=1.0)
+        self.assertEqual(len(self.socket.outbox), 1)
+
+        delta = ThreadStatus()
+        delta.ParseFromString(self.socket.outbox[0])
+        self.assertTrue(delta.delta)
+        self.assertEqual(list(delta.added_functions), ['square'])
+        self.assertEqual(len(delta.removed_functions), 0)
+        self.assertEqual(len(delta.functions), 0)
+
+    def test_urgent_update_sent_immediately(self):
+        '''
+        An urgent change, like the executor departing, should be sent right
+        away regardless of the rate limit.
+        '''
+        self.status.running = False
+        self.reporter.update(urgent=True, now=0.1)
+        self.assertEqual(len(self.socket.outbox), 1)
+
+        delta = ThreadStatus()
+        delta.ParseFromString(self.socket.outbox[0])
+        self.assertFalse(delta.running)
+
+    def test_backlog_changes_batched(self):
+        '''
+        Small changes in the backlog should not be sent, while changes that add
+        up to the step, or the backlog draining, should be.
+        '''
+        self.status.backlog = 1
+        self.reporter.update(now=2)
+        self.assertEqual(len(self.socket.outbox), 0)
+
+        self.status.backlog = BACKLOG_STEP
+        self.reporter.update(now=4)
+        self.assertEqual(len(self.socket.outbox), 1)
+
+        delta = ThreadStatus()
+        delta.ParseFromString(self.socket.outbox[0])
+        self.assertTrue(delta.delta)
+        self.assertEqual(delta.backlog, BACKLOG_STEP)
+
+        self.status.backlog = 0
+        self.reporter.update(now=6)
+        self.assertEqual(len(self.socket.outbox), 2)
+
+        delta.ParseFromString(self.socket.outbox[1])
+        self.assertEqual(delta.backlog, 0)
+
+    def test_handoffs_go_to_one_scheduler(self):
+        '''
+        Every request an executor hands off, and every trigger it forwards
+        afterwards, should go to the same scheduler, since that scheduler is
+        the one that knows where the request was re-routed.
+        '''
+        self.pusher_cache.addresses.clear()
+
+        schedulers = ['10.0.0.1', '10.0.0.2', '10.0.0.3']
+        for _ in range(5):
+            utils.handoff_request(schedulers, self.pusher_cache, self.status,
+                                  None, [])
+            schedulers.reverse()
+
+        self.assertEqual(len(set(self.pusher_cache.addresses)), 1)
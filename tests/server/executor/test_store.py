@@ -0,0 +1,269 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import unittest
+
+from cloudburst.server.executor.store import ObjectReference, ObjectStore
+from cloudburst.shared.proto.internal_pb2 import ObjectRequest, ObjectResponse
+from tests.mock import kvs_client, zmq_utils
+
+
+class TestObjectStore(unittest.TestCase):
+    '''
+    Tests for the executor's object store, ensuring that objects are read
+    from shared memory on the same node and fetched from their owner
+    otherwise, that they are freed once every consumer has read them or
+    dropped the request that would have, and that they are written to the KVS
+    if they are evicted or expire first, and removed from it later.
+    '''
+
+    def setUp(self):
+        self.kvs_client = kvs_client.MockAnnaClient()
+        self.body = b'x' * 100
+
+        self.stores = []
+        self.producer = self._create_store('127.0.0.1', 1)
+
+    def tearDown(self):
+        # Remove any shared memory segments that are left over.
+        for store in self.stores:
+            store.spill_all()
+
+    def test_own_object(self):
+        '''
+        An executor should read its own objects from its store, and free them
+        once every consumer has read them.
+        '''
+        ref = self.producer.put(self.body, 2)
+        self.assertEqual(ref.location, '127.0.0.1:1')
+
+        self.assertEqual(self.producer.fetch(ref), self.body)
+        self.assertEqual(len(self.producer.objects), 1)
+
+        self.assertEqual(self.producer.fetch(ref), self.body)
+        self.assertEqual(len(self.producer.objects), 0)
+        self.assertEqual(self.producer.size, 0)
+
+    def test_same_node(self):
+        '''
+        An executor on the same node should read the object from shared
+        memory, and then let its owner know.
+        '''
+        consumer = self._create_store('127.0.0.1', 0)
+        ref = self.producer.put(self.body, 1)
+
+        self.assertEqual(consumer.fetch(ref), self.body)
+        self.assertEqual(consumer.local_fetches, 1)
+        self.assertEqual(consumer.pusher_cache.addresses,
+                         ['tcp://127.0.0.1:4061'])
+
+        # The owner frees the object once it hears from the consumer.
+        release = consumer.pusher_cache.socket.outbox[0]
+        self.producer.request_socket.inbox.append(release)
+        self.producer.serve()
+        self.assertEqual(len(self.producer.objects), 0)
+        self.assertEqual(len(self.producer.pusher_cache.socket.outbox), 0)
+
+    def test_other_node(self):
+        '''
+        An executor on another node should fetch the object from its owner
+        without waiting for it, and each of its requests that reads the object
+        should find it once it arrives.
+        '''
+        consumer = self._create_store('10.0.0.1', 0)
+        ref = self.producer.put(self.body, 2)
+
+        # Two of the consumer's requests read the object.
+        self.assertTrue(consumer.request(ref, now=0))
+        self.assertTrue(consumer.request(ref, now=0))
+        self.assertEqual(consumer.deadline(), 0.1)
+
+        request = ObjectRequest()
+        request.ParseFromString(consumer.pusher_cache.socket.outbox[0])
+        self.assertEqual(request.key, ref.key)
+        self.assertEqual(request.response_address, consumer.response_address)
+
+        # The consumer asks for the object once, and sending it does not free
+        # it.
+        self.assertEqual(len(consumer.pusher_cache.socket.outbox), 1)
+        self.producer.request_socket.inbox.append(
+            consumer.pusher_cache.socket.outbox.pop())
+        self.producer.serve()
+        self.assertEqual(len(self.producer.objects), 1)
+
+        self.assertEqual(consumer.receive(now=0), [])
+        response = self.producer.pusher_cache.socket.outbox[0]
+        consumer.response_socket.inbox.append(response)
+        self.assertEqual(consumer.receive(now=0), [ref.key])
+        self.assertIsNone(consumer.deadline())
+
+        # The owner frees the object once it hears back for both requests.
+        self.assertEqual(len(consumer.pusher_cache.socket.outbox), 2)
+        self.producer.request_socket.inbox.extend(
+            consumer.pusher_cache.socket.outbox)
+        self.producer.serve()
+        self.assertEqual(len(self.producer.objects), 0)
+
+        self.assertEqual(consumer.fetch(ref), self.body)
+        self.assertEqual(consumer.fetch(ref), self.body)
+        self.assertEqual(consumer.remote_fetches, 1)
+        self.assertEqual(len(consumer.fetched), 0)
+
+    def test_spill(self):
+        '''
+        Objects should be written to the KVS when they expire or are evicted,
+        and consumers should find them there.
+        '''
+        first = self.producer.put(self.body, 1, now=0)
+        second = self.producer.put(self.body, 1, now=1)
+        self.assertEqual(self.producer.spilled, 0)
+
+        # The store only has room for two objects.
+        third = self.producer.put(self.body, 1, now=2)
+        self.assertEqual(self.producer.spilled, 1)
+        self.assertFalse(first.key in self.producer.objects)
+
+        self.producer.expire(now=self.producer.ttl + 1.5)
+        self.assertEqual(self.producer.spilled, 2)
+        self.assertFalse(second.key in self.producer.objects)
+        self.assertTrue(third.key in self.producer.objects)
+
+        # A consumer on the same node finds the object in the KVS, and one on
+        # another node does once the owner answers that it no longer has it.
+        same_node = self._create_store('127.0.0.1', 0)
+        self.assertEqual(same_node.fetch(first), self.body)
+        self.assertEqual(same_node.local_fetches, 0)
+
+        # Once its consumer has read it, the owner removes it from the KVS.
+        self.assertEqual(len(self.producer.spilled_objects), 2)
+        self.producer.request_socket.inbox.append(
+            same_node.pusher_cache.socket.outbox.pop())
+        self.producer.serve()
+        self.assertFalse(first.key in self.producer.spilled_objects)
+        self.assertEqual(self.kvs_client.get(first.key)[first.key].reveal(),
+                         b'')
+        self.assertIsNone(same_node.fetch(first))
+
+        other_node = self._create_store('10.0.0.1', 0)
+        self.assertTrue(other_node.request(second, now=0))
+
+        response = ObjectResponse(key=second.key, found=False)
+        other_node.response_socket.inbox.append(response.SerializeToString())
+        self.assertEqual(other_node.receive(now=0), [])
+
+        self.assertEqual(other_node.retry(now=0), [])
+        self.assertEqual(self.kvs_client.async_requests, [[second.key]])
+
+        kv_pairs = self.kvs_client.receive_async()
+        self.assertEqual(other_node.receive_kvs(kv_pairs, now=0),
+                         [second.key])
+        self.assertEqual(other_node.fetch(second), self.body)
+        self.assertEqual(other_node.remote_fetches, 0)
+
+    def test_spill_ttl(self):
+        '''
+        Objects in the KVS that not every consumer has read should be removed
+        once their own TTL has passed.
+        '''
+        ref = self.producer.put(self.body, 2, now=0)
+        self.producer.expire(now=self.producer.ttl)
+        self.assertTrue(ref.key in self.producer.spilled_objects)
+
+        self.producer.expire(now=self.producer.ttl +
+                             self.producer.spill_ttl - 1)
+        self.assertTrue(ref.key in self.producer.spilled_objects)
+
+        self.producer.expire(now=self.producer.ttl + self.producer.spill_ttl)
+        self.assertFalse(ref.key in self.producer.spilled_objects)
+        self.assertEqual(self.kvs_client.get(ref.key)[ref.key].reveal(), b'')
+
+    def test_abandon(self):
+        '''
+        The owner of an object should free it once its consumers have either
+        read it or dropped the requests that would have, whether or not they
+        had started fetching it.
+        '''
+        consumer = self._create_store('10.0.0.1', 0)
+        ref = self.producer.put(self.body, 3)
+
+        # One request is dropped before it fetched the object, one while the
+        # object is on its way, and one reads it.
+        consumer.abandon(ref, False)
+        self.assertTrue(consumer.request(ref, now=0))
+        self.assertTrue(consumer.request(ref, now=0))
+        consumer.abandon(ref, True)
+
+        request = ObjectRequest()
+        for message in consumer.pusher_cache.socket.outbox:
+            request.ParseFromString(message)
+            if request.response_address:
+                self.producer.request_socket.inbox.append(message)
+        self.producer.serve()
+
+        consumer.response_socket.inbox.append(
+            self.producer.pusher_cache.socket.outbox[0])
+        self.assertEqual(consumer.receive(now=0), [ref.key])
+        self.assertEqual(consumer.fetch(ref), self.body)
+
+        releases = []
+        for message in consumer.pusher_cache.socket.outbox:
+            request.ParseFromString(message)
+            if not request.response_address:
+                releases.append(message)
+        self.assertEqual(len(releases), 3)
+
+        self.producer.request_socket.inbox.extend(releases)
+        self.producer.serve()
+        self.assertEqual(len(self.producer.objects), 0)
+
+    def test_timeout(self):
+        '''
+        A consumer should give up on an object that is neither held by its
+        owner nor in the KVS once the timeout has passed.
+        '''
+        ref = ObjectReference('objects/missing', '10.0.0.2:0')
+
+        same_node = self._create_store('10.0.0.2', 1)
+        self.assertIsNone(same_node.fetch(ref))
+
+        other_node = self._create_store('10.0.0.1', 0)
+        self.assertTrue(other_node.request(ref, now=0))
+        self.assertEqual(other_node.retry(now=1), [])
+        self.assertEqual(other_node.retry(now=other_node.timeout),
+                         [ref.key])
+        self.assertIsNone(other_node.fetch(ref))
+
+    def test_depart(self):
+        '''
+        A departing executor should write its objects to the KVS, and stop
+        storing new ones.
+        '''
+        ref = self.producer.put(self.body, 1)
+        self.producer.depart()
+
+        self.assertEqual(self.producer.spilled, 1)
+        self.assertIsNotNone(self.kvs_client.get(ref.key)[ref.key])
+        self.assertIsNone(self.producer.put(self.body, 1))
+
+    def _create_store(self, ip, tid):
+        store = ObjectStore(ip, tid, zmq_utils.MockZmqContext(),
+                            zmq_utils.MockPusherCache(), self.kvs_client,
+                            threshold=10, capacity=250, ttl=1)
+
+        # The mock context hands out the same socket every time.
+        store.request_socket = zmq_utils.MockZmqSocket()
+        store.response_socket = zmq_utils.MockZmqSocket()
+
+        self.stores.append(store)
+        return store
@@ -0,0 +1,217 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import unittest
+
+from cloudburst.server.executor.tracker import RequestTracker
+from cloudburst.shared.proto.cloudburst_pb2 import (
+    DagSchedule,
+    DagTrigger,
+    MULTIEXEC # Cloudburst's execution types
+)
+
+
+class TestRequestTracker(unittest.TestCase):
+    '''
+    Tests for the executor's request tracker, ensuring that a request is
+    reported ready exactly once, regardless of the order in which its schedule
+    and triggers arrive, and that its state is dropped once it finishes.
+    '''
+
+    def setUp(self):
+        self.tracker = RequestTracker()
+
+    def test_schedule_after_triggers(self):
+        '''
+        A request whose triggers all arrive before its schedule should become
+        ready when the schedule arrives.
+        '''
+        schedule = self._create_schedule(['f1', 'f2'])
+
+        self.assertFalse(self.tracker.add_trigger(self._create_trigger('f1'),
+                                                  0))
+        self.assertFalse(self.tracker.add_trigger(self._create_trigger('f2'),
+                                                  0))
+        self.assertTrue(self.tracker.add_schedule(schedule, 0))
+
+        key = (schedule.id, schedule.target_function)
+        self.assertEqual(len(self.tracker.triggers(key)), 2)
+        self.assertEqual(self.tracker.pending(schedule.target_function), 1)
+
+    def test_duplicate_trigger(self):
+        '''
+        A duplicate trigger should neither make a request ready early nor
+        report it ready a second time.
+        '''
+        schedule = self._create_schedule(['f1', 'f2'])
+        self.tracker.add_schedule(schedule, 0)
+
+        self.assertFalse(self.tracker.add_trigger(self._create_trigger('f1'),
+                                                  0))
+        self.assertFalse(self.tracker.add_trigger(self._create_trigger('f1'),
+                                                  0))
+        self.assertTrue(self.tracker.add_trigger(self._create_trigger('f2'),
+                                                 0))
+        self.assertFalse(self.tracker.add_trigger(self._create_trigger('f2'),
+                                                  0))
+
+    def test_multiexec(self):
+        '''
+        A MULTIEXEC function should become ready on every trigger and only see
+        the most recent one.
+        '''
+        schedule = self._create_schedule(['f1', 'f2'], MULTIEXEC)
+        key = (schedule.id, schedule.target_function)
+        self.tracker.add_schedule(schedule, 0)
+
+        self.assertTrue(self.tracker.add_trigger(self._create_trigger('f1'),
+                                                 0))
+        self.tracker.clear_triggers(key)
+
+        trigger = self._create_trigger('f2')
+        self.assertTrue(self.tracker.add_trigger(trigger, 0))
+        self.assertEqual(self.tracker.triggers(key), [trigger])
+
+    def test_multiexec_queued_triggers(self):
+        '''
+        Triggers that arrive while a MULTIEXEC request is waiting to run should
+        each get a run, in the order in which they arrived.
+        '''
+        schedule = self._create_schedule(['f1', 'f2'], MULTIEXEC)
+        key = (schedule.id, schedule.target_function)
+        self.tracker.add_schedule(schedule, 0)
+
+        first = self._create_trigger('f1')
+        second = self._create_trigger('f2')
+        self.assertTrue(self.tracker.add_trigger(first, 0))
+        self.assertFalse(self.tracker.add_trigger(second, 0))
+        self.assertEqual(self.tracker.triggers(key), [first])
+
+        self.assertTrue(self.tracker.clear_triggers(key))
+        self.assertEqual(self.tracker.triggers(key), [second])
+
+        self.assertFalse(self.tracker.clear_triggers(key))
+        self.assertFalse(self.tracker.is_ready(key))
+
+    def test_finish(self):
+        '''
+        Finishing a request should drop its state and ignore any messages for
+        it until it is pruned.
+        '''
+        schedule = self._create_schedule(['f1'])
+        key = (schedule.id, schedule.target_function)
+        self.tracker.add_schedule(schedule, 0)
+        self.tracker.add_trigger(self._create_trigger('f1'), 0)
+
+        self.tracker.finish(key, 1)
+        self.assertFalse(key in self.tracker)
+        self.assertEqual(self.tracker.pending(schedule.target_function), 0)
+
+        self.assertFalse(self.tracker.add_trigger(self._create_trigger('f1'),
+                                                  2))
+        self.assertFalse(key in self.tracker)
+
+        self.tracker.prune_finished(2)
+        self.assertFalse(self.tracker.is_finished(key))
+
+    def test_cancel(self):
+        '''
+        Cancelling a request should drop it, and cancelling one we have not
+        heard of yet should make us ignore its messages.
+        '''
+        schedule = self._create_schedule(['f1'])
+        key = (schedule.id, schedule.target_function)
+        self.tracker.add_schedule(schedule, 0)
+
+        self.tracker.cancel(key, 1)
+        self.assertFalse(key in self.tracker)
+        self.assertTrue(self.tracker.is_finished(key))
+
+        other = self._create_schedule(['f1'])
+        other.id = 'other'
+        self.tracker.cancel((other.id, other.target_function), 1)
+        self.assertFalse(self.tracker.add_schedule(other, 2))
+        self.assertEqual(len(self.tracker), 0)
+
+    def test_expire(self):
+        '''
+        Requests that are still waiting for their schedule or triggers after
+        the TTL should be released, while ready requests and recent requests
+        should be left alone.
+        '''
+        schedule = self._create_schedule(['f1', 'f2'])
+        self.tracker.add_schedule(schedule, 0)
+
+        ready = self._create_schedule(['f1'])
+        ready.id = 'ready'
+        self.tracker.add_schedule(ready, 0)
+        trigger = self._create_trigger('f1')
+        trigger.id = 'ready'
+        self.tracker.add_trigger(trigger, 0)
+
+        recent = self._create_trigger('f1')
+        recent.id = 'recent'
+        self.tracker.add_trigger(recent, 5)
+
+        expired = self.tracker.expire(1, 10)
+        self.assertEqual([request.schedule for request in expired],
+                         [schedule])
+
+        key = (schedule.id, schedule.target_function)
+        self.assertFalse(key in self.tracker)
+        self.assertTrue(self.tracker.is_finished(key))
+        self.assertEqual(len(self.tracker), 2)
+
+    def test_wait_for_objects(self):
+        '''
+        A request held for the objects it reads should be released once all
+        of them have arrived, and not at all if it was cancelled meanwhile.
+        '''
+        schedule = self._create_schedule(['f1'])
+        self.tracker.add_schedule(schedule, 0)
+        self.tracker.add_trigger(self._create_trigger('f1'), 0)
+
+        key = (schedule.id, schedule.target_function)
+        self.tracker.wait_for_objects(key, ['a', 'b'])
+        self.assertEqual(self.tracker.objects_arrived(['a']), [])
+        self.assertEqual(self.tracker.objects_arrived(['b']), [key])
+
+        self.tracker.wait_for_objects(key, ['c'])
+        self.tracker.cancel(key, 0)
+        self.assertEqual(self.tracker.objects_arrived(['c']), [])
+        self.assertEqual(self.tracker.waiting, {})
+
+    def _create_schedule(self, sources, ftype=None):
+        schedule = DagSchedule()
+        schedule.id = 'id'
+        schedule.target_function = 'sink'
+        schedule.dag.name = 'dag'
+
+        ref = schedule.dag.functions.add()
+        ref.name = 'sink'
+        if ftype is not None:
+            ref.type = ftype
+
+        for source in sources:
+            schedule.triggers.append(source)
+
+        return schedule
+
+    def _create_trigger(self, source):
+        trigger = DagTrigger()
+        trigger.id = 'id'
+        trigger.target_function = 'sink'
+        trigger.source = source
+
+        return trigger
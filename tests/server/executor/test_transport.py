@@ -0,0 +1,69 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import unittest
+
+from cloudburst.server import utils as sutils
+from cloudburst.server.executor import transport
+from tests.mock.zmq_utils import MockPusherCache
+
+
+class TestTransportCache(unittest.TestCase):
+    '''
+    Tests for the same-node transport between executors, ensuring that only
+    the sockets of executors on our own node are reached over IPC, and that
+    messages passed through shared memory arrive intact.
+    '''
+
+    def setUp(self):
+        self.ip = '127.0.0.1'
+        self.pusher_cache = MockPusherCache()
+        self.transport_cache = transport.TransportCache(self.pusher_cache,
+                                                        self.ip)
+
+    def test_select_own_node(self):
+        '''
+        The executor sockets on our own node should be reached over IPC.
+        '''
+        port = sutils.DAG_EXEC_PORT + 3
+        address = 'tcp://' + self.ip + ':' + str(port)
+
+        self.transport_cache.get(address)
+        self.assertEqual(self.pusher_cache.addresses,
+                         [transport.IPC_ADDR_TEMPLATE % port])
+
+    def test_select_other(self):
+        '''
+        Executors on other nodes, and the sockets that are not executor
+        sockets, should be reached as they are.
+        '''
+        other = 'tcp://10.0.0.1:' + str(sutils.DAG_EXEC_PORT + 3)
+        self.assertEqual(self.transport_cache.select(other), other)
+
+        scheduler = 'tcp://' + self.ip + ':' + str(sutils.STATUS_PORT)
+        self.assertEqual(self.transport_cache.select(scheduler), scheduler)
+
+        ipc = 'ipc:///requests/get'
+        self.assertEqual(self.transport_cache.select(ipc), ipc)
+
+    def test_share(self):
+        '''
+        A message passed through shared memory should be read back intact,
+        and its segment removed once it is read.
+        '''
+        body = b'x' * (transport.SHARED_THRESHOLD + 1)
+
+        buf = transport.share(body)
+        self.assertEqual(transport.receive(buf), body)
+        self.assertIsNone(transport.read_segment(buf.name))
@@ -14,6 +14,7 @@
 
 import unittest
 
+from cloudburst.server.executor import transport
 from cloudburst.server.executor.user_library import CloudburstUserLibrary
 from cloudburst.shared.serializer import Serializer
 from tests.mock.kvs_client import MockAnnaClient
@@ -86,3 +87,40 @@ class TestUserLibrary(unittest.TestCase):
         self.assertEqual(msgs[1][0], sender)
         self.assertEqual(msgs[0][1], message2)
         self.assertEqual(msgs[1][1], message1)
+
+    def test_send_shared(self):
+        '''
+        Tests that large messages to executors on the same node are passed
+        through shared memory, and that receive reads them back.
+        '''
+        msg = b'x' * (transport.SHARED_THRESHOLD + 1)
+        self.user_library.send((self.ip, 1), msg)
+
+        sender, buf = self.pusher_cache.socket.outbox[0]
+        self.assertTrue(isinstance(buf, transport.SharedBuffer))
+
+        self.context.sckt.inbox.append((sender, buf))
+        msgs = self.user_library.recv()
+        self.assertEqual(msgs, [(sender, msg)])
+
+        # Messages to other nodes are sent as they are.
+        self.user_library.send(('10.0.0.1', 0), msg)
+        self.assertEqual(self.pusher_cache.socket.outbox[1][1], msg)
+
+    def test_shared_expires(self):
+        '''
+        Tests that the sender removes a message passed through shared memory
+        that was not received in time.
+        '''
+        msg = b'x' * (transport.SHARED_THRESHOLD + 1)
+        self.user_library.shared_ttl = 0
+        self.user_library.send((self.ip, 1), msg)
+
+        sender, buf = self.pusher_cache.socket.outbox[0]
+        self.user_library.close()
+        self.assertEqual(len(self.user_library.shared), 0)
+        self.assertIsNone(transport.receive(buf))
+
+        # The receiver skips the message.
+        self.context.sckt.inbox.append((sender, buf))
+        self.assertEqual(self.user_library.recv(), [])
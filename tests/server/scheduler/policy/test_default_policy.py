@@ -21,15 +21,20 @@ from anna.lattices import LWWPairLattice
 from cloudburst.server.scheduler.policy.default_policy import (
     DefaultCloudburstSchedulerPolicy
 )
-from cloudburst.server.scheduler.utils import get_cache_ip_key
-import cloudburst.server.utils as sutils
-from cloudburst.shared.proto.cloudburst_pb2 import Dag
+from cloudburst.server.scheduler.utils import (
+    get_cache_ip_key,
+    get_unpin_address
+)
+from cloudburst.server.utils import get_node_cache_key
+from cloudburst.shared.proto.cloudburst_pb2 import Dag, GenericResponse
 from cloudburst.shared.proto.internal_pb2 import (
+    PinFunction,
     ThreadStatus,
     SchedulerStatus,
     CPU
 )
 from cloudburst.shared.proto.shared_pb2 import StringSet
+from cloudburst.shared.reference import CloudburstReference
 from cloudburst.shared.serializer import Serializer
 from tests.mock import kvs_client, zmq_utils
 
@@ -48,16 +53,13 @@ class TestDefaultSchedulerPolicy(unittest.TestCase):
     def setUp(self):
         self.pusher_cache = zmq_utils.MockPusherCache()
         self.socket = zmq_utils.MockZmqSocket()
-        self.pin_socket = zmq_utils.MockZmqSocket()
 
         self.kvs_client = kvs_client.MockAnnaClient()
         self.ip = '127.0.0.1'
 
-        self.policy = DefaultCloudburstSchedulerPolicy(self.pin_socket,
-                                                       self.pusher_cache,
-                                                       self.kvs_client, self.ip,
-                                                       policy='random',
-                                                       random_threshold=0)
+        self.policy = DefaultCloudburstSchedulerPolicy(
+            self.pusher_cache, self.kvs_client, self.ip, policy='random',
+            random_threshold=0)
 
     def tearDown(self):
         # Clear all policy metadata.
@@ -92,6 +94,24 @@ class TestDefaultSchedulerPolicy(unittest.TestCase):
         self.assertEqual(result, (self.ip, 3))
 
 
+    def test_pick_hedge_executor(self):
+        '''
+        A hedged request should go to the least backlogged of the function's
+        other replicas that is not backed off, if there is one.
+        '''
+        primary = (self.ip, 1)
+        self.policy.function_locations['fn'] = [primary, (self.ip, 2),
+                                                (self.ip, 3), (self.ip, 4)]
+        self.policy.backoff[(self.ip, 2)] = time.time()
+        self.policy.backlogs[(self.ip, 3)] = 10
+
+        self.assertEqual(self.policy.pick_hedge_executor('fn', primary),
+                         (self.ip, 4))
+
+        self.policy.function_locations['single'] = [primary]
+        self.assertEqual(self.policy.pick_hedge_executor('single', primary),
+                         None)
+
     def test_pin_reject(self):
         '''
         This test explicitly rejects a pin request from the policy and ensures
@@ -101,18 +121,60 @@ class TestDefaultSchedulerPolicy(unittest.TestCase):
         address_set = {(self.ip, 1), (self.ip, 2)}
         self.policy.unpinned_cpu_executors.update(address_set)
 
-        # Create one failing and one successful response.
-        self.pin_socket.inbox.append(sutils.ok_resp)
-        self.pin_socket.inbox.append(sutils.error.SerializeToString())
+        fref = Dag.FunctionReference(name='function')
+        self.assertTrue(self.policy.pin_function('dag', fref, []))
+        self.assertEqual(len(self.policy.unpinned_cpu_executors), 1)
+
+        # Reject the first pin request.
+        pin_msg = PinFunction()
+        pin_msg.ParseFromString(self.pusher_cache.socket.outbox[0])
+        response = GenericResponse(success=False, response_id=pin_msg.id)
+
+        result = self.policy.process_pin_response(response)
+        self.assertEqual(result, ('dag', fref, [], False))
+        self.assertEqual(len(self.policy.pending_dags['dag']), 0)
+
+        # Retry, and accept the second pin request.
+        self.assertTrue(self.policy.pin_function('dag', fref, []))
+        pin_msg.ParseFromString(self.pusher_cache.socket.outbox[1])
+        response = GenericResponse(success=True, response_id=pin_msg.id)
 
-        success = self.policy.pin_function(
-            'dag', Dag.FunctionReference(name='function'), [])
-        self.assertTrue(success)
+        result = self.policy.process_pin_response(response)
+        self.assertEqual(result, ('dag', fref, [], True))
 
         # Ensure that both remaining executors have been removed from unpinned
         # and that the DAG commit is pending.
         self.assertEqual(len(self.policy.unpinned_cpu_executors), 0)
         self.assertEqual(len(self.policy.pending_dags), 1)
+        self.assertEqual(len(self.policy.pending_pins), 0)
+        self.assertFalse(self.policy.pin_function('dag', fref, []))
+
+    def test_pin_timeout(self):
+        '''
+        This test ensures that pin requests that are not answered in time are
+        given up on, and that the function is unpinned if the executor accepts
+        the request after that.
+        '''
+        self.policy.unpinned_cpu_executors.add((self.ip, 1))
+
+        fref = Dag.FunctionReference(name='function')
+        self.assertTrue(self.policy.pin_function('dag', fref, []))
+
+        self.assertEqual(self.policy.expire_pins(time.time() - 10), [])
+        expired = self.policy.expire_pins(time.time() + 1)
+        self.assertEqual(expired, [('dag', fref, [])])
+        self.assertEqual(len(self.policy.pending_pins), 0)
+
+        # The executor accepts the request late, so we unpin the function.
+        pin_msg = PinFunction()
+        pin_msg.ParseFromString(self.pusher_cache.socket.outbox[0])
+        response = GenericResponse(success=True, response_id=pin_msg.id)
+
+        self.assertEqual(self.policy.process_pin_response(response), None)
+        self.assertEqual(self.pusher_cache.socket.outbox[1], 'function')
+        self.assertEqual(self.pusher_cache.addresses[1],
+                         get_unpin_address(self.ip, 1))
+        self.assertEqual(len(self.policy.abandoned_pins), 0)
 
     def test_process_status(self):
         '''
@@ -177,6 +239,38 @@ class TestDefaultSchedulerPolicy(unittest.TestCase):
         self.assertEqual(len(self.policy.function_locations[function_name]), 0)
         self.assertTrue(key in self.policy.unpinned_cpu_executors)
 
+    def test_process_status_delta(self):
+        '''
+        This test ensures that a delta status update is applied on top of the
+        executor's previous status: functions it adds are located on the
+        executor, functions it removes are not, and the rest is left alone.
+        '''
+        key = (self.ip, 1)
+
+        status = ThreadStatus()
+        status.running = True
+        status.ip = self.ip
+        status.tid = 1
+        status.functions.extend(['square', 'incr'])
+        status.utilization = 0.5
+        self.policy.process_status(status)
+
+        delta = ThreadStatus()
+        delta.running = True
+        delta.ip = self.ip
+        delta.tid = 1
+        delta.delta = True
+        delta.added_functions.append('decr')
+        delta.removed_functions.append('incr')
+        self.policy.process_status(delta)
+
+        self.assertEqual(set(self.policy.thread_statuses[key].functions),
+                         {'square', 'decr'})
+        self.assertEqual(self.policy.thread_statuses[key].utilization, 0.5)
+        self.assertEqual(self.policy.function_locations['square'], [key])
+        self.assertEqual(self.policy.function_locations['decr'], [key])
+        self.assertEqual(len(self.policy.function_locations['incr']), 0)
+
     def test_process_status_not_running(self):
         '''
         This test passes in a status for a server that is leaving the system
@@ -283,6 +377,46 @@ class TestDefaultSchedulerPolicy(unittest.TestCase):
         self.assertTrue(new_ip in self.policy.key_locations['key4'])
         self.assertTrue(new_ip in self.policy.key_locations['key5'])
 
+    def test_node_cache_locality(self):
+        '''
+        This test ensures that the keys in each node's shared cache count as
+        cached on that node, and that among nodes with as many of a request's
+        references cached, the one with the most room left in its shared cache
+        is picked.
+        '''
+        full_ip = '127.0.0.1'
+        empty_ip = '192.168.0.1'
+
+        for ip, size in [(full_ip, 100), (empty_ip, 0)]:
+            status = ThreadStatus()
+            status.ip = ip
+            status.tid = 0
+            status.running = True
+            status.node_cache_size = size
+            status.node_cache_capacity = 100
+            self.policy.process_status(status)
+
+            anna_keys = StringSet()
+            anna_keys.keys.append('key1')
+            self.kvs_client.put(get_cache_ip_key(ip),
+                                LWWPairLattice(0,
+                                               anna_keys.SerializeToString()))
+
+        node_keys = StringSet()
+        node_keys.keys.extend(['key1', 'key2'])
+        self.kvs_client.put(get_node_cache_key(full_ip),
+                            LWWPairLattice(0, node_keys.SerializeToString()))
+
+        self.policy.update()
+
+        self.assertEqual(self.policy.key_locations['key2'], [full_ip])
+        self.assertEqual(sorted(self.policy.key_locations['key1']),
+                         [full_ip, empty_ip])
+
+        result = self.policy.pick_executor([CloudburstReference('key1',
+                                                                True)])
+        self.assertEqual(result, (empty_ip, 0))
+
     def test_update_function_locations(self):
         '''
         This test ensures that the update_function_locations method correctly
@@ -0,0 +1,152 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import unittest
+
+from cloudburst.server.scheduler.admission import (
+    AdmissionController,
+    TokenBucket
+)
+from cloudburst.server.scheduler.policy.default_policy import (
+    DefaultCloudburstSchedulerPolicy
+)
+from tests.mock import kvs_client, zmq_utils
+
+
+class TestAdmissionController(unittest.TestCase):
+    '''
+    Tests for the scheduler's admission controller, ensuring that calls are
+    rejected with a sensible retry-after hint when a DAG exceeds its rate
+    limit or the executors it runs on are saturated.
+    '''
+
+    def setUp(self):
+        self.kvs_client = kvs_client.MockAnnaClient()
+        self.ip = '127.0.0.1'
+
+        self.policy = DefaultCloudburstSchedulerPolicy(
+            zmq_utils.MockPusherCache(), self.kvs_client, self.ip,
+            policy='random', random_threshold=0)
+
+        self.policy.function_locations['fn'] = [(self.ip, 0), (self.ip, 1)]
+
+    def test_token_bucket(self):
+        '''
+        A token bucket should admit a burst, then admit requests at its rate,
+        and tell the caller how long to wait for the next token.
+        '''
+        bucket = TokenBucket(rate=10, burst=2, now=0)
+
+        self.assertEqual(bucket.take(0), 0)
+        self.assertEqual(bucket.take(0), 0)
+        self.assertAlmostEqual(bucket.take(0), 0.1)
+
+        # Half a token has accumulated after 50ms.
+        self.assertAlmostEqual(bucket.take(0.05), 0.05)
+        self.assertEqual(bucket.take(0.1), 0)
+
+    def test_rate_limit_per_dag(self):
+        '''
+        Each DAG should have its own token bucket, and DAGs without a rate
+        should not be limited.
+        '''
+        admission = AdmissionController(self.policy, rates={'dag': 1},
+                                         burst=1)
+
+        self.assertEqual(admission.admit('dag', ['fn'], now=0), 0)
+        self.assertGreater(admission.admit('dag', ['fn'], now=0), 0)
+        self.assertEqual(admission.admit('other', ['fn'], now=0), 0)
+        self.assertEqual(admission.admit('dag', ['fn'], now=1), 0)
+
+        self.assertEqual(admission.rejected, 1)
+
+    def test_saturated_executors(self):
+        '''
+        A call should only be rejected once every executor for one of its
+        functions has reached the backlog limit, and the hint should grow with
+        the backlog.
+        '''
+        admission = AdmissionController(self.policy, max_backlog=10)
+
+        self.policy.backlogs[(self.ip, 0)] = 10
+        self.assertEqual(admission.admit('dag', ['fn'], now=0), 0)
+
+        self.policy.backlogs[(self.ip, 1)] = 10
+        retry_after = admission.admit('dag', ['fn'], now=0)
+        self.assertGreater(retry_after, 0)
+
+        self.policy.backlogs[(self.ip, 1)] = 20
+        self.policy.backlogs[(self.ip, 0)] = 20
+        self.assertGreater(admission.admit('dag', ['fn'], now=0), retry_after)
+
+        # Functions without known locations are left to the policy engine.
+        self.assertEqual(admission.admit('dag', ['unknown'], now=0), 0)
+
+    def test_saturated_cluster(self):
+        '''
+        A call should be rejected when the backlog of the whole cluster
+        reaches the global limit, even if its own executors have room.
+        '''
+        admission = AdmissionController(self.policy, max_total_backlog=15)
+
+        self.policy.backlogs[(self.ip, 2)] = 10
+        self.assertEqual(admission.admit('dag', ['fn'], now=0), 0)
+
+        self.policy.backlogs[(self.ip, 3)] = 10
+        self.assertGreater(admission.admit('dag', ['fn'], now=0), 0)
+
+    def test_backlog_rejection_keeps_tokens(self):
+        '''
+        Calls rejected because of the backlog should not use up the DAG's
+        tokens.
+        '''
+        admission = AdmissionController(self.policy, rate=1, burst=1,
+                                        max_backlog=10)
+
+        self.policy.backlogs[(self.ip, 0)] = 10
+        self.policy.backlogs[(self.ip, 1)] = 10
+        self.assertGreater(admission.admit('dag', ['fn'], now=0), 0)
+
+        self.policy.backlogs.clear()
+        self.assertEqual(admission.admit('dag', ['fn'], now=0), 0)
+
+    def test_fair_share_under_contention(self):
+        '''
+        While a call's executors are contended, a tenant that has been
+        admitted more than its weighted share of calls should be rejected,
+        while other tenants are still admitted.
+        '''
+        admission = AdmissionController(self.policy, max_backlog=10,
+                                        weights={'heavy': 2})
+
+        for _ in range(10):
+            self.assertEqual(admission.admit('flood', ['fn'], now=0), 0)
+        admission.admit('light', ['fn'], now=0)
+        admission.admit('heavy', ['fn'], now=0)
+
+        # Without contention, every tenant is admitted.
+        self.assertEqual(admission.admit('flood', ['fn'], now=0), 0)
+
+        self.policy.backlogs[(self.ip, 0)] = 5
+        self.policy.backlogs[(self.ip, 1)] = 5
+        self.assertGreater(admission.admit('flood', ['fn'], now=0), 0)
+        self.assertEqual(admission.admit('light', ['fn'], now=0), 0)
+        self.assertEqual(admission.admit('other', ['fn'], now=0), 0)
+
+        # A tenant's calls can be admitted under another name.
+        self.assertEqual(admission.admit('flood', ['fn'], now=0,
+                                         tenant='heavy'), 0)
+
+        # Once its usage decays, the flooding tenant is admitted again.
+        self.assertEqual(admission.admit('flood', ['fn'], now=10), 0)
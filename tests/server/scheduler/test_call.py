@@ -14,10 +14,17 @@
 
 import unittest
 
-from cloudburst.server.scheduler.call import call_function, call_dag
+from cloudburst.server.scheduler.admission import AdmissionController
+from cloudburst.server.scheduler.call import (
+    call_dag,
+    call_function,
+    receive_dag_call,
+    reroute_request
+)
 from cloudburst.server.scheduler.policy.default_policy import (
     DefaultCloudburstSchedulerPolicy
 )
+from cloudburst.server.scheduler.singleflight import InflightCalls
 from cloudburst.server.scheduler import utils
 from cloudburst.server import utils as sutils
 from cloudburst.shared.proto.cloudburst_pb2 import (
@@ -30,9 +37,20 @@ from cloudburst.shared.proto.cloudburst_pb2 import (
     NO_RESOURCES,  # Cloudburst's error types
     NORMAL  # Cloudburst's consistency modes
 )
-from cloudburst.shared.proto.internal_pb2 import ThreadStatus
+from cloudburst.shared.proto.internal_pb2 import (
+    ScheduleHandoff,
+    ThreadStatus
+)
 from cloudburst.shared.reference import CloudburstReference
 from cloudburst.shared.serializer import Serializer
+from cloudburst.shared.utils import (
+    DEADLINE_LOCATION,
+    PRIORITY_LOCATION,
+    QOS_ARGS,
+    RETRY_AFTER_PREFIX,
+    TENANT_LOCATION,
+    WEIGHT_LOCATION
+)
 from tests.mock import kvs_client, zmq_utils
 
 serializer = Serializer()
@@ -50,16 +68,13 @@ class TestSchedulerCall(unittest.TestCase):
     def setUp(self):
         self.pusher_cache = zmq_utils.MockPusherCache()
         self.socket = zmq_utils.MockZmqSocket()
-        self.pin_socket = zmq_utils.MockZmqSocket()
 
         self.kvs_client = kvs_client.MockAnnaClient()
         self.ip = '127.0.0.1'
 
-        self.policy = DefaultCloudburstSchedulerPolicy(self.pin_socket,
-                                                       self.pusher_cache,
-                                                       self.kvs_client, self.ip,
-                                                       policy='random',
-                                                       random_threshold=0)
+        self.policy = DefaultCloudburstSchedulerPolicy(
+            self.pusher_cache, self.kvs_client, self.ip, policy='random',
+            random_threshold=0)
 
         # Add an executor to the policy engine by default.
         status = ThreadStatus()
@@ -192,6 +207,37 @@ class TestSchedulerCall(unittest.TestCase):
     DAG FUNCTION CALL TESTS
     '''
 
+    def test_call_function_coalesced(self):
+        '''
+        Tests that an identical call to a pure function that arrives while the
+        first one is in flight is given the first call's response key, and is
+        not forwarded to an executor.
+        '''
+        inflight = InflightCalls()
+        inflight.pure.add('function')
+
+        call = FunctionCall()
+        call.name = 'function'
+        serializer.dump(2, call.arguments.values.add())
+
+        for _ in range(2):
+            self.socket.inbox.append(call.SerializeToString())
+            call_function(self.socket, self.pusher_cache, self.policy,
+                          inflight=inflight)
+
+        self.assertEqual(len(self.pusher_cache.socket.outbox), 1)
+        self.assertEqual(len(self.socket.outbox), 2)
+
+        responses = []
+        for msg in self.socket.outbox:
+            response = GenericResponse()
+            response.ParseFromString(msg)
+            self.assertTrue(response.success)
+            responses.append(response.response_id)
+
+        self.assertEqual(responses[0], responses[1])
+        self.assertEqual(inflight.coalesced, 1)
+
     def test_dag_call_no_refs(self):
         '''
         Tests a DAG call without any references. We do not currently have a
@@ -249,6 +295,309 @@ class TestSchedulerCall(unittest.TestCase):
             self.pusher_cache.addresses[2], sutils.get_dag_trigger_address(
                 ':'.join(map(lambda s: str(s), source_address))))
 
+    def test_dag_call_deadline_and_priority(self):
+        '''
+        Tests that a DAG call's deadline, priority class, and tenant are copied
+        into every schedule, with the deadline relative to when the call was
+        scheduled, along with the tenant's weight.
+        '''
+        source = 'source'
+        sink = 'sink'
+        dag, _, _ = self._construct_dag_with_locations(source, sink)
+
+        call = DagCall()
+        call.name = dag.name
+        call.consistency = NORMAL
+        call.function_args[QOS_ARGS].values.extend(
+            [serializer.dump(0.5, serialize=False),
+             serializer.dump(2, serialize=False),
+             serializer.dump('tenant', serialize=False)])
+
+        call_dag(call, self.pusher_cache, {dag.name: (dag, {source})},
+                 self.policy, weight=2.0)
+
+        # The two schedules are sent before the trigger.
+        for msg in self.pusher_cache.socket.outbox[:2]:
+            schedule = DagSchedule()
+            schedule.ParseFromString(msg)
+
+            self.assertAlmostEqual(
+                float(schedule.locations[DEADLINE_LOCATION]),
+                schedule.start_time + 0.5)
+            self.assertEqual(schedule.locations[PRIORITY_LOCATION], '2')
+            self.assertEqual(schedule.locations[TENANT_LOCATION], 'tenant')
+            self.assertEqual(float(schedule.locations[WEIGHT_LOCATION]), 2.0)
+
+    def test_dag_call_hedged(self):
+        '''
+        Tests that a hedged function's schedule and triggers are sent to both
+        of its replicas, and that the result of a DAG that is returned
+        directly to the client is never hedged.
+        '''
+        source = 'source'
+        sink = 'sink'
+        dag, source_address, sink_address = self._construct_dag_with_locations(
+            source, sink)
+        source_backup = (self.ip, 3)
+        self.policy.function_locations[source].append(source_backup)
+        self.policy.function_locations[sink].append((self.ip, 4))
+
+        call = DagCall()
+        call.name = dag.name
+        call.consistency = NORMAL
+        call.response_address = 'tcp://127.0.0.1:9000'
+
+        call_dag(call, self.pusher_cache, {dag.name: (dag, {source})},
+                 self.policy, hedged=[source, sink])
+
+        # Two copies of the source's schedule, one of the sink's, and a
+        # trigger for each replica of the source.
+        self.assertEqual(len(self.pusher_cache.socket.outbox), 5)
+        addresses = self.pusher_cache.addresses
+        source_replicas = [source_address, source_backup]
+        self.assertEqual(set(addresses[:2]), set(
+            utils.get_queue_address(*loc) for loc in source_replicas))
+        self.assertEqual(set(addresses[3:]), set(
+            sutils.get_dag_trigger_address('%s:%d' % loc) for loc in
+            source_replicas))
+
+        schedule = DagSchedule()
+        schedule.ParseFromString(self.pusher_cache.socket.outbox[0])
+        self.assertEqual(
+            {schedule.locations[source],
+             sutils.get_hedge_location(schedule, source)},
+            set('%s:%d' % loc for loc in source_replicas))
+        self.assertEqual(sutils.get_hedge_location(schedule, sink), None)
+
+    def test_dag_call_fused(self):
+        '''
+        Tests that only the first function of a fused chain gets a schedule,
+        and that the functions fused after it are located with it.
+        '''
+        source = 'source'
+        sink = 'sink'
+        dag, source_address, _ = self._construct_dag_with_locations(source,
+                                                                   sink)
+        dag.colocated.extend([source, sink])
+        self.policy.function_locations[sink] = [source_address]
+
+        call = DagCall()
+        call.name = dag.name
+        call.consistency = NORMAL
+        call.function_args[sink].values.extend(
+            [serializer.dump(1, serialize=False)])
+
+        call_dag(call, self.pusher_cache, {dag.name: (dag, {source})},
+                 self.policy)
+
+        # One schedule and one trigger, both for the source.
+        self.assertEqual(len(self.pusher_cache.socket.outbox), 2)
+        self.assertEqual(self.pusher_cache.addresses[0],
+                         utils.get_queue_address(*source_address))
+
+        schedule = DagSchedule()
+        schedule.ParseFromString(self.pusher_cache.socket.outbox[0])
+        self.assertEqual(schedule.target_function, source)
+        self.assertEqual(schedule.locations[sink],
+                         schedule.locations[source])
+        self.assertEqual(len(schedule.arguments[sink].values), 1)
+
+    def test_dag_call_late_bound(self):
+        '''
+        Tests that in late-binding mode, a function with a single predecessor
+        is not given an executor or a schedule, and that its replicas are
+        passed along with their backlogs instead.
+        '''
+        source = 'source'
+        sink = 'sink'
+        dag, source_address, sink_address = \
+            self._construct_dag_with_locations(source, sink)
+        other_address = (self.ip, 3)
+        self.policy.function_locations[sink].append(other_address)
+        self.policy.backlogs[other_address] = 4
+
+        call = DagCall()
+        call.name = dag.name
+        call.consistency = NORMAL
+
+        response = call_dag(call, self.pusher_cache,
+                            {dag.name: (dag, {source})}, self.policy,
+                            late=True)
+        self.assertTrue(response.success)
+
+        # One schedule and one trigger, both for the source.
+        self.assertEqual(len(self.pusher_cache.socket.outbox), 2)
+        self.assertEqual(self.pusher_cache.addresses[0],
+                         utils.get_queue_address(*source_address))
+
+        schedule = DagSchedule()
+        schedule.ParseFromString(self.pusher_cache.socket.outbox[0])
+        self.assertEqual(schedule.target_function, source)
+        self.assertFalse(sink in schedule.locations)
+
+        candidates = sutils.get_candidates(schedule, sink)
+        self.assertEqual(candidates, [('%s:%d' % sink_address, 0),
+                                      ('%s:%d' % other_address, 4)])
+
+    def test_dag_call_rejected_when_saturated(self):
+        '''
+        Tests that a DAG call is rejected with a retry-after hint, without
+        scheduling anything, when every executor for one of its functions has
+        reached the backlog limit.
+        '''
+        source = 'source'
+        sink = 'sink'
+        dag, source_address, sink_address = self._construct_dag_with_locations(
+            source, sink)
+        dags = {dag.name: (dag, {source})}
+
+        self.policy.backlogs[sink_address] = 20
+        admission = AdmissionController(self.policy, max_backlog=10)
+
+        call = DagCall()
+        call.name = dag.name
+        call.consistency = NORMAL
+        self.socket.inbox.append(call.SerializeToString())
+
+        receive_dag_call(self.socket, self.pusher_cache, dags, self.policy,
+                         {source: 0, sink: 0}, {}, {}, admission)
+
+        self.assertEqual(len(self.pusher_cache.socket.outbox), 0)
+        self.assertEqual(len(self.socket.outbox), 1)
+
+        response = GenericResponse()
+        response.ParseFromString(self.socket.outbox[0])
+        self.assertFalse(response.success)
+        self.assertEqual(response.error, NO_RESOURCES)
+        self.assertTrue(response.response_id.startswith(RETRY_AFTER_PREFIX))
+
+        retry_after = float(response.response_id[len(RETRY_AFTER_PREFIX):])
+        self.assertGreater(retry_after, 0)
+        self.assertEqual(admission.rejected, 1)
+
+    def test_dag_call_coalesced(self):
+        '''
+        Tests that an identical call to a DAG of pure functions is attached to
+        the one in flight, even if its executors are saturated, and that a
+        call whose result is returned directly is never coalesced.
+        '''
+        source = 'source'
+        sink = 'sink'
+        dag, _, sink_address = self._construct_dag_with_locations(source,
+                                                                  sink)
+        dags = {dag.name: (dag, {source})}
+        call_frequency = {source: 0, sink: 0}
+
+        inflight = InflightCalls()
+        inflight.pure.update([source, sink])
+
+        call = DagCall()
+        call.name = dag.name
+        call.consistency = NORMAL
+        call.function_args[source].values.extend(
+            [serializer.dump(1, serialize=False)])
+
+        self.socket.inbox.append(call.SerializeToString())
+        receive_dag_call(self.socket, self.pusher_cache, dags, self.policy,
+                         call_frequency, {}, {}, inflight=inflight)
+
+        # Once the executors are saturated, the identical call is still
+        # answered, but without scheduling anything.
+        self.policy.backlogs[sink_address] = 20
+        admission = AdmissionController(self.policy, max_backlog=10)
+        self.socket.inbox.append(call.SerializeToString())
+        receive_dag_call(self.socket, self.pusher_cache, dags, self.policy,
+                         call_frequency, {}, {}, admission=admission,
+                         inflight=inflight)
+
+        self.assertEqual(len(self.pusher_cache.socket.outbox), 3)
+        self.assertEqual(call_frequency[source], 1)
+        self.assertEqual(inflight.coalesced, 1)
+
+        first = GenericResponse()
+        first.ParseFromString(self.socket.outbox[0])
+        second = GenericResponse()
+        second.ParseFromString(self.socket.outbox[1])
+        self.assertTrue(second.success)
+        self.assertEqual(first.response_id, second.response_id)
+
+        self.policy.backlogs.clear()
+        call.response_address = 'tcp://127.0.0.1:9000'
+        self.socket.inbox.append(call.SerializeToString())
+        receive_dag_call(self.socket, self.pusher_cache, dags, self.policy,
+                         call_frequency, {}, {}, inflight=inflight)
+
+        self.assertEqual(len(self.pusher_cache.socket.outbox), 6)
+        self.assertEqual(inflight.coalesced, 1)
+
+    def test_reroute_handed_off_request(self):
+        '''
+        Tests that a request handed off by a departing executor is sent to
+        another replica of the same function, along with its buffered
+        triggers, and that later triggers for the same request follow it.
+        '''
+        source = 'source'
+        sink = 'sink'
+        dag, _, sink_address = self._construct_dag_with_locations(source,
+                                                                  sink)
+
+        # Add a second replica of the sink function, which should receive the
+        # request once the original replica departs.
+        new_address = (self.ip, 3)
+        self.policy.function_locations[sink].append(new_address)
+
+        # Make sure the policy knows which function the departing executor had
+        # pinned, as it would have from that executor's status updates.
+        status = ThreadStatus()
+        status.ip, status.tid = sink_address
+        status.functions.append(sink)
+        status.running = True
+        self.policy.process_status(status)
+
+        schedule = DagSchedule()
+        schedule.id = 'id'
+        schedule.dag.CopyFrom(dag)
+        schedule.target_function = sink
+        schedule.triggers.append(source)
+        schedule.locations[sink] = ':'.join(map(str, sink_address))
+
+        trigger = DagTrigger()
+        trigger.id = schedule.id
+        trigger.source = source
+        trigger.target_function = sink
+
+        handoff = ScheduleHandoff()
+        handoff.status.CopyFrom(status)
+        handoff.status.ClearField('functions')
+        handoff.status.running = False
+        handoff.schedule = schedule.SerializeToString()
+        self.socket.inbox.append(handoff.SerializeToString())
+
+        rerouted = {}
+        reroute_request(self.socket, self.pusher_cache, self.policy, rerouted)
+
+        # The schedule should have been sent to the new replica, with its
+        # location updated.
+        new_location = ':'.join(map(str, new_address))
+        self.assertEqual(rerouted[(schedule.id, sink)][0], new_location)
+        self.assertEqual(len(self.pusher_cache.socket.outbox), 1)
+        self.assertEqual(self.pusher_cache.addresses[0],
+                         utils.get_queue_address(*new_address))
+
+        forwarded = DagSchedule()
+        forwarded.ParseFromString(self.pusher_cache.socket.outbox[0])
+        self.assertEqual(forwarded.locations[sink], new_location)
+
+        # A trigger that arrives at the departing executor later on should be
+        # forwarded without resending the schedule.
+        handoff.triggers.append(trigger.SerializeToString())
+        self.socket.inbox.append(handoff.SerializeToString())
+        reroute_request(self.socket, self.pusher_cache, self.policy, rerouted)
+
+        self.assertEqual(len(self.pusher_cache.socket.outbox), 2)
+        self.assertEqual(self.pusher_cache.addresses[1],
+                         sutils.get_dag_trigger_address(new_location))
+
     '''
     HELPER FUNCTIONS
     '''
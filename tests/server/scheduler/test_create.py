@@ -13,6 +13,7 @@
 #  limitations under the License.
 
 import random
+import time
 import unittest
 
 from anna.lattices import LWWPairLattice, SingleKeyCausalLattice
@@ -20,7 +21,10 @@ from anna.lattices import LWWPairLattice, SingleKeyCausalLattice
 from cloudburst.server.scheduler.create import (
     create_dag,
     create_function,
-    delete_dag
+    delete_dag,
+    expire_pin_requests,
+    receive_pin_response,
+    PIN_TIMEOUT
 )
 from cloudburst.server.scheduler.policy.default_policy import (
     DefaultCloudburstSchedulerPolicy
@@ -59,11 +63,24 @@ class TestSchedulerCreate(unittest.TestCase):
         self.kvs_client = kvs_client.MockAnnaClient()
         self.ip = '127.0.0.1'
 
-        self.policy = DefaultCloudburstSchedulerPolicy(self.pin_socket,
-                                                       self.pusher_cache,
-                                                       self.kvs_client, self.ip,
-                                                       policy='random',
-                                                       random_threshold=0)
+        self.policy = DefaultCloudburstSchedulerPolicy(
+            self.pusher_cache, self.kvs_client, self.ip, policy='random',
+            random_threshold=0)
+
+    def respond_to_pin(self, index, creation, dags, call_frequency,
+                       success=True):
+        '''
+        Answers the pin request at the given index of the outbox and passes the
+        response on to the scheduler, returning the updated DAG creation.
+        '''
+        pin_msg = PinFunction()
+        pin_msg.ParseFromString(self.pusher_cache.socket.outbox[index])
+
+        response = GenericResponse(success=success, response_id=pin_msg.id)
+        self.pin_socket.inbox.append(response.SerializeToString())
+
+        return receive_pin_response(self.pin_socket, creation, self.socket,
+                                    dags, self.policy, call_frequency)
 
     '''
     INDIVIDUAL FUNCTION CREATION TESTS
@@ -146,15 +163,24 @@ class TestSchedulerCreate(unittest.TestCase):
         address_set = {(self.ip, 1), (self.ip, 2)}
         self.policy.unpinned_cpu_executors.update(address_set)
 
-        # Prepopulate the pin_accept socket with sufficient success messages.
-        self.pin_socket.inbox.append(sutils.ok_resp)
-        self.pin_socket.inbox.append(sutils.ok_resp)
-
-        # Call the DAG creation method.
+        # Call the DAG creation method, which should send both pin requests
+        # right away without waiting for responses.
         dags = {}
         call_frequency = {}
-        create_dag(self.socket, self.pusher_cache, self.kvs_client, dags,
-                   self.policy, call_frequency)
+        creation = create_dag(self.socket, self.pusher_cache, self.kvs_client,
+                              dags, self.policy, call_frequency)
+        self.assertEqual(creation.outstanding, 2)
+        self.assertEqual(len(self.pusher_cache.socket.outbox), 2)
+
+        # Accept the pin requests; the DAG should only be committed once both
+        # have been accepted.
+        creation = self.respond_to_pin(1, creation, dags, call_frequency)
+        self.assertEqual(creation.outstanding, 1)
+        self.assertEqual(len(self.socket.outbox), 0)
+        self.assertEqual(len(dags), 0)
+
+        creation = self.respond_to_pin(0, creation, dags, call_frequency)
+        self.assertEqual(creation, None)
 
         # Test that the correct metadata was created.
         self.assertTrue(dag_name in dags)
@@ -205,6 +231,50 @@ class TestSchedulerCreate(unittest.TestCase):
         self.assertEqual(len(self.policy.function_locations[source]), 1)
         self.assertEqual(len(self.policy.function_locations[sink]), 1)
 
+    def test_create_fused_dag(self):
+        '''
+        Tests that a chain of colocated functions is pinned as one unit, and
+        that the functions fused after the first one are located wherever it
+        is once the DAG is committed. A function that is not colocated is
+        pinned on its own.
+        '''
+        fnames = ['first', 'second', 'third', 'last']
+        dag = create_linear_dag([None] * 4, fnames, self.kvs_client, 'dag')
+        dag.colocated.extend(fnames[:3])
+        self.socket.inbox.append(dag.SerializeToString())
+
+        self.policy.unpinned_cpu_executors.update({(self.ip, 1),
+                                                   (self.ip, 2)})
+
+        dags = {}
+        call_frequency = {}
+        creation = create_dag(self.socket, self.pusher_cache, self.kvs_client,
+                              dags, self.policy, call_frequency)
+        self.assertEqual(creation.outstanding, 2)
+        self.assertEqual(len(self.pusher_cache.socket.outbox), 2)
+
+        pins = {}
+        for message in self.pusher_cache.socket.outbox:
+            pin_msg = PinFunction()
+            pin_msg.ParseFromString(message)
+            pins[pin_msg.name] = list(pin_msg.fused)
+
+        self.assertEqual(pins, {'first': ['second', 'third'], 'last': []})
+
+        creation = self.respond_to_pin(0, creation, dags, call_frequency)
+        creation = self.respond_to_pin(1, creation, dags, call_frequency)
+        self.assertEqual(creation, None)
+        self.assertTrue('dag' in dags)
+
+        locations = self.policy.function_locations
+        self.assertEqual(len(locations['first']), 1)
+        self.assertEqual(locations['second'], locations['first'])
+        self.assertEqual(locations['third'], locations['first'])
+        self.assertEqual(len(locations['last']), 1)
+
+        # Every function still counts its own calls.
+        self.assertEqual(set(call_frequency.keys()), set(fnames))
+
     def test_create_dag_already_exists(self):
         '''
         This test attempts to create a DAG that already exists and makes sure
@@ -266,14 +336,12 @@ class TestSchedulerCreate(unittest.TestCase):
         address_set = {(self.ip, 1)}
         self.policy.unpinned_cpu_executors.update(address_set)
 
-        # Prepopulate the pin_accept socket with sufficient success messages.
-        self.pin_socket.inbox.append(sutils.ok_resp)
-
         # Attempt to create the DAG.
         dags = {}
         call_frequency = {}
-        create_dag(self.socket, self.pusher_cache, self.kvs_client, dags,
-                   self.policy, call_frequency)
+        creation = create_dag(self.socket, self.pusher_cache, self.kvs_client,
+                              dags, self.policy, call_frequency)
+        self.assertEqual(creation, None)
 
         # Check that an error was returned to the user.
         self.assertEqual(len(self.socket.outbox), 1)
@@ -282,6 +350,10 @@ class TestSchedulerCreate(unittest.TestCase):
         self.assertFalse(response.success)
         self.assertEqual(response.error, NO_RESOURCES)
 
+        # The executor accepts the pin request after the DAG was discarded, so
+        # the function should be unpinned.
+        self.respond_to_pin(0, creation, dags, call_frequency)
+
         # Test that the correct pin messages were sent.
         self.assertEqual(len(self.pusher_cache.socket.outbox), 2)
         messages = self.pusher_cache.socket.outbox
@@ -304,11 +376,58 @@ class TestSchedulerCreate(unittest.TestCase):
         self.assertEqual(len(self.policy.unpinned_cpu_executors), 0)
         self.assertEqual(len(self.policy.function_locations), 0)
         self.assertEqual(len(self.policy.pending_dags), 0)
+        self.assertEqual(len(self.policy.pending_pins), 0)
 
         # Check that no additional metadata was created or sent.
         self.assertEqual(len(call_frequency), 0)
         self.assertEqual(len(dags), 0)
 
+    def test_create_dag_pin_retries(self):
+        '''
+        This test checks that rejected and timed out pin requests are retried
+        on other executors, and that the DAG is discarded once there are no
+        executors left to try.
+        '''
+        dag = create_linear_dag([None], ['fn'], self.kvs_client, 'dag')
+        self.socket.inbox.append(dag.SerializeToString())
+
+        address_set = {(self.ip, 1), (self.ip, 2), (self.ip, 3)}
+        self.policy.unpinned_cpu_executors.update(address_set)
+
+        dags = {}
+        call_frequency = {}
+        creation = create_dag(self.socket, self.pusher_cache, self.kvs_client,
+                              dags, self.policy, call_frequency)
+
+        # A rejected pin request is sent to another executor.
+        creation = self.respond_to_pin(0, creation, dags, call_frequency,
+                                       success=False)
+        self.assertEqual(len(self.pusher_cache.socket.outbox), 2)
+        self.assertEqual(creation.outstanding, 1)
+
+        # So is one that is not answered in time.
+        creation = expire_pin_requests(creation, self.socket, self.policy,
+                                       now=time.time() + PIN_TIMEOUT + 1)
+        self.assertEqual(len(self.pusher_cache.socket.outbox), 3)
+        self.assertEqual(len(self.policy.unpinned_cpu_executors), 0)
+
+        # Once the last executor times out too, the DAG is discarded.
+        creation = expire_pin_requests(creation, self.socket, self.policy,
+                                       now=time.time() + PIN_TIMEOUT + 1)
+        self.assertEqual(creation, None)
+
+        self.assertEqual(len(self.socket.outbox), 1)
+        response = GenericResponse()
+        response.ParseFromString(self.socket.outbox[0])
+        self.assertFalse(response.success)
+        self.assertEqual(response.error, NO_RESOURCES)
+
+        self.assertEqual(len(self.pusher_cache.addresses), 3)
+        self.assertEqual(set(self.pusher_cache.addresses),
+                         set(map(lambda a: get_pin_address(*a), address_set)))
+        self.assertEqual(len(self.policy.pending_dags), 0)
+        self.assertEqual(len(dags), 0)
+
     def test_delete_dag(self):
         '''
         We attempt to delete a DAG that has already been created and check to
@@ -395,8 +514,9 @@ class TestSchedulerCreate(unittest.TestCase):
         dags = {}
         call_frequency = {}
 
-        create_dag(self.socket, self.pusher_cache, self.kvs_client, dags,
-                   self.policy, call_frequency)
+        creation = create_dag(self.socket, self.pusher_cache, self.kvs_client,
+                              dags, self.policy, call_frequency)
+        self.assertEqual(creation, None)
 
         # Check that an error was returned to the user.
         self.assertEqual(len(self.socket.outbox), 1)
@@ -433,10 +553,10 @@ class TestSchedulerCreate(unittest.TestCase):
         address_set = {(self.ip, 1)}
         self.policy.unpinned_gpu_executors.update(address_set)
 
-        self.pin_socket.inbox.append(sutils.ok_resp)
-
-        create_dag(self.socket, self.pusher_cache, self.kvs_client, dags,
-                   self.policy, call_frequency)
+        creation = create_dag(self.socket, self.pusher_cache, self.kvs_client,
+                              dags, self.policy, call_frequency)
+        creation = self.respond_to_pin(0, creation, dags, call_frequency)
+        self.assertEqual(creation, None)
 
         # Test that the correct metadata was created.
         self.assertTrue(dag_name in dags)
@@ -0,0 +1,156 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import unittest
+
+from cloudburst.server.scheduler.gossip import SchedulerGossip
+from cloudburst.shared.proto.cloudburst_pb2 import Dag
+
+
+class TestSchedulerGossip(unittest.TestCase):
+    '''
+    Tests for the metadata gossip between schedulers, ensuring that each
+    scheduler is only sent the changes it has not acknowledged, that a
+    scheduler that missed updates catches up, and that DAGs learned from peers
+    are not sent on.
+    '''
+
+    def setUp(self):
+        self.first = SchedulerGossip('first', '10.0.0.1')
+        self.second = SchedulerGossip('second', '10.0.0.2')
+
+    def test_only_changes_are_sent(self):
+        '''
+        Once a peer acknowledges an update, only later changes should be sent
+        to it, and nothing should be sent if nothing changed.
+        '''
+        dags = {'dag': (self._create_dag('dag'), None)}
+        self.first.record(dags, {'square': [('10.0.0.3', 0)]})
+
+        status = self.first.build(self.second.ip)
+        self.assertEqual(list(status.dags), ['dag'])
+        self.assertEqual(len(status.function_locations), 1)
+        self.assertTrue(self.second.receive(status))
+
+        # The second scheduler acknowledges the update.
+        ack = self.second.build(self.first.ip)
+        self.assertEqual(ack.acked_version, status.version)
+        self.assertFalse(self.first.receive(ack))
+        self.assertEqual(self.first.build(self.second.ip), None)
+
+        dags['other'] = (self._create_dag('other'), None)
+        del dags['dag']
+        self.first.record(dags, {'square': [('10.0.0.3', 0)]})
+
+        status = self.first.build(self.second.ip)
+        self.assertEqual(list(status.dags), ['other'])
+        self.assertEqual(list(status.removed_dags), ['dag'])
+        self.assertEqual(len(status.function_locations), 0)
+
+    def test_missed_update_is_resent(self):
+        '''
+        A peer that receives an update without the changes before it should
+        skip it and acknowledge what it has, so that everything is re-sent.
+        '''
+        self.first.record({'dag': (self._create_dag('dag'), None)}, {})
+        status = self.first.build(self.second.ip)
+        self.first.peer_acked[self.second.ip] = status.version
+
+        self.first.record({'dag': (self._create_dag('dag'), None),
+                           'other': (self._create_dag('other'), None)}, {})
+        status = self.first.build(self.second.ip)
+        self.assertFalse(self.second.receive(status))
+
+        ack = self.second.build(self.first.ip)
+        self.assertEqual(ack.acked_version, 0)
+        self.first.receive(ack)
+
+        status = self.first.build(self.second.ip)
+        self.assertEqual(status.base_version, 0)
+        self.assertEqual(set(status.dags), {'dag', 'other'})
+        self.assertTrue(self.second.receive(status))
+
+    def test_learned_dags_are_not_sent_on(self):
+        '''
+        A scheduler should not send on a DAG it learned of from a peer, so
+        that a delayed copy of the DAG cannot bring it back after the peer that
+        registered it deleted it.
+        '''
+        third = SchedulerGossip('third', '10.0.0.3')
+        first_dags = {'dag': (self._create_dag('dag'), None)}
+        second_dags = {}
+        third_dags = {}
+
+        self.first.record(first_dags, {})
+        self._apply(self.second, second_dags,
+                    self.first.build(self.second.ip))
+        self._apply(third, third_dags, self.first.build(third.ip))
+        self.assertTrue('dag' in second_dags)
+        self.assertTrue('dag' in third_dags)
+
+        # The second scheduler has no changes of its own to send.
+        self.second.record(second_dags, {})
+        self.assertEqual(self.second.version, 0)
+        self.assertIsNone(self.second.build(third.ip))
+
+        # The first scheduler deletes the DAG, and the third one hears of the
+        # deletion before the second one's next update.
+        del first_dags['dag']
+        self.first.record(first_dags, {})
+        status = self.first.build(third.ip)
+        self.assertEqual(list(status.removed_dags), ['dag'])
+        self._apply(third, third_dags, status)
+        self.assertFalse('dag' in third_dags)
+
+        # So the second scheduler has no copy of the DAG to send it.
+        self.second.record(second_dags, {})
+        self.assertIsNone(self.second.build(third.ip))
+
+        self._apply(self.second, second_dags,
+                    self.first.build(self.second.ip))
+        self.assertFalse('dag' in second_dags)
+
+        # A DAG deleted through a scheduler that learned of it is deleted
+        # everywhere.
+        first_dags['other'] = (self._create_dag('other'), None)
+        self.first.record(first_dags, {})
+        self._apply(self.second, second_dags,
+                    self.first.build(self.second.ip))
+
+        del second_dags['other']
+        self.second.record(second_dags, {})
+        status = self.second.build(self.first.ip)
+        self.assertEqual(list(status.removed_dags), ['other'])
+        self._apply(self.first, first_dags, status)
+        self.assertFalse('other' in first_dags)
+
+    def _apply(self, gossip, dags, status):
+        # Applies an update the way the scheduler does.
+        if not gossip.receive(status):
+            return
+
+        gossip.learn(status)
+        for definition in status.dag_definitions:
+            dag = Dag()
+            dag.ParseFromString(definition)
+            if dag.name not in dags:
+                dags[dag.name] = (dag, None)
+
+        for name in status.removed_dags:
+            dags.pop(name, None)
+
+    def _create_dag(self, name):
+        dag = Dag()
+        dag.name = name
+        return dag
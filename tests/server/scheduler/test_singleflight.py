@@ -0,0 +1,125 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import unittest
+
+from cloudburst.server.scheduler.singleflight import InflightCalls
+from cloudburst.shared.proto.cloudburst_pb2 import (
+    Dag,
+    DagCall,
+    FunctionCall,
+    MULTI, NORMAL  # Cloudburst's consistency modes
+)
+from cloudburst.shared.reference import CloudburstReference
+from cloudburst.shared.serializer import Serializer
+from cloudburst.shared.utils import QOS_ARGS
+
+serializer = Serializer()
+
+
+class TestInflightCalls(unittest.TestCase):
+    '''
+    Tests for the scheduler's coalescing of identical calls to pure functions,
+    ensuring that only eligible calls are coalesced, and only while the first
+    call is in flight.
+    '''
+
+    def setUp(self):
+        self.inflight = InflightCalls(window=1.0)
+        self.inflight.pure.update(['fn', 'other'])
+
+    def test_function_digest(self):
+        '''
+        Calls should have the same digest only if they have the same name and
+        arguments, and calls to impure functions should have none.
+        '''
+        digest = self.inflight.function_digest(self._function_call('fn', 1))
+        self.assertIsNotNone(digest)
+        self.assertEqual(digest, self.inflight.function_digest(
+            self._function_call('fn', 1)))
+
+        self.assertNotEqual(digest, self.inflight.function_digest(
+            self._function_call('fn', 2)))
+        self.assertNotEqual(digest, self.inflight.function_digest(
+            self._function_call('other', 1)))
+
+        self.assertIsNone(self.inflight.function_digest(
+            self._function_call('impure', 1)))
+        self.assertIsNone(self.inflight.function_digest(
+            self._function_call('fn', CloudburstReference('key', True))))
+
+        call = self._function_call('fn', 1)
+        call.consistency = MULTI
+        self.assertIsNone(self.inflight.function_digest(call))
+
+    def test_dag_digest(self):
+        '''
+        A DAG call should only be coalesced if all of its functions are pure
+        and its result is stored in the KVS, and its QoS arguments should not
+        change its digest.
+        '''
+        dag = Dag()
+        dag.name = 'dag'
+        dag.functions.extend([Dag.FunctionReference(name='fn'),
+                              Dag.FunctionReference(name='other')])
+
+        call = DagCall()
+        call.name = dag.name
+        call.consistency = NORMAL
+        call.function_args['fn'].values.extend(
+            [serializer.dump(1, serialize=False)])
+        digest = self.inflight.dag_digest(call, dag)
+        self.assertIsNotNone(digest)
+
+        call.function_args[QOS_ARGS].values.extend(
+            [serializer.dump(0.5, serialize=False)])
+        self.assertEqual(digest, self.inflight.dag_digest(call, dag))
+
+        # Moving an argument to another function changes the call.
+        moved = DagCall()
+        moved.name = dag.name
+        moved.consistency = NORMAL
+        moved.function_args['other'].values.extend(
+            [serializer.dump(1, serialize=False)])
+        self.assertNotEqual(digest, self.inflight.dag_digest(moved, dag))
+
+        call.response_address = 'tcp://127.0.0.1:9000'
+        self.assertIsNone(self.inflight.dag_digest(call, dag))
+
+        dag.functions.extend([Dag.FunctionReference(name='impure')])
+        self.assertIsNone(self.inflight.dag_digest(moved, dag))
+
+    def test_attach_within_window(self):
+        '''
+        A call should be attached to an identical one only until the window
+        after that call was recorded has passed.
+        '''
+        self.assertIsNone(self.inflight.attach('a', now=0))
+        self.inflight.record('a', 'response-a', now=0)
+        self.inflight.record('b', 'response-b', now=0.5)
+
+        self.assertEqual(self.inflight.attach('a', now=0.9), 'response-a')
+        self.assertIsNone(self.inflight.attach('a', now=1.2))
+        self.assertEqual(self.inflight.attach('b', now=1.2), 'response-b')
+
+        self.assertEqual(self.inflight.coalesced, 2)
+        self.assertEqual(list(self.inflight.calls.keys()), ['b'])
+
+    def _function_call(self, name, arg):
+        call = FunctionCall()
+        call.name = name
+        call.consistency = NORMAL
+        serializer.dump(arg, call.arguments.values.add())
+
+        return call
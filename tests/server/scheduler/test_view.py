@@ -0,0 +1,98 @@
+#  Copyright 2019 U.C. Berkeley RISE Lab
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+
+import time
+import unittest
+
+from cloudburst.server.scheduler.policy.default_policy import (
+    DefaultCloudburstSchedulerPolicy
+)
+from cloudburst.server.scheduler.view import apply_view, build_view
+from cloudburst.shared.proto.internal_pb2 import SchedulerView
+from tests.mock import kvs_client, zmq_utils
+from tests.server.utils import create_linear_dag
+
+
+class TestSchedulerView(unittest.TestCase):
+    '''
+    Tests for the view of a scheduler's metadata that its main process sends
+    to its worker processes, ensuring that workers end up with the same DAGs
+    and routing metadata as the main process.
+    '''
+
+    def setUp(self):
+        self.kvs_client = kvs_client.MockAnnaClient()
+        self.ip = '127.0.0.1'
+
+        self.main = self._create_policy()
+        self.worker = self._create_policy()
+
+    def test_view_round_trip(self):
+        '''
+        Applying a view should replace all of a worker's routing metadata with
+        the main process's.
+        '''
+        dag = create_linear_dag([None, None], ['source', 'sink'],
+                                self.kvs_client, 'dag')
+        dags = {'dag': (dag, {'source'})}
+
+        self.main.function_locations = {'source': [(self.ip, 1)],
+                                        'sink': [(self.ip, 2), (self.ip, 0)]}
+        self.main.unpinned_cpu_executors = {(self.ip, 3)}
+        self.main.unpinned_gpu_executors = {(self.ip, 4)}
+        self.main.key_locations = {'key': [self.ip]}
+        self.main.backoff = {(self.ip, 2): time.time()}
+        self.main.node_cache_sizes = {self.ip: (100, 1000)}
+
+        # The worker knows of an executor that has since been pinned.
+        self.worker.unpinned_cpu_executors = {(self.ip, 1)}
+
+        view = SchedulerView()
+        view.ParseFromString(build_view(dags, self.main).SerializeToString())
+
+        worker_dags = {}
+        call_frequency = {}
+        apply_view(view, worker_dags, self.worker, call_frequency)
+
+        self.assertEqual(list(worker_dags.keys()), ['dag'])
+        self.assertEqual(worker_dags['dag'][0], dag)
+        self.assertEqual(worker_dags['dag'][1], {'source'})
+        self.assertEqual(call_frequency, {'source': 0, 'sink': 0})
+
+        self.assertEqual(self.worker.function_locations,
+                         self.main.function_locations)
+        self.assertEqual(self.worker.unpinned_cpu_executors, {(self.ip, 3)})
+        self.assertEqual(self.worker.unpinned_gpu_executors, {(self.ip, 4)})
+        self.assertEqual(self.worker.key_locations, {'key': [self.ip]})
+        self.assertEqual(set(self.worker.backoff.keys()), {(self.ip, 2)})
+        self.assertEqual(self.worker.node_cache_sizes, {self.ip: (100, 1000)})
+
+    def test_view_removes_dags(self):
+        '''
+        DAGs that the main process no longer knows of should be dropped, while
+        DAGs the worker already has are kept as they are.
+        '''
+        dag = create_linear_dag([None], ['fn'], self.kvs_client, 'dag')
+        old = create_linear_dag([None], ['old'], self.kvs_client, 'old')
+
+        worker_dags = {'dag': (dag, {'fn'}), 'old': (old, {'old'})}
+        view = build_view({'dag': (dag, {'fn'})}, self.main)
+
+        apply_view(view, worker_dags, self.worker, {})
+        self.assertEqual(list(worker_dags.keys()), ['dag'])
+
+    def _create_policy(self):
+        return DefaultCloudburstSchedulerPolicy(
+            zmq_utils.MockPusherCache(), self.kvs_client, self.ip,
+            policy='random', random_threshold=0)